@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Async capabilities client
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Fetch GetCapabilities documents with asyncio (httpx.AsyncClient)
+    and hand them to OWSLib for parsing, so that thousands of endpoints can
+    be in flight from one event loop. get_service(url) returns the same
+    OWSLib service object (WMS, WMTS or WFS) that the scrapers expect.
+Notes:
+- Uses Python 3.9
+- OWSLib only parses the fetched bytes (xml=...), it never fetches itself.
+  Parsing runs in a worker thread so that it does not block the event loop
+- At most config.ASYNC_HOST_CONNECTIONS requests to the same host are in
+  flight, so that operators with many endpoints on one server are not
+  flooded
+- Usage (check all sources, print one line per source):
+  python async_capabilities.py [sources.csv]
+"""
+
+import asyncio
+import csv
+import re
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+import configuration as config
+from scraper import get_version, parse_service
+
+
+class AsyncCapabilitiesClient:
+    """
+    Async client for the capabilities of OGC services. Use it as an async
+    context manager; it shares one connection pool for all requests.
+
+    Parameters:
+    max_connections (int): Maximum number of requests in flight.
+    timeout (float): Timeout of a request in seconds.
+    host_connections (int): Maximum number of requests in flight to the
+        same host.
+    """
+
+    def __init__(self, max_connections=None, timeout=None,
+                 host_connections=None):
+        self.max_connections = max_connections or config.ASYNC_MAX_CONNECTIONS
+        self.timeout = timeout or config.CAPABILITIES_TIMEOUT
+        self.host_connections = host_connections or \
+            config.ASYNC_HOST_CONNECTIONS
+        self.client = None
+        self.host_slots = defaultdict(lambda: asyncio.Semaphore(
+            self.host_connections))
+
+    async def __aenter__(self):
+        import httpx
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout, follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.max_connections))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        self.client = None
+
+    async def fetch(self, url):
+        """
+        Fetch a capabilities document, with at most host_connections
+        requests to the same host at a time.
+
+        Parameters:
+        url (str): GetCapabilities URL.
+
+        Returns:
+        bytes: The document.
+
+        Raises:
+        httpx.HTTPError: If the request failed or its status is not 200.
+        """
+        async with self.host_slots[urlparse(url).netloc]:
+            response = await self.client.get(url)
+        response.raise_for_status()
+        return response.content
+
+    async def get_service(self, url, version=None):
+        """
+        Fetch and parse the capabilities of a service.
+
+        Parameters:
+        url (str): GetCapabilities URL.
+        version (str, optional): Service version. By default the version of
+            the capabilities document.
+
+        Returns:
+        tuple: (service, service_type, children_possible) as returned by
+            scraper.parse_service.
+
+        Raises:
+        httpx.HTTPError: If the document could not be fetched.
+        ValueError: If it is no valid WMS, WMTS or WFS capabilities
+            document.
+        """
+        xml = await self.fetch(url)
+        service, service_type, children_possible = await asyncio.to_thread(
+            parse_document, url, xml, version)
+        if service_type is None:
+            raise ValueError(
+                "Service does not seem to be a valid WMS, WMTS or WFS")
+        return service, service_type, children_possible
+
+    async def get_services(self, urls):
+        """
+        Fetch and parse the capabilities of many services concurrently.
+
+        Parameters:
+        urls (list): GetCapabilities URLs.
+
+        Returns:
+        list: Per URL, the result of get_service or the exception raised.
+        """
+        return await asyncio.gather(*(self.get_service(url) for url in urls),
+                                    return_exceptions=True)
+
+
+def parse_document(url, xml, version=None):
+    """
+    Parse a capabilities document with OWSLib, without any network access.
+
+    Parameters:
+    url (str): GetCapabilities URL the document was fetched from.
+    xml (bytes): The document.
+    version (str, optional): Service version, by default the version of the
+        document.
+
+    Returns:
+    tuple: (service, service_type, children_possible), service and
+        service_type None if the document is no valid capabilities document.
+    """
+    if version is None:
+        try:
+            version = get_version(url, xml)
+        except Exception:
+            version = None
+        if version is not None and not re.match(r"^\d+\.\d+\.\d+$", version):
+            version = None
+    return parse_service(url, version, xml)
+
+
+async def get_service(url, version=None):
+    """
+    Fetch and parse the capabilities of a single service with a client of
+    its own. Use AsyncCapabilitiesClient to share connections between many
+    requests.
+
+    Parameters:
+    url (str): GetCapabilities URL.
+    version (str, optional): Service version.
+
+    Returns:
+    var: The OWSLib service object (WMS, WMTS or WFS).
+    """
+    async with AsyncCapabilitiesClient(max_connections=1) as client:
+        service, _, _ = await client.get_service(url, version)
+    return service
+
+
+async def check_sources(sources):
+    async with AsyncCapabilitiesClient() as client:
+        return await client.get_services([source['URL']
+                                          for source in sources])
+
+
+if __name__ == "__main__":
+    source_file = sys.argv[1] if len(sys.argv) > 1 else \
+        config.SOURCE_COLLECTION_CSV
+    with open(source_file, mode="r", encoding="utf8") as f:
+        sources = list(csv.DictReader(f, delimiter=",", quotechar='"',
+                                      lineterminator="\n"))
+    start = time.perf_counter()
+    results = asyncio.run(check_sources(sources))
+    for source, result in zip(sources, results):
+        if isinstance(result, Exception):
+            status = "failed: %s" % (str(result) or type(result).__name__)
+        else:
+            status = "%s, %s layers" % (result[1], len(result[0].contents))
+        print("%s > %s: %s" % (source['Description'], source['URL'], status))
+    print("%s sources in %.1f s" % (len(sources),
+                                    time.perf_counter() - start))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Benchmark layer table
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Compare the memory of the layer rows of a harvest held as a list of
+    dictionaries (csv.DictReader) and as a dictionary-encoded LayerTable
+    (layer_table.py), on a synthetic geoservices_CH.csv with about 100'000
+    layers in services of up to 2'000 layers.
+Notes:
+- Uses Python 3.9
+- Each store is loaded in a process of its own and reports the memory it
+  holds (tracemalloc), its peak RSS and the size of its pickle (what a
+  scraping worker process sends back)
+- Usage: python benchmark-layer-table.py [number of layers, e.g. 100000]
+"""
+
+import csv
+import json
+import os
+import pickle
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import configuration as config
+from layer_table import LayerTable
+
+LAYERS = 100000
+FIELDS = ["OWNER", "TITLE", "NAME", "MAPGEO", "TREE", "GROUP", "ABSTRACT",
+          "KEYWORDS", "LEGEND", "CONTACT", "SERVICELINK", "METADATA",
+          "UPDATE", "SERVICETYPE", "MAX_ZOOM", "CENTER_LAT", "CENTER_LON",
+          "BBOX"]
+WORDS = ["Wald", "Gewässer", "Strassen", "Lärm", "Gebäude", "Zonenplan",
+         "Naturgefahren", "Orthofoto", "Grundwasser", "Bauzonen"]
+
+
+def write_harvest(path, layers):
+    """
+    Write a synthetic geoservices_CH.csv: services of 50 to 2'000 layers,
+    with the repetition of a real harvest (owner, contact, service link,
+    MAPGEO prefix, tree) and unique titles, names, abstracts and legends.
+    """
+    random.seed(1)
+    with open(path, mode="w", encoding="utf8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, lineterminator="\n")
+        writer.writeheader()
+        n = 0
+        service = 0
+        while n < layers:
+            service += 1
+            owner = "KT_%s" % "ABCDEFGHIJKLMNOPQRSTUVWXYZ"[service % 26] * 2
+            link = "https://geodienste.%s.ch/ows/service_%s/wms" % (
+                owner.lower(), service)
+            title = "Geodienst %s %s" % (random.choice(WORDS), service)
+            contact = "Amt für Geoinformation %s, Abteilung Geodaten, " \
+                      "Postfach, 8090 Zürich, geoinformation@%s.ch" % (
+                          owner, owner.lower())
+            keywords = ", ".join(random.sample(WORDS, 4))
+            for k in range(min(random.randint(50, 2000), layers - n)):
+                group = "gruppe_%s" % (k // 25)
+                name = "%s.layer_%s" % (group, k)
+                center = (round(random.uniform(46, 47.5), 2),
+                          round(random.uniform(6, 10), 2))
+                writer.writerow({
+                    "OWNER": owner,
+                    "TITLE": "%s %s" % (random.choice(WORDS), k),
+                    "NAME": name,
+                    "MAPGEO": "%slayers=WMS||%s %s||%s?||%s||1.3.0&E=%s&N=%s"
+                              "&zoom=7" % (config.MAPGEO_PREFIX,
+                                           random.choice(WORDS), k, link,
+                                           name, 2600000 + service,
+                                           1200000 + service),
+                    "TREE": "%s/%s/%s" % (owner, title, group),
+                    "GROUP": group,
+                    "ABSTRACT": "Beschreibung der Ebene %s des Dienstes %s" %
+                                (k, service) if k % 2 else "",
+                    "KEYWORDS": keywords,
+                    "LEGEND": "%s?request=GetLegendGraphic&layer=%s&format="
+                              "image/png" % (link, name),
+                    "CONTACT": contact,
+                    "SERVICELINK": link,
+                    "METADATA": "https://www.geocat.ch/geonetwork/srv/ger/"
+                                "catalog.search#/metadata/%s-%s" % (service,
+                                                                    k // 25),
+                    "UPDATE": "",
+                    "SERVICETYPE": "WMS",
+                    "MAX_ZOOM": 7,
+                    "CENTER_LAT": center[0],
+                    "CENTER_LON": center[1],
+                    "BBOX": "%s %s %s %s" % (center[1] - 0.1, center[0] - 0.1,
+                                             center[1] + 0.1,
+                                             center[0] + 0.1)})
+                n += 1
+
+
+def measure(store, path, trace):
+    # Runs in a process of its own, prints the figures as JSON. tracemalloc
+    # inflates the RSS, so the memory held and the peak RSS are measured in
+    # separate runs
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if store == "dicts":
+        with open(path, mode="r", encoding="utf8") as f:
+            rows = list(csv.DictReader(f, delimiter=",", quotechar='"',
+                                       lineterminator="\n"))
+    else:
+        rows = LayerTable.read_csv(path)
+    seconds = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0] if trace else None
+    tracemalloc.stop()
+    start = time.perf_counter()
+    checksum = sum(len(row["MAPGEO"]) + len(row["CONTACT"]) for row in rows)
+    scan = time.perf_counter() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({
+        "rows": len(rows), "held": held, "load": seconds, "scan": scan,
+        "pickle": len(pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)),
+        "checksum": checksum, "maxrss": maxrss}))
+
+
+def run(store, path):
+    results = []
+    for trace in ("", "trace"):
+        results.append(json.loads(subprocess.run(
+            [sys.executable, __file__, "--measure", store, path, trace],
+            capture_output=True, check=True, text=True).stdout))
+    result = results[0]
+    result["held"] = results[1]["held"]
+    return result
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3], sys.argv[4] == "trace")
+        sys.exit(0)
+    layers = int(sys.argv[1]) if len(sys.argv) > 1 else LAYERS
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "geoservices_CH.csv")
+        write_harvest(path, layers)
+        print("%s layers, %.1f MB CSV" % (layers,
+                                          os.path.getsize(path) / 1e6))
+        baseline = json.loads(subprocess.run(
+            [sys.executable, "-c", "import resource, json; print(json.dumps("
+             "resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))"],
+            capture_output=True, check=True, text=True).stdout)
+        results = {store: run(store, path) for store in ("dicts", "table")}
+    if results["dicts"]["checksum"] != results["table"]["checksum"]:
+        print("Stores disagree")
+        sys.exit(1)
+    for store, result in results.items():
+        print("%-6s held %6.1f MB, peak RSS %6.1f MB, pickle %6.1f MB, "
+              "load %.2f s, scan %.2f s" % (
+                  store, result["held"] / 1e6,
+                  (result["maxrss"] - baseline) / 1e6, result["pickle"] / 1e6,
+                  result["load"], result["scan"]))
+    print("%.1fx less memory held, %.1fx lower peak RSS" % (
+        results["dicts"]["held"] / results["table"]["held"],
+        (results["dicts"]["maxrss"] - baseline) /
+        (results["table"]["maxrss"] - baseline)))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Benchmark layer tree
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Benchmark the layer tree traversal of get_service_info
+    (scraper.walk_layer_tree) against the former traversal, on a synthetic
+    WMS 1.3.0 capabilities document with about 10'000 layers nested 6 deep.
+Notes:
+- Uses Python 3.9
+- Only the traversal is timed: scraping a layer is replaced by collecting
+  (layer, TREE, GROUP), and no GetMap requests are sent
+- Usage: python benchmark-layer-tree.py [fan-out per level, e.g. 5,4,4,4,5,5]
+"""
+
+import sys
+import time
+from owslib.wms import WebMapService
+from scraper import walk_layer_tree
+
+FAN_OUT = (5, 4, 4, 4, 5, 5)
+
+
+def capabilities_document(fan_out):
+    """
+    Build a WMS 1.3.0 capabilities document with an unnamed top layer and
+    fan_out[k] named child layers per layer on level k.
+
+    Parameters:
+    fan_out (tuple): Number of children per level.
+
+    Returns:
+    tuple: (document as bytes, number of named layers)
+    """
+    parts = []
+    count = 0
+
+    def add_layers(prefix, level):
+        nonlocal count
+        if level == len(fan_out):
+            return
+        for n in range(fan_out[level]):
+            name = "%s.%s" % (prefix, n) if prefix else "l%s" % n
+            count += 1
+            parts.append("<Layer><Name>%s</Name><Title>Layer %s</Title>"
+                         "<EX_GeographicBoundingBox>"
+                         "<westBoundLongitude>6</westBoundLongitude>"
+                         "<eastBoundLongitude>10</eastBoundLongitude>"
+                         "<southBoundLatitude>46</southBoundLatitude>"
+                         "<northBoundLatitude>47</northBoundLatitude>"
+                         "</EX_GeographicBoundingBox>" % (name, name))
+            add_layers(name, level + 1)
+            parts.append("</Layer>")
+
+    add_layers("", 0)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<WMS_Capabilities version="1.3.0" '
+        'xmlns="http://www.opengis.net/wms" '
+        'xmlns:xlink="http://www.w3.org/1999/xlink">'
+        '<Service><Name>WMS</Name><Title>Benchmark</Title></Service>'
+        '<Capability><Request><GetMap><Format>image/png</Format><DCPType>'
+        '<HTTP><Get><OnlineResource xlink:href="http://localhost/wms?"/>'
+        '</Get></HTTP></DCPType></GetMap></Request>'
+        '<Exception><Format>XML</Format></Exception>'
+        '<Layer><Title>Top</Title>%s</Layer></Capability>'
+        '</WMS_Capabilities>' % "".join(parts))
+    return document.encode("utf-8"), count
+
+
+def former_traversal(service, prefix):
+    # The traversal of get_service_info before walk_layer_tree: a list of
+    # processed layers, one level of children per layer
+    rows = []
+    layers_done = []
+    for i in list(service.contents):
+        this_layer = service.contents[i].id
+        if this_layer not in layers_done:
+            rows.append((this_layer, "%s/%s" % (prefix, i.replace('"', '')),
+                         i))
+            layers_done.append(this_layer)
+            try:
+                number_children = len(service.contents[i].children)
+            except AttributeError:
+                number_children = 0
+            for j in range(number_children):
+                this_child_layer = service.contents[i]._children[j].id
+                if this_child_layer not in layers_done:
+                    rows.append((this_child_layer, "%s/%s" % (
+                        prefix, i.replace('"', '')), i))
+                    layers_done.append(this_child_layer)
+    return rows
+
+
+def tree_traversal(service, prefix):
+    rows = []
+    for layer_id, parent_id, parent_path in walk_layer_tree(service):
+        if parent_id is None:
+            rows.append((layer_id, "%s/%s" % (prefix, layer_id), layer_id))
+        else:
+            rows.append((layer_id, "%s/%s" % (prefix, parent_path),
+                         parent_id))
+    return rows
+
+
+if __name__ == "__main__":
+    fan_out = FAN_OUT
+    if len(sys.argv) > 1:
+        fan_out = tuple(int(n) for n in sys.argv[1].split(","))
+    document, count = capabilities_document(fan_out)
+    start = time.perf_counter()
+    service = WebMapService("http://localhost/wms", version="1.3.0",
+                            xml=document)
+    parse_time = time.perf_counter() - start
+    print("%s layers, %s levels, %.0f kB; OWSLib parsing %.2f s" % (
+        count, len(fan_out), len(document) / 1024, parse_time))
+
+    timings = {}
+    for label, traversal in (("former traversal", former_traversal),
+                             ("walk_layer_tree", tree_traversal)):
+        start = time.perf_counter()
+        rows = traversal(service, "Benchmark")
+        timings[label] = time.perf_counter() - start
+        print("%-17s %8.3f s, %s rows, %s distinct TREE paths" % (
+            label, timings[label], len(rows),
+            len({row[1] for row in rows})))
+    print("speed-up %.0fx" % (timings["former traversal"] /
+                              timings["walk_layer_tree"]))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Benchmark spatial index
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Benchmark the spatial index (spatial_index.py) against a scan of
+    the BBOX strings of geoservices_CH.csv, on a synthetic catalogue of
+    layers spread over Switzerland: a few cantonal-wide layers, many
+    municipal ones and layers with the fallback extent.
+Notes:
+- Uses Python 3.9
+- Times point and area queries that return the ids of the layers, the
+  lookup of the layer rows is not included
+- Usage: python benchmark-spatial-index.py [number of layers, e.g. 60000]
+"""
+
+import csv
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from spatial_index import (SWISS_BBOX, SpatialIndex, build_spatial_index,
+                           parse_bbox)
+
+LAYERS = 60000
+QUERIES = 2000
+
+
+def write_catalogue(path, layers):
+    # geoservices_CH.csv with the columns the index reads
+    rng = random.Random(1)
+    with open(path, mode="w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["OWNER", "TITLE", "NAME", "SERVICELINK",
+                         "SERVICETYPE", "BBOX"])
+        for n in range(layers):
+            if n % 20 == 0:
+                box = SWISS_BBOX
+            else:
+                # 1 in 50 covers a canton, the others a municipality
+                size = 0.5 if n % 50 == 1 else rng.uniform(0.01, 0.1)
+                x = rng.uniform(6.0, 10.4 - size)
+                y = rng.uniform(45.85, 47.75 - size)
+                box = (x, y, x + size, y + size)
+            writer.writerow(["KT_%s" % (n % 26), "Layer %s" % n,
+                             "layer%s" % n, "https://example.ch/wms", "WMS",
+                             " ".join(str(v) for v in box)])
+
+
+def scan(path, x, y):
+    # The lookup without index: parse every BBOX string
+    result = []
+    with open(path, mode="r", encoding="utf8") as f:
+        for n, row in enumerate(csv.DictReader(f)):
+            box, bbox_source = parse_bbox(row["BBOX"])
+            if bbox_source != "layer":
+                continue
+            xmin, ymin, xmax, ymax = box
+            if xmin <= x <= xmax and ymin <= y <= ymax:
+                result.append(n)
+    return result
+
+
+def timed(queries, function):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        function(*query)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6, max(times) * 1e6
+
+
+if __name__ == "__main__":
+    layers = int(sys.argv[1]) if len(sys.argv) > 1 else LAYERS
+    rng = random.Random(2)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_file = os.path.join(temp_dir, "geoservices_CH.csv")
+        db_file = os.path.join(temp_dir, "spatial_index.sqlite")
+        write_catalogue(csv_file, layers)
+        start = time.perf_counter()
+        counts = build_spatial_index(csv_file, db_file)
+        print("%s layers indexed in %.1f s: %s" % (
+            layers, time.perf_counter() - start, counts))
+
+        index = SpatialIndex(db_file)
+        points = [(rng.uniform(6.0, 10.4), rng.uniform(45.85, 47.75))
+                  for _ in range(QUERIES)]
+        areas = [(x, y, x + 0.02, y + 0.02) for x, y in points]
+        lv95_points = [(rng.uniform(2500000, 2830000),
+                        rng.uniform(1080000, 1290000))
+                       for _ in range(QUERIES)]
+        hits = statistics.mean(len(index.query(*p)) for p in points)
+        print("%.0f layers per point on average" % hits)
+        for label, queries, function in (
+                ("point WGS84", points, index.query),
+                ("point LV95", lv95_points,
+                 lambda x, y: index.query(x, y, crs="LV95")),
+                ("area covers", areas, index.query),
+                ("area intersects", areas,
+                 lambda *a: index.query(*a, mode="intersects"))):
+            median, worst = timed(queries, function)
+            print("%-16s median %6.0f us, max %6.0f us" % (label, median,
+                                                           worst))
+        start = time.perf_counter()
+        if sorted(scan(csv_file, *points[0])) != sorted(
+                index.query(*points[0])):
+            print("index and scan disagree")
+            sys.exit(1)
+        print("%-16s %6.0f us" % ("CSV scan", (time.perf_counter() - start)
+                                   * 1e6))
+        index.close()
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Catalogue database
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Keep the results of every scraper run in an embedded SQLite
+    database (config.CATALOGUE_DB): sources, services, layers, datasets,
+    owner statistics, operator errors and runs in normalised tables,
+    indexed on OWNER, SERVICELINK and NAME, with full-text search on TITLE,
+    ABSTRACT and KEYWORDS. Lookups and joins across runs are queries
+    instead of scans of the CSV files.
+Notes:
+- Uses Python 3.9
+- SQLite with FTS5, as bundled with Python
+- Layers are versioned: a layer that did not change since the previous run
+  keeps its row, only its last_run is updated; a changed layer gets a new
+  row. The layers of the latest run are in the view current_layers
+- Rows of geoservices_CH.csv that repeat a layer of the same service with
+  the same content (e.g. listed in several groups with equal TREE) are
+  stored once, so current_layers can hold fewer rows than the CSV file
+- The database is kept in config.CACHE_PATH, not in data/: it is not
+  published with the harvest
+- Datasets are those of the latest run, owner statistics and operator
+  errors are kept for every run
+- Usage (search the layers of the latest run):
+  python catalogue_db.py <search terms>
+"""
+
+import csv
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import configuration as config
+from search_index import tokenize
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    partial INTEGER NOT NULL,
+    sources INTEGER,
+    report TEXT
+);
+CREATE TABLE IF NOT EXISTS sources (
+    source_id INTEGER PRIMARY KEY,
+    operator TEXT NOT NULL,
+    url TEXT NOT NULL UNIQUE,
+    first_run INTEGER NOT NULL REFERENCES runs,
+    last_run INTEGER NOT NULL REFERENCES runs
+);
+CREATE INDEX IF NOT EXISTS sources_operator ON sources (operator);
+CREATE TABLE IF NOT EXISTS services (
+    service_id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    servicelink TEXT NOT NULL,
+    servicetype TEXT NOT NULL,
+    contact TEXT,
+    first_run INTEGER NOT NULL REFERENCES runs,
+    last_run INTEGER NOT NULL REFERENCES runs,
+    UNIQUE (owner, servicelink, servicetype)
+);
+CREATE INDEX IF NOT EXISTS services_servicelink ON services (servicelink);
+CREATE TABLE IF NOT EXISTS layers (
+    layer_id INTEGER PRIMARY KEY,
+    service_id INTEGER NOT NULL REFERENCES services,
+    name TEXT NOT NULL,
+    title TEXT,
+    abstract TEXT,
+    keywords TEXT,
+    mapgeo TEXT,
+    tree TEXT,
+    layer_group TEXT,
+    legend TEXT,
+    metadata TEXT,
+    updated TEXT,
+    max_zoom TEXT,
+    center_lat TEXT,
+    center_lon TEXT,
+    bbox TEXT,
+    digest TEXT NOT NULL,
+    first_run INTEGER NOT NULL REFERENCES runs,
+    last_run INTEGER NOT NULL REFERENCES runs,
+    UNIQUE (service_id, name, digest)
+);
+CREATE INDEX IF NOT EXISTS layers_name ON layers (name);
+CREATE INDEX IF NOT EXISTS layers_last_run ON layers (last_run);
+CREATE VIRTUAL TABLE IF NOT EXISTS layer_search USING fts5 (
+    title, abstract, keywords, content='layers', content_rowid='layer_id'
+);
+CREATE TABLE IF NOT EXISTS datasets (
+    owner TEXT NOT NULL,
+    title TEXT,
+    name TEXT,
+    mapgeo TEXT,
+    abstract TEXT,
+    keywords TEXT,
+    contact TEXT,
+    wms_getcap TEXT,
+    wmts_getcap TEXT,
+    wfs_getcap TEXT,
+    run_id INTEGER NOT NULL REFERENCES runs
+);
+CREATE INDEX IF NOT EXISTS datasets_owner ON datasets (owner);
+CREATE INDEX IF NOT EXISTS datasets_name ON datasets (name);
+CREATE TABLE IF NOT EXISTS owner_stats (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    owner TEXT NOT NULL,
+    field TEXT NOT NULL,
+    dataset_count INTEGER,
+    count INTEGER,
+    missing INTEGER,
+    PRIMARY KEY (run_id, owner, field)
+);
+CREATE INDEX IF NOT EXISTS owner_stats_owner ON owner_stats (owner);
+CREATE TABLE IF NOT EXISTS errors (
+    error_id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs,
+    timestamp TEXT,
+    operator TEXT,
+    url TEXT,
+    issue TEXT,
+    UNIQUE (timestamp, operator, url, issue)
+);
+CREATE INDEX IF NOT EXISTS errors_operator ON errors (operator);
+CREATE INDEX IF NOT EXISTS errors_url ON errors (url);
+CREATE VIEW IF NOT EXISTS current_layers AS
+    SELECT services.owner, services.servicelink, services.servicetype,
+           services.contact, layers.*
+    FROM layers JOIN services USING (service_id)
+    WHERE layers.last_run = (SELECT max(run_id) FROM runs);
+"""
+# Columns of geoservices_CH.csv and of the layers table
+LAYER_COLUMNS = [("NAME", "name"), ("TITLE", "title"),
+                 ("ABSTRACT", "abstract"), ("KEYWORDS", "keywords"),
+                 ("MAPGEO", "mapgeo"), ("TREE", "tree"),
+                 ("GROUP", "layer_group"), ("LEGEND", "legend"),
+                 ("METADATA", "metadata"), ("UPDATE", "updated"),
+                 ("MAX_ZOOM", "max_zoom"), ("CENTER_LAT", "center_lat"),
+                 ("CENTER_LON", "center_lon"), ("BBOX", "bbox")]
+DATASET_COLUMNS = ["OWNER", "TITLE", "NAME", "MAPGEO", "ABSTRACT", "KEYWORDS",
+                   "CONTACT", "WMSGetCap", "WMTSGetCap", "WFSGetCap"]
+STATS_FIELDS = ["KEYWORDS", "ABSTRACT", "CONTACT", "METADATA"]
+
+
+def read_csv(path):
+    with open(path, mode="r", encoding="utf8") as f:
+        yield from csv.DictReader(f, delimiter=",", quotechar='"',
+                                  lineterminator="\n")
+
+
+def connect(db_file):
+    """
+    Open the catalogue database, creating its tables if needed.
+
+    Parameters:
+    db_file (str): Path of the database.
+
+    Returns:
+    sqlite3.Connection: The connection.
+    """
+    if os.path.dirname(db_file):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+    connection = sqlite3.connect(db_file)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    connection.execute("PRAGMA user_version = %s" % SCHEMA_VERSION)
+    return connection
+
+
+def layer_digest(row):
+    # Digest of everything a layer row says, to tell changed layers apart
+    values = [row.get(column, "") for column, _ in LAYER_COLUMNS]
+    values += [row.get("OWNER", ""), row.get("SERVICELINK", ""),
+               row.get("SERVICETYPE", ""), row.get("CONTACT", "")]
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+def load_layers(connection, run_id, geoservices_csv):
+    """
+    Add the layers of a run: unchanged layers keep their row, changed and
+    new ones get a new row.
+
+    Returns:
+    tuple: (layer rows of the run, distinct layers of the run, new layer
+        rows)
+    """
+    services = {(row["owner"], row["servicelink"], row["servicetype"]):
+                row["service_id"] for row in connection.execute(
+                    "SELECT service_id, owner, servicelink, servicetype "
+                    "FROM services")}
+    seen = set()
+    count = 0
+    new_rows = 0
+    for row in read_csv(geoservices_csv):
+        key = (row["OWNER"], row["SERVICELINK"].strip(), row["SERVICETYPE"])
+        service_id = services.get(key)
+        if service_id is None:
+            service_id = connection.execute(
+                "INSERT INTO services (owner, servicelink, servicetype, "
+                "contact, first_run, last_run) VALUES (?, ?, ?, ?, ?, ?)",
+                key + (row["CONTACT"], run_id, run_id)).lastrowid
+            services[key] = service_id
+        elif service_id not in seen:
+            connection.execute(
+                "UPDATE services SET contact = ?, last_run = ? "
+                "WHERE service_id = ?", (row["CONTACT"], run_id, service_id))
+        seen.add(service_id)
+        digest = layer_digest(row)
+        cursor = connection.execute(
+            "UPDATE layers SET last_run = ? WHERE service_id = ? AND "
+            "name = ? AND digest = ?",
+            (run_id, service_id, row["NAME"], digest))
+        if cursor.rowcount == 0:
+            connection.execute(
+                "INSERT INTO layers (service_id, %s, digest, first_run, "
+                "last_run) VALUES (?, %s, ?, ?, ?)" % (
+                    ", ".join(column for _, column in LAYER_COLUMNS),
+                    ", ".join("?" for _ in LAYER_COLUMNS)),
+                [service_id] + [row[column] for column, _ in LAYER_COLUMNS] +
+                [digest, run_id, run_id])
+            new_rows += 1
+        count += 1
+    distinct = connection.execute(
+        "SELECT count(*) FROM layers WHERE last_run = ?",
+        (run_id,)).fetchone()[0]
+    return count, distinct, new_rows
+
+
+def load_owner_stats(connection, run_id, stats_csv):
+    for row in read_csv(stats_csv):
+        connection.executemany(
+            "INSERT OR REPLACE INTO owner_stats (run_id, owner, field, "
+            "dataset_count, count, missing) VALUES (?, ?, ?, ?, ?, ?)",
+            [(run_id, row["OWNER"], field, int(row["DATASET_COUNT"]),
+              int(row["%s_COUNT" % field]), int(row["%s_MISSING" % field]))
+             for field in STATS_FIELDS])
+
+
+def load_errors(connection, run_id, errors_path):
+    # The error logs of a partial run still hold the issues of earlier runs
+    # for the operators not harvested, those are kept with their first run
+    for error_log_file in sorted(glob.glob(os.path.join(errors_path,
+                                                        "*_errors.csv"))):
+        connection.executemany(
+            "INSERT OR IGNORE INTO errors (run_id, timestamp, operator, url, "
+            "issue) VALUES (?, ?, ?, ?, ?)",
+            [(run_id, row["Timestamp"], row["Operator"], row["URL"],
+              row["Issue"]) for row in read_csv(error_log_file)])
+
+
+def update_catalogue(db_file, run_report, sources, geoservices_csv=None,
+                     geodata_csv=None, stats_csv=None, errors_path=None):
+    """
+    Add a scraper run to the catalogue database, in one transaction.
+
+    Parameters:
+    db_file (str): Path of the database (config.CATALOGUE_DB).
+    run_report (dict): The run report, with "date", "partial" and
+        "sources".
+    sources (list): The source collection.
+    geoservices_csv, geodata_csv, stats_csv (str, optional): The layers,
+        datasets and owner statistics of the run, by default those of
+        configuration.py.
+    errors_path (str, optional): Directory of the operator error logs,
+        config.DEAD_SERVICES_PATH by default.
+
+    Returns:
+    dict: The run id, the layer rows of the CSV file ("rows"), the layers
+        stored for the run ("layers", without repeated rows, see Notes) and
+        the new layer rows, for the run report.
+    """
+    geoservices_csv = geoservices_csv or config.GEOSERVICES_CH_CSV
+    geodata_csv = geodata_csv or config.GEODATA_CH_CSV
+    stats_csv = stats_csv or config.GEOSERVICES_STATS_CH_CSV
+    errors_path = errors_path or config.DEAD_SERVICES_PATH
+    connection = connect(db_file)
+    try:
+        with connection:
+            run_id = connection.execute(
+                "INSERT INTO runs (date, partial, sources, report) "
+                "VALUES (?, ?, ?, ?)",
+                (run_report["date"], int(bool(run_report["partial"])),
+                 run_report["sources"], json.dumps(run_report))).lastrowid
+            for source in sources:
+                connection.execute(
+                    "INSERT INTO sources (operator, url, first_run, last_run) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET "
+                    "operator = excluded.operator, last_run = excluded.last_run",
+                    (source["Description"], source["URL"], run_id, run_id))
+            rows, layers, new_layers = load_layers(connection, run_id,
+                                                   geoservices_csv)
+            connection.execute("DELETE FROM datasets")
+            connection.executemany(
+                "INSERT INTO datasets (owner, title, name, mapgeo, abstract, "
+                "keywords, contact, wms_getcap, wmts_getcap, wfs_getcap, "
+                "run_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ([row[column] for column in DATASET_COLUMNS] + [run_id]
+                 for row in read_csv(geodata_csv)))
+            load_owner_stats(connection, run_id, stats_csv)
+            load_errors(connection, run_id, errors_path)
+            connection.execute(
+                "INSERT INTO layer_search (layer_search) VALUES ('rebuild')")
+        connection.execute("PRAGMA optimize")
+    finally:
+        connection.close()
+    return {"run_id": run_id, "rows": rows, "layers": layers,
+            "new_layers": new_layers}
+
+
+def search(connection, text, limit=20):
+    """
+    Full-text search of the layers of the latest run.
+
+    Parameters:
+    connection (sqlite3.Connection): The catalogue database.
+    text (str): Search words, e.g. "wald-grenze"; all of them must match.
+        They are split as search_index.tokenize does and quoted, so FTS5
+        operators and punctuation are taken literally.
+    limit (int): Maximum number of layers.
+
+    Returns:
+    list: The matching layers (sqlite3.Row), best match first.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return []
+    query = " ".join('"%s"' % token for token in sorted(tokens))
+    return connection.execute(
+        "SELECT current_layers.* FROM layer_search "
+        "JOIN current_layers ON current_layers.layer_id = layer_search.rowid "
+        "WHERE layer_search MATCH ? ORDER BY rank LIMIT ?",
+        (query, limit)).fetchall()
+
+
+if __name__ == "__main__":
+    connection = connect(config.CATALOGUE_DB)
+    for layer in search(connection, " ".join(sys.argv[1:])):
+        print("%s > %s: %s (%s)" % (layer["owner"], layer["servicelink"],
+                                    layer["title"], layer["name"]))
+    connection.close()
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Catalogue server
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Small read-only HTTP query API over the harvested catalogue, to be
+    self-hosted, so that tools find layers and datasets by owner, keyword or
+    service link without downloading and parsing the CSV files. Serves the
+    layers (geoservices_CH.csv) and datasets (geodata_CH.csv) from Arrow IPC
+    files that the server builds from the CSV files (write_table).
+Notes:
+- Uses Python 3.9
+- Usage: python catalogue_server.py [port], then e.g.
+  GET /layers?OWNER=KT_ZH&SERVICETYPE=WMS&q=wald&limit=20&offset=40
+  GET /datasets?q=gewaesser&fields=OWNER,TITLE,WMSGetCap
+  GET /tables
+  Any column is an exact-match filter (repeat it for several values), q
+  searches the words of TITLE, ABSTRACT, KEYWORDS, OWNER and NAME as the
+  search index of the catalogue page does (search_index.tokenize)
+- The Arrow files are uncompressed and memory-mapped: the operating system
+  pages the columns in as queries touch them, and all server threads share
+  them. They are working files in config.CATALOGUE_ARROW_PATH, built at
+  startup where missing or older than their CSV file, and not committed
+- Hot reload: a new harvest (a CSV file newer than its Arrow file) is
+  converted on the next request and replaces the Arrow file atomically;
+  that request opens the new file, requests in flight finish on the old one
+- Responses carry an ETag (version of the table and the query). A request
+  with a matching If-None-Match gets 304, and the last
+  config.CATALOGUE_CACHE_ENTRIES responses are kept in memory
+- python check-catalogue-server.py tests it against a local harvest
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+import configuration as config
+
+logger = logging.getLogger("Scraping log")
+
+# Table name -> (CSV file of the harvest, Arrow file)
+TABLES = {
+    "layers": (config.GEOSERVICES_CH_CSV,
+               os.path.join(config.CATALOGUE_ARROW_PATH, "layers.arrow")),
+    "datasets": (config.GEODATA_CH_CSV,
+                 os.path.join(config.CATALOGUE_ARROW_PATH, "datasets.arrow"))}
+# Column of the search tokens, not returned in responses
+SEARCH_COLUMN = "_SEARCH"
+
+
+def write_table(csv_file, arrow_file):
+    """
+    Write a CSV file of the harvest as an uncompressed Arrow IPC file, with
+    the search tokens of every row. The file is replaced atomically.
+
+    Parameters:
+    csv_file (str): geoservices_CH.csv or geodata_CH.csv.
+    arrow_file (str): The Arrow file.
+
+    Returns:
+    int: The number of rows.
+    """
+    import pyarrow as pa
+    from search_index import INDEXED_FIELDS, tokenize
+    digest = hashlib.sha1()
+    with open(csv_file, mode="rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    with open(csv_file, mode="r", encoding="utf8") as f:
+        reader = csv.DictReader(f, delimiter=",", quotechar='"',
+                                lineterminator="\n")
+        columns = {field: [] for field in reader.fieldnames}
+        search = []
+        for row in reader:
+            for field in reader.fieldnames:
+                columns[field].append(row[field])
+            tokens = set()
+            for field in INDEXED_FIELDS:
+                tokens |= tokenize(row.get(field))
+            # Leading blank: " wal" matches the tokens starting with "wal"
+            search.append(" " + " ".join(sorted(tokens)))
+    columns[SEARCH_COLUMN] = search
+    table = pa.table({name: pa.array(values, type=pa.string())
+                      for name, values in columns.items()})
+    # The version identifies the content, so that ETags stay valid across
+    # harvests that did not change the table
+    table = table.replace_schema_metadata(
+        {"version": digest.hexdigest()[:16]})
+    os.makedirs(os.path.dirname(arrow_file) or ".", exist_ok=True)
+    with pa.OSFile(arrow_file + ".tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(arrow_file + ".tmp", arrow_file)
+    return table.num_rows
+
+
+class CatalogueTable:
+    """
+    A memory-mapped Arrow file, rebuilt when its CSV file is newer and
+    reopened when it has been replaced.
+
+    Parameters:
+    csv_file (str): The CSV file of the harvest.
+    arrow_file (str): The Arrow file.
+    """
+
+    def __init__(self, csv_file, arrow_file):
+        self.csv_file = csv_file
+        self.arrow_file = arrow_file
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.file_id = None
+        self.table = None
+        self.version = None
+
+    def build(self):
+        """
+        Write the Arrow file if it is missing or older than the CSV file.
+        Without a CSV file, an existing Arrow file is kept.
+
+        Returns:
+        None
+        """
+        with self.build_lock:
+            try:
+                csv_time = os.stat(self.csv_file).st_mtime_ns
+            except OSError:
+                return
+            try:
+                if os.stat(self.arrow_file).st_mtime_ns > csv_time:
+                    return
+            except OSError:
+                pass
+            rows = write_table(self.csv_file, self.arrow_file)
+            logger.info("Catalogue server: built %s (%s rows)" % (
+                self.arrow_file, rows))
+        return
+
+    def current(self):
+        """
+        Returns:
+        tuple: (pyarrow.Table, version) of the file as it is now.
+
+        Raises:
+        OSError: If neither the Arrow nor the CSV file exist.
+        """
+        import pyarrow as pa
+        self.build()
+        stat = os.stat(self.arrow_file)
+        file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if file_id != self.file_id:
+                source = pa.memory_map(self.arrow_file, "r")
+                self.table = pa.ipc.open_file(source).read_all()
+                self.version = self.table.schema.metadata[
+                    b"version"].decode()
+                self.file_id = file_id
+                logger.info("Catalogue server: loaded %s (%s rows)" % (
+                    self.arrow_file, self.table.num_rows))
+            return self.table, self.version
+
+
+def query_table(table, parameters):
+    """
+    Filter, search and page a table.
+
+    Parameters:
+    table (pyarrow.Table): The table.
+    parameters (list): The query parameters, (name, value) pairs.
+
+    Returns:
+    dict: "total" (matching rows), "offset", "limit" and "rows".
+
+    Raises:
+    ValueError: If a parameter is invalid.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from search_index import tokenize
+    columns = [name for name in table.column_names if name != SEARCH_COLUMN]
+    filters = {}
+    terms = set()
+    offset = 0
+    limit = config.CATALOGUE_PAGE_SIZE
+    fields = columns
+    for name, value in parameters:
+        if name == "q":
+            terms |= tokenize(value)
+        elif name == "offset":
+            offset = int(value)
+        elif name == "limit":
+            limit = int(value)
+        elif name == "fields":
+            fields = [field for field in value.split(",") if field]
+            unknown = set(fields) - set(columns)
+            if unknown:
+                raise ValueError("Unknown fields %s" % ", ".join(
+                    sorted(unknown)))
+        elif name in columns:
+            filters.setdefault(name, []).append(value)
+        else:
+            raise ValueError("Unknown parameter %s" % name)
+    if offset < 0 or not 0 < limit <= config.CATALOGUE_MAX_PAGE_SIZE:
+        raise ValueError("offset must be >= 0 and limit 1 to %s" %
+                         config.CATALOGUE_MAX_PAGE_SIZE)
+
+    mask = None
+    for name, values in filters.items():
+        condition = pc.is_in(table[name],
+                             value_set=pa.array(values, type=pa.string()))
+        mask = condition if mask is None else pc.and_(mask, condition)
+    for term in sorted(terms):
+        condition = pc.match_substring(table[SEARCH_COLUMN], " " + term)
+        mask = condition if mask is None else pc.and_(mask, condition)
+    if mask is not None:
+        table = table.filter(mask)
+    page = table.slice(offset, limit).select(fields)
+    return {"total": table.num_rows, "offset": offset, "limit": limit,
+            "rows": page.to_pylist()}
+
+
+class ResponseCache:
+    """
+    The last responses, by ETag, thread-safe.
+
+    Parameters:
+    size (int): Number of responses kept.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.responses = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, etag):
+        with self.lock:
+            body = self.responses.get(etag)
+            if body is not None:
+                self.responses.move_to_end(etag)
+            return body
+
+    def put(self, etag, body):
+        with self.lock:
+            self.responses[etag] = body
+            self.responses.move_to_end(etag)
+            while len(self.responses) > self.size:
+                self.responses.popitem(last=False)
+
+
+def make_server(port, host="127.0.0.1", tables=None):
+    """
+    Create the HTTP server; call serve_forever() on it.
+
+    Parameters:
+    port (int): Port, 0 for any free port.
+    host (str): Interface to listen on.
+    tables (dict, optional): (CSV file, Arrow file) per table name, TABLES
+        by default.
+
+    Returns:
+    http.server.ThreadingHTTPServer: The server.
+    """
+    tables = {name: CatalogueTable(csv_file, arrow_file)
+              for name, (csv_file, arrow_file) in (tables or TABLES).items()}
+    # Build the missing and outdated Arrow files before the first request
+    for table in tables.values():
+        table.build()
+    cache = ResponseCache(config.CATALOGUE_CACHE_ENTRIES)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_body(self, status, body, etag=None):
+            self.send_response(status)
+            self.send_header("Content-Type",
+                             "application/json; charset=utf-8")
+            if etag is not None:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_body(self, status, message):
+            self.send_body(status, json.dumps({"error": message}).encode())
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            name = url.path.strip("/")
+            try:
+                if name == "tables":
+                    body = {}
+                    for table_name, table in tables.items():
+                        data, version = table.current()
+                        body[table_name] = {
+                            "rows": data.num_rows, "version": version,
+                            "columns": [c for c in data.column_names
+                                        if c != SEARCH_COLUMN]}
+                    self.send_body(200, json.dumps(body).encode())
+                    return
+                if name not in tables:
+                    self.send_error_body(404, "Unknown table %s" % name)
+                    return
+                data, version = tables[name].current()
+            except OSError as e:
+                self.send_error_body(503, "No harvest available: %s" % e)
+                return
+            parameters = parse_qsl(url.query, keep_blank_values=True)
+            etag = '"%s-%s"' % (version, hashlib.sha1(json.dumps(
+                [name, sorted(parameters)]).encode()).hexdigest()[:16])
+            if etag in [tag.strip() for tag in self.headers.get(
+                    "If-None-Match", "").split(",")]:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = cache.get(etag)
+            if body is None:
+                try:
+                    result = query_table(data, parameters)
+                except ValueError as e:
+                    self.send_error_body(400, str(e))
+                    return
+                body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+                cache.put(etag, body)
+            self.send_body(200, body, etag)
+
+        def log_message(self, format, *args):
+            logger.info("Catalogue server: " + format % args)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else \
+        config.CATALOGUE_SERVER_PORT
+    server = make_server(port)
+    print("Serving the catalogue on http://127.0.0.1:%s/tables" % port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Change detection
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Compare the layers of the current harvest (geoservices_CH.csv) with
+    the latest snapshot of the history (snapshot_store.py) and write the
+    layers that were added,
+    removed or modified as Parquet files, plus a summary per service
+    endpoint (OWNER, SERVICELINK) that alerts and downstream consumers can
+    use instead of the full files.
+Notes:
+- Uses Python 3.9
+- Rows are identified by a hashed key of OWNER, SERVICELINK and NAME. The
+  same layer can be listed more than once per endpoint (e.g. in several
+  groups); such rows are numbered in the order of TREE, GROUP and their
+  position in the file, so the key does not depend on the content
+- Runs entirely in DuckDB with a memory limit and COPY ... TO Parquet, so
+  memory use does not grow with the size of the harvest (DuckDB spills to
+  config.CHANGES_TEMP_DIR)
+- The previous state is the latest snapshot of the history, written by
+  full runs only; a partial run is compared with the last full run
+- Called by scraper.py after every run; can also be run on its own:
+  python change_detection.py
+"""
+
+import os
+from datetime import datetime
+import duckdb
+import configuration as config
+from operator_errors import cet
+
+ROW_KEY_COLUMNS = ["OWNER", "SERVICELINK", "NAME"]
+# Bookkeeping columns of the rows of the snapshot store
+STORE_COLUMNS = ["SNAPSHOT_DATE", "DELTA_OP", "ROW_KEY", "ROW_DIGEST"]
+ROW_ORDER_COLUMNS = ["TREE", "GROUP"]
+CHANGE_TABLES = ("added", "removed", "modified")
+
+
+def quote(column):
+    return '"%s"' % column.replace('"', '""')
+
+
+def hashed(columns):
+    """
+    Returns:
+    str: SQL expression of the MD5 hash of some columns. NULL and "" hash
+        alike, as the CSV files do not tell them apart.
+    """
+    return "md5(concat_ws(chr(31), %s))" % ", ".join(
+        "coalesce(CAST(%s AS VARCHAR), '')" % quote(column)
+        for column in columns)
+
+
+def connect(memory_limit=None, temp_directory=None):
+    """
+    Open an in-memory DuckDB database with a memory limit, spilling to disk
+    beyond it.
+
+    Parameters:
+    memory_limit (str, optional): E.g. "512MB".
+    temp_directory (str, optional): Directory DuckDB spills to.
+
+    Returns:
+    duckdb.DuckDBPyConnection: The connection.
+    """
+    con = duckdb.connect()
+    if memory_limit:
+        con.execute("SET memory_limit='%s'" % memory_limit)
+    if temp_directory:
+        os.makedirs(temp_directory, exist_ok=True)
+        con.execute("SET temp_directory='%s'" % temp_directory)
+    return con
+
+
+def create_keyed_view(con, name, source, columns):
+    """
+    Create a view of a layer table with its ROW_KEY and ROW_DIGEST (hash of
+    all compared columns).
+
+    Parameters:
+    con (duckdb.DuckDBPyConnection): The connection.
+    name (str): Name of the view.
+    source (str): SQL table expression of a CSV file, in file order, e.g.
+        read_csv_sql(...).
+    columns (list): The columns that are compared.
+
+    Returns:
+    None
+    """
+    order = [quote(c) for c in ROW_ORDER_COLUMNS if c in columns]
+    con.execute("""
+        CREATE VIEW %s AS
+        SELECT * EXCLUDE (ROW_POSITION, ROW_OCCURRENCE),
+            %s AS ROW_KEY
+        FROM (
+            SELECT *, %s AS ROW_DIGEST,
+                row_number() OVER (PARTITION BY %s ORDER BY %s) AS
+                    ROW_OCCURRENCE
+            FROM (SELECT *, row_number() OVER () AS ROW_POSITION FROM %s))
+        """ % (
+        name, hashed(ROW_KEY_COLUMNS + ["ROW_OCCURRENCE"]), hashed(columns),
+        ", ".join(quote(c) for c in ROW_KEY_COLUMNS),
+        ", ".join(order + ["ROW_POSITION"]), source))
+    return
+
+
+def read_csv_sql(csv_filename):
+    # All columns as text, exactly as written by the scraper
+    return "read_csv_auto('%s', header=true, all_varchar=true)" % \
+        csv_filename.replace("'", "''")
+
+
+def read_parquet_sql(parquet_filename):
+    return "read_parquet('%s')" % parquet_filename.replace("'", "''")
+
+
+def table_columns(con, source):
+    return [row[0] for row in con.execute(
+        "DESCRIBE SELECT * FROM %s" % source).fetchall()]
+
+
+def detect_changes(current_csv, previous_source, output_path, summary_file,
+                   memory_limit=None, temp_directory=None):
+    """
+    Compare the current harvest with a previous one.
+
+    Writes to output_path:
+    - geoservices_added_CH.parquet: rows of the current harvest only
+    - geoservices_removed_CH.parquet: rows of the previous harvest only
+    - geoservices_modified_CH.parquet: current rows whose content changed,
+      with CHANGED_FIELDS (comma-separated column names)
+    and to summary_file the number of added, removed and modified layers per
+    endpoint (OWNER, SERVICELINK), endpoints without changes omitted.
+
+    Parameters:
+    current_csv (str): The current harvest (config.GEOSERVICES_CH_CSV).
+    previous_source (str): SQL table expression of the previous harvest
+        with its ROW_KEY, e.g. the state of the snapshot store.
+    output_path (str): Directory of the Parquet change tables.
+    summary_file (str): Path of the CSV summary.
+    memory_limit (str, optional): DuckDB memory limit.
+    temp_directory (str, optional): Directory DuckDB spills to.
+
+    Returns:
+    dict: The number of added, removed and modified rows.
+    """
+    con = connect(memory_limit, temp_directory)
+    current_source = read_csv_sql(current_csv)
+    current_columns = table_columns(con, current_source)
+    previous_columns = [c for c in table_columns(con, previous_source)
+                        if c not in STORE_COLUMNS]
+    # Columns added or dropped between runs are not compared
+    columns = [c for c in current_columns if c in previous_columns]
+    create_keyed_view(con, "current_rows", current_source, columns)
+    con.execute("""
+        CREATE VIEW previous_rows AS
+        SELECT %s, %s AS ROW_DIGEST, ROW_KEY FROM %s""" % (
+        ", ".join(quote(c) for c in previous_columns), hashed(columns),
+        previous_source))
+
+    changed_fields = "concat_ws(',', %s)" % ", ".join(
+        "CASE WHEN coalesce(c.%s, '') <> coalesce(CAST(p.%s AS VARCHAR), "
+        "'') THEN '%s' END" % (quote(c), quote(c), c) for c in columns)
+    queries = {
+        "added": """
+            SELECT c.* FROM current_rows c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM previous_rows p WHERE p.ROW_KEY = c.ROW_KEY)""",
+        "removed": """
+            SELECT p.* FROM previous_rows p
+            WHERE NOT EXISTS (
+                SELECT 1 FROM current_rows c WHERE c.ROW_KEY = p.ROW_KEY)""",
+        "modified": """
+            SELECT c.*, %s AS CHANGED_FIELDS FROM current_rows c
+            JOIN previous_rows p ON c.ROW_KEY = p.ROW_KEY
+            WHERE c.ROW_DIGEST <> p.ROW_DIGEST""" % changed_fields}
+
+    os.makedirs(output_path, exist_ok=True)
+    counts = {}
+    for change, query in queries.items():
+        change_file = change_table_path(output_path, change)
+        con.execute("COPY (%s) TO '%s' (FORMAT PARQUET)" % (
+            query, change_file.replace("'", "''")))
+        counts[change] = con.execute(
+            "SELECT count(*) FROM %s" % read_parquet_sql(change_file)
+        ).fetchone()[0]
+
+    datestamp = datetime.now(cet()).strftime("%Y-%m-%d")
+    change_columns = ",\n".join(
+        "count(*) FILTER (WHERE CHANGE = '%s') AS %s" % (
+            change, change.upper()) for change in CHANGE_TABLES)
+    union = " UNION ALL ".join(
+        "SELECT OWNER, SERVICELINK, '%s' AS CHANGE FROM %s" % (
+            change, read_parquet_sql(change_table_path(output_path, change)))
+        for change in CHANGE_TABLES)
+    con.execute("""
+        COPY (
+            SELECT '%s' AS DATE, OWNER, SERVICELINK, %s
+            FROM (%s)
+            GROUP BY OWNER, SERVICELINK
+            ORDER BY OWNER, SERVICELINK)
+        TO '%s' (HEADER, DELIMITER ',')""" % (
+        datestamp, change_columns, union,
+        summary_file.replace("'", "''")))
+    con.close()
+    return counts
+
+
+def change_table_path(output_path, change):
+    """
+    Returns:
+    str: Path of the Parquet table of the added, removed or modified rows.
+    """
+    return os.path.join(output_path, "geoservices_%s_CH.parquet" % change)
+
+
+def update_changes(current_csv=config.GEOSERVICES_CH_CSV, store=None):
+    """
+    Detect the changes since the latest snapshot of the history. Call it
+    before the current harvest is added to the history.
+
+    Parameters:
+    current_csv (str): The current harvest.
+    store (SnapshotStore, optional): The history, snapshot_store.open_store()
+        by default.
+
+    Returns:
+    dict or None: The number of added, removed and modified rows, None if
+        the history is empty (first run).
+    """
+    import snapshot_store
+    store = store or snapshot_store.open_store()
+    dates = store.dates()
+    if not dates:
+        return None
+    return detect_changes(current_csv, "(%s)" % store.state_sql(dates[-1]),
+                          config.CHANGES_PATH,
+                          config.GEOSERVICES_CHANGES_CH_CSV,
+                          config.CHANGES_MEMORY_LIMIT,
+                          config.CHANGES_TEMP_DIR)
+
+
+if __name__ == "__main__":
+    counts = update_changes()
+    if counts is None:
+        print("No snapshot in %s to compare with" % config.HISTORY_PATH)
+    else:
+        print("Layers added: %(added)s, removed: %(removed)s, "
+              "modified: %(modified)s" % counts)
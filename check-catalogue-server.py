@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Check catalogue server
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Check the query API of catalogue_server.py against a synthetic
+    harvest on a local port: filtering, full-text search, paging, ETag
+    revalidation and hot reload of a new harvest. Fails (exit code 1) if a
+    check does not hold.
+Notes:
+- Uses Python 3.9
+- Runs entirely locally, in a temporary directory; the harvest files of the
+  repository are not touched
+- Usage: python check-catalogue-server.py [number of layers, e.g. 20000]
+"""
+
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from catalogue_server import make_server
+
+LAYERS = 20000
+FIELDS = ["OWNER", "TITLE", "NAME", "MAPGEO", "TREE", "GROUP", "ABSTRACT",
+          "KEYWORDS", "LEGEND", "CONTACT", "SERVICELINK", "METADATA",
+          "UPDATE", "SERVICETYPE", "MAX_ZOOM", "CENTER_LAT", "CENTER_LON",
+          "BBOX"]
+OWNERS = ["KT_AG", "KT_BE", "KT_FR", "KT_ZH", "Bund"]
+WORDS = ["Wald", "Gewässer", "Strassen", "Lärm", "Gebäude", "Zonenplan",
+         "Naturgefahren", "Orthofoto"]
+
+
+def write_harvest(path, layers):
+    # A geoservices_CH.csv with layers rows
+    with open(path, mode="w", encoding="utf8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, lineterminator="\n")
+        writer.writeheader()
+        for n in range(layers):
+            row = dict.fromkeys(FIELDS, "")
+            row.update({
+                "OWNER": OWNERS[n % len(OWNERS)],
+                "TITLE": "%s %s" % (WORDS[n % len(WORDS)], n),
+                "NAME": "layer.%s" % n,
+                "ABSTRACT": "Abstract of layer %s" % n,
+                "KEYWORDS": WORDS[(n // len(WORDS)) % len(WORDS)],
+                "SERVICELINK": "https://%s.example.ch/wms" %
+                               OWNERS[n % len(OWNERS)].lower(),
+                "SERVICETYPE": "WMS" if n % 3 else "WFS"})
+            writer.writerow(row)
+
+
+def get(url, etag=None):
+    """
+    Returns:
+    tuple: (status, ETag, JSON body or None)
+    """
+    request = urllib.request.Request(url)
+    if etag is not None:
+        request.add_header("If-None-Match", etag)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return (response.status, response.headers.get("ETag"),
+                    json.loads(response.read()))
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get("ETag"), None
+
+
+def expected(layers, owner=None, word=None, service_type=None):
+    # Number of synthetic layers matching the filters
+    count = 0
+    for n in range(layers):
+        if owner is not None and OWNERS[n % len(OWNERS)] != owner:
+            continue
+        if service_type is not None and \
+                ("WMS" if n % 3 else "WFS") != service_type:
+            continue
+        if word is not None and word not in (
+                WORDS[n % len(WORDS)], WORDS[(n // len(WORDS)) % len(WORDS)]):
+            continue
+        count += 1
+    return count
+
+
+def check(base, csv_file, layers):
+    failures = []
+    status, _, body = get(base + "/tables")
+    if status != 200 or body["layers"]["rows"] != layers:
+        failures.append("tables not listed")
+
+    status, _, body = get(base + "/layers?OWNER=KT_ZH&SERVICETYPE=WFS")
+    if status != 200 or body["total"] != expected(layers, "KT_ZH", None,
+                                                  "WFS"):
+        failures.append("filter returns %s layers" % (body or {}).get(
+            "total"))
+
+    # "gewasser" finds "Gewässer", a search for the prefix "gebaud" as well
+    for query, word in (("gewasser", "Gewässer"), ("Gebaud", "Gebäude")):
+        status, _, body = get(base + "/layers?q=%s&OWNER=KT_BE" % query)
+        if status != 200 or body["total"] != expected(layers, "KT_BE", word):
+            failures.append("search %s returns %s layers" % (
+                query, (body or {}).get("total")))
+
+    status, _, first = get(base + "/layers?limit=7&fields=NAME")
+    status, _, second = get(base + "/layers?limit=7&offset=7&fields=NAME")
+    names = [row["NAME"] for row in first["rows"] + second["rows"]]
+    if names != ["layer.%s" % n for n in range(14)] or \
+            set(first["rows"][0]) != {"NAME"}:
+        failures.append("paging or field selection wrong")
+
+    status, etag, _ = get(base + "/layers?q=wald")
+    status, _, body = get(base + "/layers?q=wald", etag)
+    if etag is None or status != 304:
+        failures.append("no 304 for a matching ETag (%s)" % status)
+
+    status, _, _ = get(base + "/layers?unknown=1")
+    if status != 400:
+        failures.append("unknown parameter not rejected (%s)" % status)
+
+    # A new harvest lands while the server is running
+    write_harvest(csv_file, layers + 100)
+    status, new_etag, body = get(base + "/layers?q=wald", etag)
+    if status != 200 or new_etag == etag or body["total"] != expected(
+            layers + 100, None, "Wald"):
+        failures.append("new harvest not reloaded")
+
+    start = time.perf_counter()
+    for n in range(100):
+        get(base + "/layers?q=strassen+%s&limit=5" % n)
+    print("100 uncached searches in %.2f s" % (time.perf_counter() - start))
+    return failures
+
+
+if __name__ == "__main__":
+    layers = int(sys.argv[1]) if len(sys.argv) > 1 else LAYERS
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_file = os.path.join(temp_dir, "geoservices_CH.csv")
+        arrow_file = os.path.join(temp_dir, "layers.arrow")
+        write_harvest(csv_file, layers)
+        server = make_server(0, tables={"layers": (csv_file, arrow_file)})
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            failures = check("http://127.0.0.1:%s" % server.server_port,
+                             csv_file, layers)
+        finally:
+            server.shutdown()
+            server.server_close()
+    print("%s layers: %s" % (layers, "OK" if not failures
+                             else "; ".join(failures)))
+    sys.exit(1 if failures else 0)
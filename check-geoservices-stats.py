@@ -72,6 +72,22 @@ if __name__ == "__main__":
 
     if len(df) > 0:
         print("\nFound significant changes")
+        # Name the endpoints of these owners whose layers changed since the
+        # previous run (see change_detection.py)
+        changed_endpoints = ""
+        if os.path.isfile(config.GEOSERVICES_CHANGES_CH_CSV):
+            endpoints = duckdb.sql(
+                """SELECT OWNER, SERVICELINK, ADDED, REMOVED, MODIFIED
+                FROM read_csv_auto('%s', header=true)
+                WHERE OWNER IN (%s)
+                ORDER BY REMOVED DESC, OWNER, SERVICELINK""" % (
+                    config.GEOSERVICES_CHANGES_CH_CSV,
+                    ", ".join("'%s'" % owner.replace("'", "''")
+                              for owner in df["Owner"]))).fetchall()
+            changed_endpoints = "\n".join(
+                "%s %s: %s added, %s removed, %s modified" % endpoint
+                for endpoint in endpoints)
+            print(changed_endpoints)
         # We have at least one "suspicious" entry
         try:
             print("\nSending e-mail")
@@ -93,6 +109,9 @@ if __name__ == "__main__":
                 This might mean that some data owners have changed endpoints of their geoservices. 
                 Check the geoservice availability change statistics at https://github.com/rastrau/geoservice_harvester_poc/blob/main/data/geoservices_changestats_CH.csv.
                 """
+                if changed_endpoints:
+                    message += ("\nEndpoints with changed layers since the "
+                                "previous run:\n%s\n" % changed_endpoints)
 
                 server.sendmail(user_name,
                                 config.GEOSERVICES_CHANGESTATS_ALERT_RECIPIENTS,
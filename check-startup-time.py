@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Check startup time
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Import-time benchmark for scraper.py and the default scraper. Fails
+    (exit code 1) if importing them takes longer than
+    config.STARTUP_IMPORT_BUDGET_MS, so that heavy imports (OWSLib, pyproj,
+    the Google API client) stay deferred to their first use.
+Notes:
+- Uses Python 3.9
+- Every measurement runs in a fresh interpreter; the best of
+  config.STARTUP_IMPORT_RUNS runs is compared with the budget
+- Lists the modules with the highest cumulative import time
+"""
+
+import subprocess
+import sys
+import configuration as config
+
+MEASURE = """
+import sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+import scraper
+import default
+print((time.perf_counter() - start) * 1000)
+""" % config.SOURCE_SCRAPER_DIR
+
+
+def measure_import_ms():
+    """
+    Import scraper and the default scraper in a fresh interpreter.
+
+    Returns:
+    float: The import time in milliseconds.
+    """
+    output = subprocess.run([sys.executable, "-c", MEASURE], check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(count=10):
+    """
+    Run "python -X importtime" on the scraper imports.
+
+    Parameters:
+    count (int): Number of modules to return.
+
+    Returns:
+    list: (cumulative milliseconds, module) of the slowest imports.
+    """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             MEASURE], check=True, capture_output=True,
+                            text=True).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        timings.append((int(cumulative) / 1000, module.rstrip()))
+    return sorted(timings, reverse=True)[:count]
+
+
+if __name__ == "__main__":
+    timings = [measure_import_ms() for _ in range(config.STARTUP_IMPORT_RUNS)]
+    best = min(timings)
+    print("Import of scraper and default scraper: %.0f ms (best of %s), "
+          "budget %s ms\n" % (best, len(timings),
+                              config.STARTUP_IMPORT_BUDGET_MS))
+    print("Slowest imports (cumulative):")
+    for milliseconds, module in slowest_imports():
+        print("%8.1f ms %s" % (milliseconds, module))
+
+    if best > config.STARTUP_IMPORT_BUDGET_MS:
+        print("\nStartup budget exceeded")
+        sys.exit(1)
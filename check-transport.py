@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Check transport
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Check the capabilities transport (http_transport.py) against local
+    test servers, over HTTP/1.1 and over HTTP/2: the documents arrive
+    complete and decompressed, compression is requested, and HTTP/2
+    multiplexes all requests over one connection. Fails (exit code 1) if a
+    check does not hold.
+Notes:
+- Uses Python 3.9
+- The HTTP/2 server speaks cleartext HTTP/2 (h2c, prior knowledge) with the
+  h2 package; the harvester negotiates HTTP/2 on https via ALPN instead
+- Prints the transport statistics of both runs, as in the run report
+"""
+
+import gzip
+import http.server
+import json
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import h2.config
+import h2.connection
+import h2.events
+from http_transport import CapabilitiesTransport, get_brotli
+
+REQUESTS = 40
+
+
+def capabilities_document(layers=500):
+    # WMS 1.3.0 capabilities with a flat list of layers
+    parts = ["<Layer><Name>layer%s</Name><Title>Layer %s</Title></Layer>" %
+             (n, n) for n in range(layers)]
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<WMS_Capabilities version="1.3.0" '
+        'xmlns="http://www.opengis.net/wms">'
+        '<Service><Name>WMS</Name><Title>Check</Title></Service>'
+        '<Capability><Layer><Title>Top</Title>%s</Layer></Capability>'
+        '</WMS_Capabilities>' % "".join(parts)).encode("utf-8")
+
+
+DOCUMENT = capabilities_document()
+
+
+def encode_body(accept_encoding):
+    """
+    Compress the document the way the client accepts.
+
+    Parameters:
+    accept_encoding (str): The Accept-Encoding request header.
+
+    Returns:
+    tuple: (Content-Encoding or None, body)
+    """
+    accepted = [e.split(";")[0].strip() for e in accept_encoding.split(",")]
+    if "br" in accepted and get_brotli() is not None:
+        return "br", get_brotli().compress(DOCUMENT)
+    if "gzip" in accepted:
+        return "gzip", gzip.compress(DOCUMENT)
+    return None, DOCUMENT
+
+
+class TestServer:
+    # Base of the test servers: counts connections, records Accept-Encoding
+    def __init__(self):
+        self.connections = 0
+        self.accept_encodings = set()
+        self.lock = threading.Lock()
+
+    def connected(self):
+        with self.lock:
+            self.connections += 1
+
+    def requested(self, accept_encoding):
+        with self.lock:
+            self.accept_encodings.add(accept_encoding)
+
+
+class Http1Server(TestServer):
+    def __init__(self):
+        super().__init__()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                server.connected()
+
+            def do_GET(self):
+                accept_encoding = self.headers.get("Accept-Encoding", "")
+                server.requested(accept_encoding)
+                encoding, body = encode_body(accept_encoding)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml")
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                     Handler)
+        self.url = "http://127.0.0.1:%s/wms" % self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Http2Server(TestServer):
+    def __init__(self):
+        super().__init__()
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.url = "http://127.0.0.1:%s/wms" % self.sock.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connected()
+            threading.Thread(target=self.serve, args=(connection,),
+                             daemon=True).start()
+
+    def serve(self, connection):
+        conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False,
+                                             header_encoding="utf-8"))
+        conn.initiate_connection()
+        connection.sendall(conn.data_to_send())
+        pending = {}
+        with connection:
+            while True:
+                data = connection.recv(65535)
+                if not data:
+                    return
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        headers = dict(event.headers)
+                        accept_encoding = headers.get("accept-encoding", "")
+                        self.requested(accept_encoding)
+                        encoding, body = encode_body(accept_encoding)
+                        response_headers = [
+                            (":status", "200"),
+                            ("content-type", "text/xml"),
+                            ("content-length", str(len(body)))]
+                        if encoding:
+                            response_headers.append(("content-encoding",
+                                                     encoding))
+                        conn.send_headers(event.stream_id, response_headers)
+                        pending[event.stream_id] = body
+                self.send_pending(conn, pending)
+                connection.sendall(conn.data_to_send())
+
+    @staticmethod
+    def send_pending(conn, pending):
+        # Send as much of the response bodies as flow control allows
+        for stream_id in list(pending):
+            body = pending[stream_id]
+            while body:
+                size = min(conn.local_flow_control_window(stream_id),
+                           conn.max_outbound_frame_size, len(body))
+                if size <= 0:
+                    break
+                conn.send_data(stream_id, body[:size])
+                body = body[size:]
+            if body:
+                pending[stream_id] = body
+            else:
+                conn.end_stream(stream_id)
+                del pending[stream_id]
+
+    def close(self):
+        self.sock.close()
+
+
+def check(protocol, server, http2_prior_knowledge=False):
+    """
+    Fetch the document of a test server REQUESTS times concurrently.
+
+    Parameters:
+    protocol (str): "http1.1" or "http2".
+    server (TestServer): The test server.
+    http2_prior_knowledge (bool): Speak HTTP/2 without negotiation.
+
+    Returns:
+    tuple: (list of failed checks, transport statistics)
+    """
+    failures = []
+    with CapabilitiesTransport(protocol, timeout=10,
+                               http2_prior_knowledge=http2_prior_knowledge
+                               ) as transport:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(transport.get, [server.url] * REQUESTS))
+        report = transport.report()
+    expected_version = "HTTP/2" if protocol == "http2" else "HTTP/1.1"
+    if any(r.status_code != 200 or r.content != DOCUMENT for r in responses):
+        failures.append("documents incomplete or not decompressed")
+    if any(r.http_version != expected_version for r in responses):
+        failures.append("not all responses over %s" % expected_version)
+    if not all("gzip" in accept for accept in server.accept_encodings):
+        failures.append("compression not requested")
+    if report["wire_bytes"] >= report["content_bytes"]:
+        failures.append("responses not compressed on the wire")
+    if protocol == "http2" and server.connections != 1:
+        failures.append("%s connections instead of one multiplexed "
+                        "connection" % server.connections)
+    return failures, report
+
+
+if __name__ == "__main__":
+    all_failures = []
+    for protocol, server_class in (("http1.1", Http1Server),
+                                   ("http2", Http2Server)):
+        server = server_class()
+        try:
+            failures, report = check(
+                protocol, server, http2_prior_knowledge=protocol == "http2")
+        finally:
+            server.close()
+        print("%s: %s requests over %s connection(s), %s" % (
+            protocol, REQUESTS, server.connections,
+            "OK" if not failures else "; ".join(failures)))
+        print(json.dumps(report, indent=1, sort_keys=True))
+        all_failures += failures
+    sys.exit(1 if all_failures else 0)
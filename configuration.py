@@ -25,3 +25,140 @@ MAPGEO_PREFIX = \
 # Google Indexing API
 JSON_KEY_FILE = "geoharvester-indexing-credentials.json"
 SCOPES = ["https://www.googleapis.com/auth/indexing"]
+
+# Harvest pipeline: threads fetching GetCapabilities documents (I/O stage),
+# processes parsing and scraping them (CPU stage, 0 runs it inline, e.g. for
+# debugging) and the number of fetched documents that may wait for a parser
+FETCH_WORKERS = 8
+PARSE_WORKERS = os.cpu_count() or 1
+PIPELINE_QUEUE_SIZE = 32
+CAPABILITIES_TIMEOUT = 60
+
+# Negative-result cache: a source failing in FAILURE_BACKOFF_AFTER runs in a
+# row is skipped for 2, 4, ... (at most FAILURE_BACKOFF_MAX_RUNS) runs
+FAILURE_HISTORY_FILE = os.path.join("tools", "failure_history.json")
+FAILURE_BACKOFF_AFTER = 3
+FAILURE_BACKOFF_MAX_RUNS = 8
+
+# Connect timeout (seconds) of the capabilities requests, dead hosts fail
+# after it instead of holding up the run
+CONNECT_TIMEOUT = 1
+
+# Timeouts learned per host from its latency percentiles across runs
+# (harvest_state.HostLatency): LATENCY_TIMEOUT_FACTOR times the p99 latency,
+# within the (min, max) caps in seconds. Hosts without enough history get
+# CONNECT_TIMEOUT, CAPABILITIES_TIMEOUT and one retry. Hosts with more than
+# LATENCY_MAX_TIMEOUT_SHARE of their responses timed out get no retries and
+# at most CAPABILITIES_TIMEOUT; all attempts of a request (connect and read
+# timeouts times the attempts) stay within REQUEST_TIME_BUDGET seconds
+HOST_LATENCY_FILE = os.path.join("tools", "host_latency.json")
+LATENCY_TIMEOUT_FACTOR = 3
+CONNECT_TIMEOUT_CAP = (1, 10)
+READ_TIMEOUT_CAP = (5, 120)
+MAX_RETRIES = 2
+LATENCY_MAX_TIMEOUT_SHARE = 0.05
+REQUEST_TIME_BUDGET = 150
+
+# Protocol (WMS, WMTS, WFS) and version that last worked per source, tried
+# before the WMS -> WMTS -> WFS cascade
+PROTOCOL_CACHE_FILE = os.path.join("tools", "protocol_cache.json")
+
+# Transport of the capabilities documents (http_transport.py): "http2"
+# multiplexes the requests to a host over one connection where the server
+# supports HTTP/2, "http1.1" keeps a pool of HTTP/1.1 connections. Both
+# request gzip/br compressed responses. Bytes on the wire and decompression
+# time go into the run report
+HTTP_TRANSPORT = "http2"
+RUN_REPORT_FILE = os.path.join("tools", "run_report.json")
+
+# Dataset files: geoservices_CH.csv is merged into datasets partition by
+# partition, about DATASET_PARTITION_BYTES of it at a time. The partitions
+# are open files, DATASET_MAX_PARTITIONS stays below the usual limit
+DATASET_PARTITION_BYTES = 4 * 1024 * 1024
+DATASET_MAX_PARTITIONS = 500
+
+# Submit the result URLs to the Google Indexing API after a run
+GOOGLE_INDEXING = True
+
+# Import-time budget of scraper.py and the default scraper in milliseconds,
+# checked by check-startup-time.py (best of STARTUP_IMPORT_RUNS runs)
+STARTUP_IMPORT_BUDGET_MS = 250
+STARTUP_IMPORT_RUNS = 5
+
+# Run-to-run change detection: the layers of a run are compared with the
+# latest snapshot of the history (HISTORY_PATH), added/removed/modified
+# layers are written as Parquet files and summarised per endpoint. DuckDB
+# spills to CHANGES_TEMP_DIR beyond CHANGES_MEMORY_LIMIT
+CHANGES_PATH = os.path.join("data", "changes")
+GEOSERVICES_CHANGES_CH_CSV = os.path.join("data", "geoservices_changes_CH.csv")
+CHANGES_MEMORY_LIMIT = "512MB"
+CHANGES_TEMP_DIR = os.path.join("tools", "duckdb_tmp")
+
+# History of geoservices_CH.csv: a base Parquet table plus one delta per
+# run; deltas beyond HISTORY_MAX_DELTAS are folded into the base
+HISTORY_PATH = os.path.join("data", "history")
+HISTORY_MAX_DELTAS = 52
+
+# Static search index of the catalogue page (search_index.py), terms are
+# sharded by their first SEARCH_PREFIX_LENGTH characters
+SEARCH_INDEX_PATH = os.path.join("data", "search")
+SEARCH_PREFIX_LENGTH = 2
+
+# QGIS/ArcGIS Pro layer files of all datasets, zipped per owner
+LAYER_FILES_PATH = os.path.join("data", "layerfiles")
+
+# Attribute schemas of the WFS feature types (wfs_schema.py): every distinct
+# schema once and the schema of every feature type. DescribeFeatureType asks
+# for up to WFS_SCHEMA_BATCH_SIZE typeNames per request, with at most
+# WFS_SCHEMA_HOST_CONNECTIONS requests per host in flight
+WFS_ATTRIBUTES_CH_CSV = os.path.join("data", "wfs_attributes_CH.csv")
+WFS_FEATURETYPES_CH_CSV = os.path.join("data", "wfs_featuretypes_CH.csv")
+WFS_SCHEMA_VERSION = "1.1.0"
+WFS_SCHEMA_BATCH_SIZE = 50
+WFS_SCHEMA_MAX_URL_LENGTH = 4000
+WFS_SCHEMA_WORKERS = 16
+WFS_SCHEMA_HOST_CONNECTIONS = 4
+
+# Legend images and WMS thumbnails of the layers (preview_cache.py), stored
+# once per distinct image. Beyond PREVIEW_CACHE_MAX_BYTES the least recently
+# used images are evicted. Optional stage of the scraper run (PREVIEWS)
+PREVIEWS = False
+PREVIEW_PATH = os.path.join("data", "previews")
+PREVIEWS_CH_CSV = os.path.join("data", "previews_CH.csv")
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PREVIEW_WORKERS = 16
+PREVIEW_HOST_CONNECTIONS = 4
+
+# Working files that are not published: CACHE_PATH is gitignored and not
+# pushed by the workflow, which keeps it from run to run with actions/cache
+CACHE_PATH = "cache"
+
+# Catalogue database (catalogue_db.py): every run in SQLite, with normalised
+# tables, versioned layers and full-text search
+CATALOGUE_DB = os.path.join(CACHE_PATH, "catalogue.sqlite")
+
+# Query API over the harvest (catalogue_server.py): the layers and datasets
+# as memory-mapped Arrow files, built by the server, pages of
+# CATALOGUE_PAGE_SIZE rows by default, the last CATALOGUE_CACHE_ENTRIES
+# responses kept
+CATALOGUE_ARROW_PATH = os.path.join(CACHE_PATH, "arrow")
+CATALOGUE_SERVER_PORT = 8080
+CATALOGUE_PAGE_SIZE = 100
+CATALOGUE_MAX_PAGE_SIZE = 1000
+CATALOGUE_CACHE_ENTRIES = 256
+
+# Profiling (python scraper.py --profile, profiling.py): stacks sampled
+# every PROFILE_INTERVAL seconds, the PROFILE_TOP_ALLOCATIONS lines that
+# allocated the most per source and operator
+PROFILE_PATH = os.path.join("tools", "profile")
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP_ALLOCATIONS = 10
+
+# Spatial index (spatial_index.py): R*Trees over the BBOX of all layers, in
+# WGS84 and LV95, built on first use
+SPATIAL_INDEX_DB = os.path.join(CACHE_PATH, "spatial_index.sqlite")
+
+# Async capabilities client (async_capabilities.py): requests in flight, at
+# most ASYNC_HOST_CONNECTIONS of them to the same host
+ASYNC_MAX_CONNECTIONS = 100
+ASYNC_HOST_CONNECTIONS = 4
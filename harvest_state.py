@@ -0,0 +1,422 @@
+"""
+Title: Harvest state
+Author: David Oesch
+Date: 2026-10-19
+Purpose: State about the harvested sources that is kept from one scraper run
+    to the next, stored as JSON files next to the error logs (the GitHub
+    workflow commits the tools/ folder after every run).
+Notes:
+- FailureHistory: negative-result cache. Sources that keep failing are
+  backed off exponentially and only attempted again every few runs instead
+  of paying the full fetch and parse chain each run.
+- ProtocolCache: the protocol (WMS, WMTS, WFS) and version that last worked
+  per source, tried first instead of the WMS -> WMTS -> WFS cascade.
+- HostLatency: latency histograms per host, from which the connect and read
+  timeouts and the retries of a host are derived.
+"""
+
+import json
+import math
+import os
+import threading
+
+
+def load_state(path):
+    """
+    Load a state file.
+
+    Parameters:
+    path (str): Path of the JSON state file.
+
+    Returns:
+    dict: The state, empty if the file does not exist or is unreadable.
+    """
+    try:
+        with open(path, mode="r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    """
+    Save a state file. The file is replaced atomically, so an interrupted run
+    never leaves a truncated state behind. Keys are sorted to keep the diffs
+    of the committed file small.
+
+    Parameters:
+    path (str): Path of the JSON state file.
+    state (dict): The state to save.
+
+    Returns:
+    None
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, mode="w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+    os.replace(temp_path, path)
+    return
+
+
+class FailureHistory:
+    """
+    Failure history of the sources, by GetCapabilities URL.
+
+    Every scraper run has a number. A source that failed in
+    backoff_after consecutive runs is chronically failing: it is skipped for
+    2, 4, 8, ... runs (at most max_backoff) and then harvested again. A
+    single success clears its history.
+    """
+
+    def __init__(self, path, backoff_after, max_backoff):
+        self.path = path
+        self.backoff_after = backoff_after
+        self.max_backoff = max_backoff
+        state = load_state(path)
+        self.run = state.get("run", 0) + 1
+        self.sources = state.get("sources", {})
+        self.skipped = {}
+
+    def failures(self, url):
+        """
+        Returns:
+        int: The number of consecutive runs in which the source failed.
+        """
+        return self.sources.get(url, {}).get("failures", 0)
+
+    def should_skip(self, url):
+        """
+        Returns:
+        bool: True if the source is backed off in this run.
+        """
+        return self.run < self.sources.get(url, {}).get("next_run", 0)
+
+    def describe(self, url):
+        """
+        Returns:
+        str: Why the source is skipped, for the operator error log.
+        """
+        entry = self.sources[url]
+        return ("Skipped: failed in %s consecutive runs, next attempt in run "
+                "%s (this is run %s). Last issue: %s" % (
+                    entry["failures"], entry["next_run"], self.run,
+                    entry.get("last_error", "n.a.")))
+
+    def record_skip(self, server_operator, url):
+        self.skipped.setdefault(server_operator, []).append(url)
+
+    def record_failure(self, url, error_details=None):
+        """
+        Record that a source failed in this run and schedule its next
+        attempt.
+
+        Parameters:
+        url (str): GetCapabilities URL of the source.
+        error_details (str, optional): The issue, kept for the skip notes.
+
+        Returns:
+        None
+        """
+        entry = self.sources.setdefault(url, {"failures": 0})
+        entry["failures"] += 1
+        entry["last_failed_run"] = self.run
+        if error_details:
+            entry["last_error"] = str(error_details)
+        if entry["failures"] >= self.backoff_after:
+            # Skipped in the backoff runs after this one
+            backoff = 2 ** (entry["failures"] - self.backoff_after + 1)
+            entry["next_run"] = self.run + min(backoff, self.max_backoff) + 1
+        else:
+            entry["next_run"] = self.run + 1
+        return
+
+    def record_success(self, url):
+        self.sources.pop(url, None)
+
+    def skipped_counts(self):
+        """
+        Returns:
+        dict: The number of sources skipped in this run per server operator.
+        """
+        return {server_operator: len(urls)
+                for server_operator, urls in self.skipped.items()}
+
+    def save(self, known_urls=None):
+        """
+        Save the failure history.
+
+        Parameters:
+        known_urls (iterable, optional): The URLs of the source collection.
+            History of sources that are no longer in it is dropped.
+
+        Returns:
+        None
+        """
+        if known_urls is not None:
+            known_urls = set(known_urls)
+            self.sources = {url: entry for url, entry in self.sources.items()
+                            if url in known_urls}
+        save_state(self.path, {"run": self.run, "sources": self.sources})
+        return
+
+
+class ProtocolCache:
+    """
+    The protocol (service type) and version that last worked per
+    GetCapabilities URL, and the number of parse attempts of this run.
+
+    The scraper tries the cached protocol first and only falls back to the
+    WMS, WMTS, WFS cascade if it fails. A source whose harvest fails keeps
+    its entry; a source found with another protocol gets it replaced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = load_state(path).get("sources", {})
+        self.stats = {"services": 0, "hits": 0, "misses": 0, "attempts": 0,
+                      "attempts_saved": 0}
+
+    def hint(self, url):
+        """
+        Returns:
+        dict: The protocol that last worked ("service_type", "version"),
+            None if unknown.
+        """
+        entry = self.sources.get(url)
+        return dict(entry) if entry else None
+
+    def record(self, url, protocol):
+        """
+        Record the outcome of parsing a source.
+
+        Parameters:
+        url (str): GetCapabilities URL of the source.
+        protocol (dict): As returned by the scraper: "attempts" and, if a
+            service was found, "service_type", "version" and
+            "attempts_saved".
+
+        Returns:
+        None
+        """
+        self.stats["attempts"] += protocol.get("attempts", 0)
+        if not protocol.get("service_type"):
+            return
+        entry = self.sources.get(url)
+        self.stats["services"] += 1
+        if entry is not None:
+            if entry["service_type"] == protocol["service_type"]:
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+        self.stats["attempts_saved"] += protocol.get("attempts_saved", 0)
+        self.sources[url] = {"service_type": protocol["service_type"],
+                             "version": protocol.get("version")}
+        return
+
+    def report(self):
+        """
+        Returns:
+        dict: The statistics of this run: services found, cache hits and
+            misses, parse attempts made and saved compared to the cascade.
+        """
+        return dict(self.stats)
+
+    def save(self, known_urls=None):
+        """
+        Save the protocol cache.
+
+        Parameters:
+        known_urls (iterable, optional): The URLs of the source collection.
+            Entries of sources that are no longer in it are dropped.
+
+        Returns:
+        None
+        """
+        if known_urls is not None:
+            known_urls = set(known_urls)
+            self.sources = {url: entry for url, entry in self.sources.items()
+                            if url in known_urls}
+        save_state(self.path, {"sources": self.sources})
+        return
+
+
+class HostLatency:
+    """
+    Latency histograms per host (host:port of the URL), kept across runs:
+    "connect" is the TCP and TLS handshake, "response" the time from
+    sending a request to its response headers. Timeouts count as slower
+    than the slowest bucket.
+
+    The timeouts of a host are factor times its p99 latency, within the
+    caps, so fast hosts fail fast and slow but healthy hosts are not cut
+    off. The longer the tail of its response times (p99 / p95), the more
+    a retry pays off: log2(p99 / p95) retries, at most max_retries. Hosts
+    with fewer than MIN_SAMPLES latencies get the default timeouts.
+
+    A host whose share of timed out responses exceeds max_timeout_share is
+    flaky rather than slow: waiting longer or retrying rarely helps, so it
+    gets no retries and at most the default read timeout (less if its p95
+    is low). Connect and read timeouts times the attempts stay within
+    request_budget seconds.
+
+    Samples of one run are recorded from several threads; older samples
+    decay (all counts are halved) once a histogram holds MAX_SAMPLES.
+    """
+
+    # Upper bounds of the buckets in seconds, the last bucket is unbounded
+    BUCKETS = [0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 7.5, 10, 15,
+               20, 30, 45, 60, 90, 120]
+    MIN_SAMPLES = 5
+    MAX_SAMPLES = 200
+
+    def __init__(self, path, factor, connect_cap, read_cap, max_retries,
+                 default_timeouts, max_timeout_share, request_budget):
+        self.path = path
+        self.factor = factor
+        self.connect_cap = connect_cap
+        self.read_cap = read_cap
+        self.max_retries = max_retries
+        self.default_timeouts = default_timeouts
+        self.max_timeout_share = max_timeout_share
+        self.request_budget = request_budget
+        self.hosts = load_state(path).get("hosts", {})
+        self.stats = {"samples": 0, "timeouts": 0}
+        self.lock = threading.Lock()
+
+    def record(self, host, metric, seconds):
+        """
+        Record a latency.
+
+        Parameters:
+        host (str): host:port.
+        metric (str): "connect" or "response".
+        seconds (float or None): The latency, None if it timed out.
+
+        Returns:
+        None
+        """
+        if seconds is None:
+            bucket = len(self.BUCKETS)
+        else:
+            bucket = next((n for n, bound in enumerate(self.BUCKETS)
+                           if seconds <= bound), len(self.BUCKETS))
+        with self.lock:
+            counts = self.hosts.setdefault(host, {}).setdefault(
+                metric, [0] * (len(self.BUCKETS) + 1))
+            counts[bucket] += 1
+            if sum(counts) >= self.MAX_SAMPLES:
+                counts[:] = [count // 2 for count in counts]
+            self.stats["samples"] += 1
+            if seconds is None:
+                self.stats["timeouts"] += 1
+        return
+
+    def percentile(self, host, metric, q):
+        """
+        Parameters:
+        host (str): host:port.
+        metric (str): "connect" or "response".
+        q (float): The percentile, e.g. 0.99.
+
+        Returns:
+        float or None: The upper bound of the bucket of the percentile in
+            seconds (inf for timeouts), None if there are too few samples.
+        """
+        with self.lock:
+            counts = list(self.hosts.get(host, {}).get(metric, []))
+        total = sum(counts)
+        if total < self.MIN_SAMPLES:
+            return None
+        cumulated = 0
+        for bucket, count in enumerate(counts):
+            cumulated += count
+            if cumulated >= q * total:
+                break
+        return self.BUCKETS[bucket] if bucket < len(self.BUCKETS) \
+            else math.inf
+
+    def timeout_share(self, host, metric):
+        """
+        Parameters:
+        host (str): host:port.
+        metric (str): "connect" or "response".
+
+        Returns:
+        float: The share of the samples that timed out, 0 without samples.
+        """
+        with self.lock:
+            counts = list(self.hosts.get(host, {}).get(metric, []))
+        total = sum(counts)
+        return counts[-1] / total if total else 0.0
+
+    def read_timeout(self, latency):
+        # factor times a latency, within the caps
+        return min(max(self.factor * latency, self.read_cap[0]),
+                   self.read_cap[1])
+
+    def timeouts(self, host):
+        """
+        Parameters:
+        host (str): host:port.
+
+        Returns:
+        dict: "connect" and "read" timeout in seconds and the number of
+            "retries" after a timeout, for requests to this host.
+        """
+        timeouts = dict(self.default_timeouts)
+        connect = self.percentile(host, "connect", 0.99)
+        if connect is not None:
+            timeouts["connect"] = min(max(self.factor * connect,
+                                          self.connect_cap[0]),
+                                      self.connect_cap[1])
+        p95 = self.percentile(host, "response", 0.95)
+        p99 = self.percentile(host, "response", 0.99)
+        if p99 is not None and \
+                self.timeout_share(host, "response") > self.max_timeout_share:
+            # Flaky host
+            if p95 < math.inf:
+                timeouts["read"] = min(self.read_timeout(p95),
+                                       timeouts["read"])
+            timeouts["retries"] = 0
+        elif p99 is not None:
+            timeouts["read"] = self.read_timeout(p99)
+            # A few timeouts (p99 inf) are worth a retry
+            timeouts["retries"] = min(
+                int(math.log2(p99 / p95)) if p99 < math.inf else 1,
+                self.max_retries)
+        # Keep all attempts of a request within the budget
+        while timeouts["retries"] > 0 and self.request_budget < (
+                timeouts["connect"] + timeouts["read"]) * (
+                timeouts["retries"] + 1):
+            timeouts["retries"] -= 1
+        timeouts["read"] = min(timeouts["read"],
+                               self.request_budget - timeouts["connect"])
+        return timeouts
+
+    def report(self):
+        """
+        Returns:
+        dict: The latencies recorded in this run and how many of them timed
+            out, the hosts known and those with learned timeouts.
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            hosts = list(self.hosts)
+        stats["hosts"] = len(hosts)
+        stats["learned"] = sum(
+            1 for host in hosts
+            if self.percentile(host, "response", 0.99) is not None)
+        return stats
+
+    def save(self):
+        """
+        Save the latency histograms.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            save_state(self.path, {"buckets": self.BUCKETS,
+                                   "hosts": self.hosts})
+        return
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""
+Title: HTTP transport
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Transport of the harvester for GetCapabilities documents. One httpx
+    client is shared by all fetch threads: with HTTP/2 the requests to a
+    host are multiplexed as streams over one connection, and compressed
+    responses (gzip, br) are always requested. Capabilities documents
+    compress 10-20x, and a few hosts serve hundreds of the endpoints.
+Notes:
+- Uses Python 3.9
+- config.HTTP_TRANSPORT selects "http2" or "http1.1". HTTP/2 is negotiated
+  per host (ALPN), hosts without it and plain http:// use HTTP/1.1
+- Responses are streamed: open() returns once the headers have arrived, the
+  body is read only as far as needed (CapabilitiesStream), so a liveness
+  check of the first bytes hands the same response on to the parser
+- Responses are read undecoded and decompressed here, so that the bytes on
+  the wire and the decompression time can be counted for the run report
+  (config.RUN_REPORT_FILE)
+- br is only requested if the brotli package is installed
+"""
+
+import logging
+import threading
+import time
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import urlparse
+import configuration as config
+
+logger = logging.getLogger("Scraping log")
+
+CapabilitiesResponse = namedtuple("CapabilitiesResponse",
+                                  ["status_code", "content", "http_version"])
+
+
+@lru_cache(maxsize=None)
+def get_brotli():
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    return brotli
+
+
+def accept_encoding():
+    """
+    Returns:
+    str: The Accept-Encoding header, with br if it can be decoded.
+    """
+    if get_brotli() is not None:
+        return "gzip, br, deflate"
+    return "gzip, deflate"
+
+
+class GzipDecoder:
+    # Incremental gzip decoder, also of bodies with several gzip members
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def decode(self, data):
+        result = self.decompressor.decompress(data)
+        while self.decompressor.eof and self.decompressor.unused_data:
+            data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            result += self.decompressor.decompress(data)
+        return result
+
+    def flush(self):
+        return self.decompressor.flush()
+
+
+class DeflateDecoder:
+    # Incremental deflate decoder. Some servers send raw deflate without the
+    # zlib header
+    def __init__(self):
+        self.decompressor = zlib.decompressobj()
+        self.first = True
+
+    def decode(self, data):
+        if not self.first:
+            return self.decompressor.decompress(data)
+        self.first = False
+        try:
+            return self.decompressor.decompress(data)
+        except zlib.error:
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decompressor.decompress(data)
+
+    def flush(self):
+        return self.decompressor.flush()
+
+
+class BrotliDecoder:
+    def __init__(self):
+        decompressor = get_brotli().Decompressor()
+        self.decode = getattr(decompressor, "process", None) or \
+            decompressor.decompress
+
+    def flush(self):
+        return b""
+
+
+class ContentDecoder:
+    """
+    Incremental decoder of a response body, for all encodings of its
+    Content-Encoding header. Keeps the time spent decompressing.
+
+    Parameters:
+    content_encoding (str): The Content-Encoding header, e.g. "gzip".
+
+    Raises:
+    ValueError: If an encoding is not supported.
+    """
+
+    def __init__(self, content_encoding):
+        self.decoders = []
+        encodings = [encoding.strip().lower()
+                     for encoding in content_encoding.split(",")
+                     if encoding.strip()]
+        # Encodings are listed in the order they were applied
+        for encoding in reversed(encodings):
+            if encoding == "identity":
+                continue
+            if encoding in ("gzip", "x-gzip"):
+                self.decoders.append((encoding, GzipDecoder()))
+            elif encoding == "deflate":
+                self.decoders.append((encoding, DeflateDecoder()))
+            elif encoding == "br" and get_brotli() is not None:
+                self.decoders.append((encoding, BrotliDecoder()))
+            else:
+                raise ValueError("Unsupported Content-Encoding %s" % encoding)
+        self.seconds = 0.0
+
+    def decode(self, data, final=False):
+        """
+        Parameters:
+        data (bytes): The next part of the body as sent by the server.
+        final (bool): Whether it is the last part.
+
+        Returns:
+        bytes: The decompressed data available so far.
+
+        Raises:
+        ValueError: If the body cannot be decoded.
+        """
+        start = time.perf_counter()
+        for encoding, decoder in self.decoders:
+            try:
+                data = decoder.decode(data)
+                if final:
+                    data += decoder.flush()
+            except Exception as e:
+                raise ValueError("Invalid %s content: %s" % (encoding, e))
+        self.seconds += time.perf_counter() - start
+        return data
+
+
+def decode_content(content, content_encoding):
+    """
+    Decompress a response body.
+
+    Parameters:
+    content (bytes): The body as sent by the server.
+    content_encoding (str): The Content-Encoding header, e.g. "gzip".
+
+    Returns:
+    bytes: The decompressed body.
+
+    Raises:
+    ValueError: If the body cannot be decoded.
+    """
+    return ContentDecoder(content_encoding).decode(content, final=True)
+
+
+class CapabilitiesStream:
+    """
+    An open response of a capabilities document. The body is only read, and
+    decompressed, as far as it is asked for: head() for a liveness check,
+    read() for the whole document. Close it when done (or use it as a
+    context manager).
+    """
+
+    def __init__(self, status_code, http_version, content_encoding, chunks,
+                 on_close):
+        self.status_code = status_code
+        self.http_version = http_version
+        self.content_encoding = content_encoding
+        self.decoder = ContentDecoder(content_encoding)
+        self.chunks = chunks
+        self.on_close = on_close
+        self.buffer = b""
+        self.wire_bytes = 0
+        self.complete = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read_chunk(self):
+        raw = next(self.chunks, None)
+        if raw is None:
+            self.buffer += self.decoder.decode(b"", final=True)
+            self.complete = True
+        else:
+            self.wire_bytes += len(raw)
+            self.buffer += self.decoder.decode(raw)
+
+    def head(self, size=512):
+        """
+        Parameters:
+        size (int): Number of bytes.
+
+        Returns:
+        bytes: The first size bytes of the decompressed body (fewer if it is
+            shorter).
+        """
+        while len(self.buffer) < size and not self.complete:
+            self.read_chunk()
+        return self.buffer[:size]
+
+    def read(self):
+        """
+        Returns:
+        bytes: The whole decompressed body, including the head already read.
+        """
+        while not self.complete:
+            self.read_chunk()
+        return self.buffer
+
+    def close(self):
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            on_close(self)
+
+
+def open_requests_stream(url, timeout):
+    """
+    Open a capabilities stream with requests, for when httpx is not
+    available. urllib3 decompresses the body, so no wire bytes are known.
+
+    Parameters:
+    url (str): GetCapabilities URL.
+    timeout (tuple): Connect and read timeout in seconds.
+
+    Returns:
+    CapabilitiesStream: The open stream.
+    """
+    import requests
+    response = requests.get(url, stream=True, timeout=timeout,
+                            headers={"Accept-Encoding": accept_encoding()})
+    return CapabilitiesStream(
+        response.status_code, "HTTP/1.1", "",
+        response.iter_content(chunk_size=65536),
+        lambda stream: response.close())
+
+
+class CapabilitiesTransport:
+    """
+    HTTP client for GetCapabilities documents, safe to share between
+    threads. Use it as a context manager or close it.
+
+    Parameters:
+    protocol (str, optional): "http2" or "http1.1", config.HTTP_TRANSPORT
+        by default.
+    timeout (float, optional): Timeout of a request in seconds,
+        config.CAPABILITIES_TIMEOUT by default.
+    http2_prior_knowledge (bool): Speak HTTP/2 without negotiation, also on
+        plain http:// (only for servers known to support it, e.g. a local
+        test server).
+    connect_timeout (float, optional): Timeout of establishing a connection
+        in seconds, config.CONNECT_TIMEOUT by default, so dead hosts fail
+        fast.
+    latency (HostLatency, optional): Records the connect and response
+        latencies of every request per host.
+    """
+
+    def __init__(self, protocol=None, timeout=None,
+                 http2_prior_knowledge=False, connect_timeout=None,
+                 latency=None):
+        import httpx
+        self.protocol = protocol or config.HTTP_TRANSPORT
+        if self.protocol not in ("http2", "http1.1"):
+            raise ValueError("Unknown HTTP transport %s" % self.protocol)
+        http2 = self.protocol == "http2"
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 needs the h2 package, using HTTP/1.1")
+                http2 = False
+        self.client = httpx.Client(
+            http1=not (http2 and http2_prior_knowledge), http2=http2,
+            timeout=httpx.Timeout(timeout or config.CAPABILITIES_TIMEOUT,
+                                  connect=connect_timeout or
+                                  config.CONNECT_TIMEOUT),
+            follow_redirects=True,
+            headers={"Accept-Encoding": accept_encoding()})
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.stats = {"protocol": self.protocol, "requests": 0, "failed": 0,
+                      "wire_bytes": 0, "content_bytes": 0,
+                      "decompress_seconds": 0.0, "http_versions": {},
+                      "content_encodings": {}, "incomplete": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.client.close()
+
+    def open(self, url, timeouts=None):
+        """
+        Send a GET request for a capabilities document and return as soon as
+        the response headers have arrived.
+
+        Parameters:
+        url (str): GetCapabilities URL.
+        timeouts (dict, optional): "connect" and "read" timeout of this
+            request in seconds, see HostLatency.timeouts.
+
+        Returns:
+        CapabilitiesStream: The open stream; close it when done.
+
+        Raises:
+        httpx.HTTPError: If the request failed.
+        ValueError: If the Content-Encoding is not supported.
+        """
+        import httpx
+        kwargs = {}
+        if timeouts is not None:
+            kwargs["timeout"] = httpx.Timeout(timeouts["read"],
+                                              connect=timeouts["connect"])
+        events = {}
+        if self.latency is not None:
+            def trace(name, info):
+                # e.g. "http11.receive_response_headers.complete"
+                events.setdefault(name.split(".", 1)[1], time.perf_counter())
+            kwargs["extensions"] = {"trace": trace}
+        context = self.client.stream("GET", url, **kwargs)
+        try:
+            try:
+                response = context.__enter__()
+            except Exception as e:
+                if self.latency is not None:
+                    self.record_latency(url, events, e)
+                raise
+            if self.latency is not None:
+                self.record_latency(url, events)
+            stream = CapabilitiesStream(
+                response.status_code, response.http_version,
+                response.headers.get("Content-Encoding", ""),
+                response.iter_raw(),
+                lambda stream: self.record(stream, context))
+        except Exception:
+            context.__exit__(None, None, None)
+            with self.lock:
+                self.stats["failed"] += 1
+            raise
+        return stream
+
+    def record_latency(self, url, events, exception=None):
+        # Connect and response latency of a request from its trace events
+        import httpx
+        host = urlparse(url).netloc
+        if "connect_tcp.started" in events:
+            if isinstance(exception, httpx.ConnectTimeout):
+                self.latency.record(host, "connect", None)
+            elif "connect_tcp.complete" in events:
+                connected = events.get("start_tls.complete",
+                                       events["connect_tcp.complete"])
+                self.latency.record(host, "connect",
+                                    connected - events["connect_tcp.started"])
+        if "send_request_headers.started" in events:
+            if isinstance(exception, httpx.ReadTimeout):
+                self.latency.record(host, "response", None)
+            elif "receive_response_headers.complete" in events:
+                self.latency.record(
+                    host, "response",
+                    events["receive_response_headers.complete"] -
+                    events["send_request_headers.started"])
+
+    def record(self, stream, context):
+        # Close the response of a stream and count what it transferred
+        context.__exit__(None, None, None)
+        with self.lock:
+            stats = self.stats
+            stats["requests"] += 1
+            stats["wire_bytes"] += stream.wire_bytes
+            stats["content_bytes"] += len(stream.buffer)
+            stats["decompress_seconds"] += stream.decoder.seconds
+            versions = stats["http_versions"]
+            versions[stream.http_version] = \
+                versions.get(stream.http_version, 0) + 1
+            encoding = stream.content_encoding or "identity"
+            encodings = stats["content_encodings"]
+            encodings[encoding] = encodings.get(encoding, 0) + 1
+            # E.g. rejected after the first bytes by the liveness check
+            if not stream.complete:
+                stats["incomplete"] += 1
+
+    def get(self, url, timeouts=None):
+        """
+        GET a capabilities document.
+
+        Parameters:
+        url (str): GetCapabilities URL.
+        timeouts (dict, optional): "connect" and "read" timeout of this
+            request in seconds.
+
+        Returns:
+        CapabilitiesResponse: status_code, content (decompressed) and
+            http_version ("HTTP/1.1" or "HTTP/2").
+
+        Raises:
+        httpx.HTTPError: If the request failed.
+        ValueError: If the response cannot be decompressed.
+        """
+        with self.open(url, timeouts) as stream:
+            try:
+                content = stream.read()
+            except Exception:
+                with self.lock:
+                    self.stats["failed"] += 1
+                raise
+        return CapabilitiesResponse(stream.status_code, content,
+                                    stream.http_version)
+
+    def report(self):
+        """
+        Returns:
+        dict: The transport statistics of the run so far, for the run
+            report.
+        """
+        with self.lock:
+            report = dict(self.stats)
+            report["http_versions"] = dict(self.stats["http_versions"])
+            report["content_encodings"] = dict(
+                self.stats["content_encodings"])
+        report["decompress_seconds"] = round(report["decompress_seconds"], 3)
+        if report["wire_bytes"]:
+            report["compression_ratio"] = round(
+                report["content_bytes"] / report["wire_bytes"], 2)
+        return report
+
+
+def is_timeout(exception):
+    """
+    Parameters:
+    exception (Exception): An exception raised by a request.
+
+    Returns:
+    bool: True if the request timed out (httpx or requests).
+    """
+    import requests
+    timeout_exceptions = [requests.exceptions.Timeout]
+    try:
+        import httpx
+        timeout_exceptions.append(httpx.TimeoutException)
+    except ImportError:
+        pass
+    return isinstance(exception, tuple(timeout_exceptions))
@@ -0,0 +1,132 @@
+/**
+ * Client of the static search index built by search_index.py.
+ *
+ * Loads manifest.json, then for a query only the term shards of its tokens
+ * and the layer shards of the owners with hits. All query tokens must match
+ * (as word prefixes). Needs fetch and DecompressionStream.
+ *
+ * Usage:
+ *   var index = new GeoSearchIndex("data/search/");
+ *   index.search("gewässer bern", 100).then(function (layers) { ... });
+ */
+var GeoSearchIndex = function (baseUrl) {
+    this.baseUrl = baseUrl;
+    this.manifest = null;
+    this.cache = {};
+};
+
+// Same tokenisation as search_index.tokenize: all combining marks
+// (Unicode category M) are dropped after the NFKD decomposition
+GeoSearchIndex.tokenize = function (text) {
+    var normalized = text.toLowerCase().replace(/ß/g, "ss")
+        .normalize("NFKD").replace(/\p{M}/gu, "");
+    return normalized.split(/[^a-z0-9]+/).filter(function (token) {
+        return token.length >= 2;
+    });
+};
+
+GeoSearchIndex.prototype.load = function (file) {
+    if (!(file in this.cache)) {
+        this.cache[file] = fetch(this.baseUrl + file + ".gz")
+            .then(function (response) { return response.arrayBuffer(); })
+            .then(function (buffer) {
+                var bytes = new Uint8Array(buffer);
+                // Servers may already have decoded the gzip transfer
+                if (bytes[0] !== 0x1f || bytes[1] !== 0x8b) {
+                    return new Response(bytes).json();
+                }
+                var stream = new Blob([bytes]).stream()
+                    .pipeThrough(new DecompressionStream("gzip"));
+                return new Response(stream).json();
+            });
+    }
+    return this.cache[file];
+};
+
+GeoSearchIndex.prototype.loadManifest = function () {
+    if (this.manifest === null) {
+        this.manifest = fetch(this.baseUrl + "manifest.json")
+            .then(function (response) { return response.json(); });
+    }
+    return this.manifest;
+};
+
+// Ids of the layers with a word starting with token
+GeoSearchIndex.prototype.lookup = function (manifest, token) {
+    var self = this;
+    var prefix = token.slice(0, manifest.prefix_length);
+    var files = Object.keys(manifest.shards).filter(function (key) {
+        return key === prefix || (token.length < manifest.prefix_length &&
+            key.indexOf(token) === 0);
+    }).map(function (key) { return manifest.shards[key]; });
+    return Promise.all(files.map(function (file) {
+        return self.load(file);
+    })).then(function (shards) {
+        var ids = new Set();
+        shards.forEach(function (shard) {
+            Object.keys(shard).forEach(function (term) {
+                if (term.indexOf(token) !== 0) {
+                    return;
+                }
+                var id = 0;
+                shard[term].forEach(function (gap) {
+                    id += gap;
+                    ids.add(id);
+                });
+            });
+        });
+        return ids;
+    });
+};
+
+/**
+ * Search the layers.
+ *
+ * @param {string} query - The search words.
+ * @param {number} limit - Maximum number of layers returned.
+ * @returns {Promise<Array>} The matching layers as objects with the fields
+ *     of the manifest (OWNER, TITLE, SERVICELINK, ...), in id order.
+ */
+GeoSearchIndex.prototype.search = function (query, limit) {
+    var self = this;
+    var tokens = GeoSearchIndex.tokenize(query);
+    return this.loadManifest().then(function (manifest) {
+        if (tokens.length === 0) {
+            return [];
+        }
+        return Promise.all(tokens.map(function (token) {
+            return self.lookup(manifest, token);
+        })).then(function (idSets) {
+            var ids = Array.from(idSets[0]).filter(function (id) {
+                return idSets.every(function (set) { return set.has(id); });
+            }).sort(function (a, b) { return a - b; });
+            if (limit) {
+                ids = ids.slice(0, limit);
+            }
+            var owners = Object.keys(manifest.owners).filter(function (owner) {
+                var range = manifest.owners[owner];
+                return ids.some(function (id) {
+                    return id >= range.first && id < range.first + range.count;
+                });
+            });
+            return Promise.all(owners.map(function (owner) {
+                return self.load(manifest.owners[owner].file);
+            })).then(function (docShards) {
+                var layers = [];
+                ids.forEach(function (id) {
+                    owners.forEach(function (owner, n) {
+                        var range = manifest.owners[owner];
+                        if (id >= range.first && id < range.first + range.count) {
+                            var layer = {};
+                            manifest.fields.forEach(function (field, i) {
+                                layer[field] = docShards[n][id - range.first][i];
+                            });
+                            layers.push(layer);
+                        }
+                    });
+                });
+                return layers;
+            });
+        });
+    });
+};
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Layer files
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Render the QGIS (.qlr) and ArcGIS Pro (.lyrx) layer files of all
+    datasets in geodata_CH.csv from the templates in templates/ and bundle
+    them per owner as zip files, so that all datasets of an owner can be
+    added to a GIS in one go. The catalogue page renders the same templates
+    one layer at a time in the browser (see index.html).
+Notes:
+- Uses Python 3.9
+- Every template is compiled once into literal text and placeholders
+  ({{NAME}}, {{SERVICELINK}}, ...), values are escaped for XML (.qlr) or
+  JSON (.lyrx)
+- The BBOX of a dataset comes from geoservices_CH.csv (WGS84) and is
+  reprojected to the CRS of the QGIS template (<authid>)
+- ArcGIS Pro files are not rendered for WFS, as on the catalogue page
+- Written to config.LAYER_FILES_PATH/<owner>_layerfiles.zip, with a WMS,
+  WMTS and WFS folder each. The zips are reproducible, so unchanged owners
+  do not add to the size of the repository
+"""
+
+import csv
+import glob
+import json
+import os
+import re
+import zipfile
+from functools import lru_cache
+from xml.sax.saxutils import escape
+import configuration as config
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{([A-Z]+)\}\}")
+AUTHID_PATTERN = re.compile(r"<authid>([^<]+)</authid>")
+# Extent of Switzerland (WGS84) for datasets without a usable BBOX
+DEFAULT_BBOX = (5.96, 45.82, 10.49, 47.81)
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# (service type, column of geodata_CH.csv, template, file extension)
+LAYER_FILES = [
+    ("WMS", "WMSGetCap", "qgis_wms_template.qlr", ".qlr"),
+    ("WMS", "WMSGetCap", "arcgispro_wms_template.lyrx", ".lyrx"),
+    ("WMTS", "WMTSGetCap", "qgis_wmts_template.qlr", ".qlr"),
+    ("WMTS", "WMTSGetCap", "arcgispro_wmts_template.lyrx", ".lyrx"),
+    ("WFS", "WFSGetCap", "qgis_wfs_template.qlr", ".qlr")]
+
+
+class LayerTemplate:
+    """
+    A layer file template, compiled into literal text and placeholders.
+    """
+
+    def __init__(self, path):
+        with open(path, mode="r", encoding="utf-8") as f:
+            text = f.read()
+        # Odd items are placeholder names, even items literal text
+        self.parts = PLACEHOLDER_PATTERN.split(text)
+        match = AUTHID_PATTERN.search(text)
+        self.crs = match.group(1) if match else None
+        if path.endswith(".lyrx"):
+            self.escape = lambda value: json.dumps(value)[1:-1]
+        else:
+            self.escape = lambda value: escape(
+                value, {"'": "&apos;", '"': "&quot;"})
+
+    def render(self, values):
+        """
+        Parameters:
+        values (dict): The value of every placeholder.
+
+        Returns:
+        str: The rendered layer file.
+        """
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = self.escape(values[parts[i]])
+        return "".join(parts)
+
+
+@lru_cache(maxsize=None)
+def get_transformer(crs):
+    from pyproj import Transformer
+    return Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+
+def extent_values(bbox, crs):
+    """
+    Reproject a WGS84 BBOX to the CRS of a template.
+
+    Parameters:
+    bbox (str): "xmin ymin xmax ymax" in WGS84, as in geoservices_CH.csv.
+    crs (str or None): Target CRS, e.g. "EPSG:3857"; None keeps WGS84.
+
+    Returns:
+    dict: XMIN, YMIN, XMAX and YMAX.
+    """
+    try:
+        xmin, ymin, xmax, ymax = (float(v) for v in bbox.split())
+        if not (-180 <= xmin < xmax <= 180 and -90 <= ymin < ymax <= 90):
+            raise ValueError(bbox)
+    except (AttributeError, ValueError):
+        xmin, ymin, xmax, ymax = DEFAULT_BBOX
+    if crs is not None and crs != "EPSG:4326":
+        xmin, ymin, xmax, ymax = get_transformer(crs).transform_bounds(
+            xmin, ymin, xmax, ymax)
+    return {"XMIN": repr(xmin), "YMIN": repr(ymin), "XMAX": repr(xmax),
+            "YMAX": repr(ymax)}
+
+
+def file_name(owner, name, extension):
+    # Like the downloads of the catalogue page, made file-system safe
+    return re.sub(r"[^\w.-]", "_", "%s_%s" % (owner, name)) + extension
+
+
+def render_layer_files(geodata_csv, geoservices_csv, output_path,
+                       template_path="templates"):
+    """
+    Render the layer files of all datasets and zip them per owner.
+
+    Parameters:
+    geodata_csv (str): The datasets (config.GEODATA_CH_CSV).
+    geoservices_csv (str): The layers (config.GEOSERVICES_CH_CSV), for the
+        BBOX of the datasets.
+    output_path (str): Directory of the zip files; existing ones are
+        replaced.
+    template_path (str): Directory of the templates.
+
+    Returns:
+    dict: The number of layer files per owner.
+    """
+    templates = {template: LayerTemplate(os.path.join(template_path,
+                                                      template))
+                 for _, _, template, _ in LAYER_FILES}
+
+    # BBOX by (OWNER, NAME, SERVICELINK)
+    bboxes = {}
+    with open(geoservices_csv, mode="r", encoding="utf8") as f:
+        for row in csv.DictReader(f, delimiter=",", quotechar='"',
+                                  lineterminator="\n"):
+            bboxes.setdefault((row["OWNER"], row["NAME"],
+                               row["SERVICELINK"].strip()), row["BBOX"])
+
+    with open(geodata_csv, mode="r", encoding="utf8") as f:
+        datasets = list(csv.DictReader(f, delimiter=",", quotechar='"',
+                                       lineterminator="\n"))
+
+    os.makedirs(output_path, exist_ok=True)
+    for old_file in glob.glob(os.path.join(output_path, "*_layerfiles.zip")):
+        os.remove(old_file)
+
+    counts = {}
+    bundles = {}
+    names = set()
+    extents = {}
+    try:
+        for dataset in datasets:
+            owner = dataset["OWNER"]
+            if owner not in bundles:
+                bundles[owner] = zipfile.ZipFile(
+                    os.path.join(output_path, "%s_layerfiles.zip" %
+                                 re.sub(r"[^\w.-]", "_", owner)),
+                    "w")
+                counts[owner] = 0
+            for service_type, column, template, extension in LAYER_FILES:
+                service_link = dataset.get(column, "n.a.").strip()
+                if not service_link or service_link == "n.a.":
+                    continue
+                template = templates[template]
+                bbox = bboxes.get((owner, dataset["NAME"], service_link))
+                if (bbox, template.crs) not in extents:
+                    extents[(bbox, template.crs)] = extent_values(
+                        bbox, template.crs)
+                values = {"OWNER": owner, "NAME": dataset["NAME"],
+                          "TITLE": dataset["TITLE"],
+                          "SERVICELINK": service_link}
+                values.update(extents[(bbox, template.crs)])
+                # NAME is not unique per owner (datasets are unique by
+                # TITLE and NAME)
+                name = "%s/%s" % (service_type, file_name(
+                    owner, dataset["NAME"], extension))
+                n = 2
+                while name in names:
+                    name = "%s/%s" % (service_type, file_name(
+                        owner, "%s_%s" % (dataset["NAME"], n), extension))
+                    n += 1
+                names.add(name)
+                # A fixed timestamp keeps the zip of an owner byte-identical
+                # as long as its datasets do not change
+                info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                bundles[owner].writestr(info, template.render(values),
+                                        compresslevel=9)
+                counts[owner] += 1
+    finally:
+        for bundle in bundles.values():
+            bundle.close()
+    return counts
+
+
+if __name__ == "__main__":
+    counts = render_layer_files(config.GEODATA_CH_CSV,
+                                config.GEOSERVICES_CH_CSV,
+                                config.LAYER_FILES_PATH)
+    print("%s layer files for %s owners in %s" % (
+        sum(counts.values()), len(counts), config.LAYER_FILES_PATH))
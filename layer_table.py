@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Layer table
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Compact in-memory store of layer rows (geoservices_CH.csv) for the
+    harvest and the post-processing, instead of a list of dictionaries.
+    The layers of a service repeat the same long strings (OWNER,
+    SERVICELINK, CONTACT, the MAPGEO prefix and service URL) in thousands of
+    rows; here every distinct value is held once.
+Notes:
+- Uses Python 3.9
+- Dictionary-encoded columns: one pool of distinct values shared by all
+  columns, and per column an array of 4-byte codes into it
+- MAPGEO and TREE are stored as sequences of segments ("||" and "/"
+  separated), so the map.geo.admin.ch prefix, the service URL and the
+  path of a layer tree are kept once per service rather than once per layer
+- Rows are handed out as dictionaries on access, in column order, so code
+  written for csv.DictReader rows works unchanged. Changing such a
+  dictionary does not change the table
+- Tables pickle compactly (the pool and the code arrays), e.g. when the
+  scraping worker processes return their rows
+- python benchmark-layer-table.py compares the memory of both
+"""
+
+import csv
+from array import array
+
+# Columns stored as segments, with their separator
+SEGMENTED_FIELDS = {"MAPGEO": "||", "TREE": "/"}
+
+
+class LayerTable:
+    """
+    Dictionary-encoded table of layer rows.
+
+    Parameters:
+    fields (list, optional): Column names; taken from the first row
+        appended if not given.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = None
+        # Distinct values, and the code of each
+        self.values = []
+        self.codes = {}
+        self.columns = {}
+        if fields is not None:
+            self.set_fields(fields)
+
+    def set_fields(self, fields):
+        self.fields = list(fields)
+        for field in self.fields:
+            if field in SEGMENTED_FIELDS:
+                # Segment codes of all rows, and where each row starts
+                self.columns[field] = (array("I"), array("I", [0]))
+            else:
+                self.columns[field] = array("I")
+
+    def encode(self, value):
+        """
+        Returns:
+        int: The code of value, added to the pool if new.
+        """
+        # 1, 1.0 and True are equal keys, but are written differently
+        key = value if type(value) is str else (type(value), value)
+        code = self.codes.get(key)
+        if code is None:
+            code = len(self.values)
+            self.codes[key] = code
+            self.values.append(value)
+        return code
+
+    def append(self, row):
+        """
+        Parameters:
+        row (dict): A layer row; keys not in the columns are ignored,
+            missing ones are stored as "".
+        """
+        if self.fields is None:
+            self.set_fields(row.keys())
+        self.append_values([row.get(field, "") for field in self.fields])
+
+    def append_values(self, values):
+        """
+        Parameters:
+        values (list): The values of a row, in column order.
+        """
+        encode = self.encode
+        for field, value in zip(self.fields, values):
+            column = self.columns[field]
+            separator = SEGMENTED_FIELDS.get(field)
+            if separator is None:
+                column.append(encode(value))
+                continue
+            codes, offsets = column
+            if type(value) is str:
+                codes.extend([encode(segment)
+                              for segment in value.split(separator)])
+            else:
+                # A value that is no string is kept whole, as one segment
+                # flagged by an empty first segment code
+                codes.extend([encode(None), encode(value)])
+            offsets.append(len(codes))
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def value(self, n, field):
+        """
+        Returns:
+        The value of a column in row n.
+        """
+        column = self.columns[field]
+        separator = SEGMENTED_FIELDS.get(field)
+        if separator is None:
+            return self.values[column[n]]
+        codes, offsets = column
+        segments = codes[offsets[n]:offsets[n + 1]]
+        if len(segments) == 2 and self.values[segments[0]] is None:
+            return self.values[segments[1]]
+        return separator.join([self.values[code] for code in segments])
+
+    def column(self, field):
+        """
+        Returns:
+        list: The values of a column, row by row.
+        """
+        return [self.value(n, field) for n in range(len(self))]
+
+    def __len__(self):
+        if not self.fields:
+            return 0
+        column = self.columns[self.fields[0]]
+        if self.fields[0] in SEGMENTED_FIELDS:
+            return len(column[1]) - 1
+        return len(column)
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError("Row %s out of range" % n)
+        return {field: self.value(n, field) for field in self.fields}
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def __getstate__(self):
+        # The codes by value are rebuilt from the pool
+        return {"fields": self.fields, "values": self.values,
+                "columns": self.columns}
+
+    def __setstate__(self, state):
+        self.fields = state["fields"]
+        self.values = state["values"]
+        self.columns = state["columns"]
+        self.codes = {value if type(value) is str else (type(value), value):
+                      code for code, value in enumerate(self.values)}
+
+    @classmethod
+    def read_csv(cls, csv_filename):
+        """
+        Load a CSV file of layers, e.g. geoservices_CH.csv.
+
+        Parameters:
+        csv_filename (str): Path to the CSV file.
+
+        Returns:
+        LayerTable: Its rows.
+        """
+        with open(csv_filename, mode="r", encoding="utf8") as f:
+            reader = csv.reader(f, delimiter=",", quotechar='"',
+                                lineterminator="\n")
+            table = cls(next(reader, None))
+            if table.fields is None:
+                return table
+            width = len(table.fields)
+            for values in reader:
+                if not values:
+                    continue
+                # Short rows are padded as csv.DictReader does
+                table.append_values(values + [None] * (width - len(values)))
+        return table
@@ -0,0 +1,172 @@
+"""
+Title: Operator errors
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Collect the issues found per server operator during a scraper run
+    in memory and write each operator's error log file
+    (<config.DEAD_SERVICES_PATH>/<operator>_errors.csv) once at the end of
+    the run. Keeps the number of issues per operator, so ISSUES.md can be
+    written without re-reading the log files.
+"""
+
+import csv
+import glob
+import os
+from datetime import datetime
+from functools import lru_cache
+
+LOG_HEADER = ["Timestamp", "Operator", "URL", "Issue"]
+
+
+@lru_cache(maxsize=None)
+def cet():
+    """
+    Returns:
+    pytz timezone: Europe/Zurich, the timezone of all timestamps. Built on
+        first use so that importing this module stays cheap.
+    """
+    import pytz
+    return pytz.timezone('Europe/Zurich')
+
+
+class OperatorErrorLog:
+    """
+    In-memory error log of a scraper run, grouped by server operator.
+
+    Records are (timestamp, operator, url, issue) tuples. The parse worker
+    processes collect their records in their own instance and hand them to
+    the main process, which adds them with extend().
+    """
+
+    def __init__(self):
+        self.records = {}
+
+    def record(self, server_operator, server_url, error_details):
+        """
+        Record an issue of a server operator, timestamped now.
+
+        Parameters:
+        server_operator (str): Server operator (source Description).
+        server_url (str): URL (or layer name) the issue relates to.
+        error_details (str or Exception): Description of the issue.
+
+        Returns:
+        None
+        """
+        timestamp = datetime.now(cet()).isoformat()
+        self.records.setdefault(server_operator, []).append(
+            (timestamp, server_operator, server_url, str(error_details)))
+
+    def extend(self, records):
+        """
+        Add records collected elsewhere, e.g. by a parse worker.
+
+        Parameters:
+        records (list): (timestamp, operator, url, issue) tuples.
+
+        Returns:
+        None
+        """
+        for record in records:
+            self.records.setdefault(record[1], []).append(tuple(record))
+
+    def all_records(self):
+        """
+        Returns:
+        list: All records, grouped by operator in order of first issue.
+        """
+        return [record for records in self.records.values()
+                for record in records]
+
+    def last_issue(self, server_operator, server_url):
+        """
+        Returns:
+        str or None: The latest issue recorded for a URL of an operator.
+        """
+        for record in reversed(self.records.get(server_operator, [])):
+            if record[2] == server_url:
+                return record[3]
+        return None
+
+    def counts(self):
+        """
+        Returns:
+        dict: The number of issues per server operator.
+        """
+        return {server_operator: len(records)
+                for server_operator, records in self.records.items()}
+
+    def log_file_path(self, server_operator, path):
+        """
+        Returns:
+        str: Path of the error log file of a server operator.
+        """
+        return os.path.join(path, "%s_errors.csv" % server_operator)
+
+    def flush(self, path):
+        """
+        Write one error log file per server operator with issues, replacing
+        any existing file.
+
+        Parameters:
+        path (str): Directory of the error log files.
+
+        Returns:
+        None
+        """
+        for server_operator, records in self.records.items():
+            with open(self.log_file_path(server_operator, path), "w",
+                      encoding="utf-8") as f:
+                writer = csv.writer(f, delimiter=",", quotechar='"',
+                                    lineterminator="\n")
+                writer.writerow(LOG_HEADER)
+                writer.writerows(records)
+        return
+
+    def load(self, path):
+        """
+        Load the records of the error log files written by an earlier run,
+        e.g. to keep the issues of the operators that a partial run does not
+        harvest.
+
+        Parameters:
+        path (str): Directory of the error log files.
+
+        Returns:
+        None
+        """
+        for log_file in sorted(glob.glob(os.path.join(path, "*_errors.csv"))):
+            try:
+                with open(log_file, "r", encoding="utf-8") as f:
+                    reader = csv.reader(f, delimiter=",", quotechar='"')
+                    if next(reader, None) != LOG_HEADER:
+                        continue
+                    self.extend(record for record in reader
+                                if len(record) == len(LOG_HEADER))
+            except OSError:
+                continue
+        return
+
+    def discard(self, server_operator, server_urls=None):
+        """
+        Drop recorded issues of a server operator.
+
+        Parameters:
+        server_operator (str): Server operator (source Description).
+        server_urls (iterable, optional): Only drop the issues of these URLs.
+            All issues of the operator are dropped if not given.
+
+        Returns:
+        None
+        """
+        if server_urls is None:
+            self.records.pop(server_operator, None)
+            return
+        server_urls = set(server_urls)
+        records = [record for record in self.records.get(server_operator, [])
+                   if record[2] not in server_urls]
+        if records:
+            self.records[server_operator] = records
+        else:
+            self.records.pop(server_operator, None)
+        return
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Preview cache
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Keep the legend images and layer thumbnails of geoservices_CH.csv,
+    so that the web catalogue and GIS users get previews without requesting
+    them from the cantonal servers. Writes config.PREVIEWS_CH_CSV with the
+    cached legend and thumbnail of every layer.
+Notes:
+- Uses Python 3.9
+- Optional stage of the scraper run (config.PREVIEWS), or on its own:
+  python preview_cache.py
+- Thumbnails are the 256x256 PNG GetMap of get_map_with_retry (EPSG:4326,
+  BBOX of the layer), for WMS layers. The request is built from the layer
+  row, so no capabilities document needs to be parsed
+- Images are stored content-addressed in config.PREVIEW_PATH/objects, by
+  their SHA-256: the same legend served for hundreds of layers is kept
+  once. Beyond config.PREVIEW_CACHE_MAX_BYTES the least recently used
+  images are evicted
+- Later runs revalidate with If-None-Match / If-Modified-Since, so unchanged
+  images are not downloaded again
+- config.PREVIEW_WORKERS requests in flight, at most
+  config.PREVIEW_HOST_CONNECTIONS of them to the same host
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+import requests
+import configuration as config
+from harvest_state import load_state, save_state
+
+logger = logging.getLogger("Scraping log")
+
+# Signature of the image formats kept
+IMAGE_TYPES = [(b"\x89PNG\r\n\x1a\n", ".png"), (b"GIF87a", ".gif"),
+               (b"GIF89a", ".gif"), (b"\xff\xd8\xff", ".jpg")]
+# Query parameters of a SERVICELINK that are replaced in the GetMap request
+GETMAP_PARAMETERS = {"service", "request", "version", "layers", "styles",
+                     "srs", "crs", "bbox", "width", "height", "format",
+                     "transparent"}
+PREVIEW_FIELDS = ["OWNER", "SERVICELINK", "NAME", "LEGEND", "THUMBNAIL"]
+
+
+def image_extension(content):
+    """
+    Parameters:
+    content (bytes): A response body.
+
+    Returns:
+    str or None: The file extension of the image, None if it is no image
+        (e.g. a service exception).
+    """
+    for signature, extension in IMAGE_TYPES:
+        if content.startswith(signature):
+            return extension
+    return None
+
+
+def thumbnail_url(row):
+    """
+    Parameters:
+    row (dict): A row of geoservices_CH.csv.
+
+    Returns:
+    str or None: The GetMap URL of the thumbnail of a WMS layer, None for
+        other layers and layers without a valid BBOX.
+    """
+    if row["SERVICETYPE"] != "WMS":
+        return None
+    try:
+        xmin, ymin, xmax, ymax = (float(v) for v in row["BBOX"].split())
+    except ValueError:
+        return None
+    if not (-180 <= xmin < xmax <= 180 and -90 <= ymin < ymax <= 90):
+        return None
+    parts = urlparse(row["SERVICELINK"].strip())
+    query = [(key, value) for key, value in parse_qsl(parts.query)
+             if key.lower() not in GETMAP_PARAMETERS]
+    # WMS 1.1.1 keeps the longitude/latitude axis order of the BBOX
+    query += [("SERVICE", "WMS"), ("VERSION", "1.1.1"),
+              ("REQUEST", "GetMap"), ("LAYERS", row["NAME"]), ("STYLES", ""),
+              ("SRS", "EPSG:4326"),
+              ("BBOX", "%s,%s,%s,%s" % (xmin, ymin, xmax, ymax)),
+              ("WIDTH", "256"), ("HEIGHT", "256"), ("FORMAT", "image/png"),
+              ("TRANSPARENT", "TRUE")]
+    return urlunparse(parts._replace(query=urlencode(query, safe=":,/")))
+
+
+class PreviewCache:
+    """
+    Content-addressed image store with an index of the URLs it was fetched
+    from, thread-safe.
+
+    Parameters:
+    path (str): Directory of the store (config.PREVIEW_PATH).
+    max_bytes (int): Size of the images kept at most.
+    latency (HostLatency, optional): Timeouts per host.
+    """
+
+    def __init__(self, path, max_bytes, latency=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.latency = latency
+        self.index_file = os.path.join(path, "index.json")
+        state = load_state(self.index_file)
+        # Image by hash: "extension", "size", "used" (time of last use)
+        self.objects = state.get("objects", {})
+        # Hash by URL, with the validators of the response
+        self.urls = state.get("urls", {})
+        self.requested = set()
+        self.lock = threading.Lock()
+        self.host_slots = defaultdict(lambda: threading.Semaphore(
+            config.PREVIEW_HOST_CONNECTIONS))
+        self.sessions = threading.local()
+        self.stats = {"requests": 0, "not_modified": 0, "stored": 0,
+                      "deduplicated": 0, "failed": 0, "evicted": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def object_file(self, key):
+        """
+        Returns:
+        str: Path of an image relative to the store.
+        """
+        return "/".join(["objects", key[:2],
+                         key[2:] + self.objects[key]["extension"]])
+
+    def session(self):
+        # requests sessions are not shared between threads
+        if not hasattr(self.sessions, "session"):
+            self.sessions.session = requests.Session()
+        return self.sessions.session
+
+    def store(self, content, extension):
+        """
+        Store an image unless it is stored already.
+
+        Returns:
+        str: Its hash.
+        """
+        key = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            if key in self.objects:
+                self.stats["deduplicated"] += 1
+                return key
+            self.objects[key] = {"extension": extension,
+                                 "size": len(content), "used": time.time()}
+            self.stats["stored"] += 1
+        file_name = os.path.join(self.path, *self.object_file(key).split("/"))
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name + ".tmp", mode="wb") as f:
+            f.write(content)
+        os.replace(file_name + ".tmp", file_name)
+        return key
+
+    def fetch(self, url):
+        """
+        Fetch an image, or revalidate the cached one.
+
+        Parameters:
+        url (str): Legend or GetMap URL.
+
+        Returns:
+        str or None: Hash of the image, None if it could not be fetched.
+        """
+        host = urlparse(url).netloc
+        timeouts = self.latency.timeouts(host) if self.latency is not None \
+            else {"connect": config.CONNECT_TIMEOUT, "read": 10}
+        with self.lock:
+            self.requested.add(url)
+            entry = self.urls.get(url)
+            if entry is not None and entry["object"] not in self.objects:
+                entry = None
+            slot = self.host_slots[host]
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with slot:
+                self.count("requests")
+                response = self.session().get(
+                    url, headers=headers,
+                    timeout=(timeouts["connect"], timeouts["read"]))
+            if response.status_code == 304 and entry is not None:
+                self.count("not_modified")
+                key = entry["object"]
+            elif response.status_code == 200:
+                extension = image_extension(response.content)
+                if extension is None:
+                    raise ValueError("Response is no image (%s)" %
+                                     response.headers.get("Content-Type"))
+                key = self.store(response.content, extension)
+            else:
+                raise ValueError("HTTP response status code %s" %
+                                 response.status_code)
+        except Exception as e:
+            self.count("failed")
+            logger.info("Preview %s: %s" % (url, e))
+            with self.lock:
+                self.urls.pop(url, None)
+            return None
+        validators = {"etag": response.headers.get("ETag"),
+                      "last_modified": response.headers.get("Last-Modified")}
+        if response.status_code == 304:
+            # A 304 need not repeat the validators
+            validators = {name: validators[name] or entry.get(name)
+                          for name in validators}
+        with self.lock:
+            self.urls[url] = dict(validators, object=key)
+            self.objects[key]["used"] = time.time()
+        return key
+
+    def evict(self):
+        """
+        Remove the least recently used images until the store is no larger
+        than max_bytes, and the URLs that were not requested in this run.
+
+        Returns:
+        None
+        """
+        size = sum(image["size"] for image in self.objects.values())
+        # Oldest first, the larger of images used at the same time first
+        for key in sorted(self.objects, key=lambda k: (
+                self.objects[k]["used"], -self.objects[k]["size"])):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path,
+                                       *self.object_file(key).split("/")))
+            except OSError as e:
+                logger.error("Could not delete preview %s: %s" % (key, e))
+            size -= self.objects.pop(key)["size"]
+            self.stats["evicted"] += 1
+        self.urls = {url: entry for url, entry in self.urls.items()
+                     if url in self.requested and
+                     entry["object"] in self.objects}
+        return
+
+    def save(self):
+        save_state(self.index_file, {"objects": self.objects,
+                                     "urls": self.urls})
+
+
+def update_previews(geoservices_csv, previews_csv, path, max_bytes,
+                    latency=None):
+    """
+    Fetch or revalidate the legend and thumbnail of every layer and write
+    the previews table.
+
+    Parameters:
+    geoservices_csv (str): The layers (config.GEOSERVICES_CH_CSV).
+    previews_csv (str): Output, the cached images per layer, relative to
+        path.
+    path (str): Directory of the store (config.PREVIEW_PATH).
+    max_bytes (int): Size of the images kept at most.
+    latency (HostLatency, optional): Timeouts per host.
+
+    Returns:
+    dict: Statistics for the run report.
+    """
+    start = time.perf_counter()
+    with open(geoservices_csv, mode="r", encoding="utf8") as f:
+        layers = [(row["OWNER"], row["SERVICELINK"].strip(), row["NAME"],
+                   row["LEGEND"].strip() if row["LEGEND"].strip().startswith(
+                       "http") else None, thumbnail_url(row))
+                  for row in csv.DictReader(f, delimiter=",", quotechar='"',
+                                            lineterminator="\n")]
+    urls = list(dict.fromkeys(url for layer in layers for url in layer[3:]
+                              if url is not None))
+
+    os.makedirs(path, exist_ok=True)
+    cache = PreviewCache(path, max_bytes, latency)
+    with ThreadPoolExecutor(max_workers=config.PREVIEW_WORKERS) as pool:
+        keys = dict(zip(urls, pool.map(cache.fetch, urls)))
+    cache.evict()
+    cache.save()
+
+    def object_file(url):
+        key = keys.get(url)
+        return cache.object_file(key) if key in cache.objects else ""
+
+    with open(previews_csv, mode="w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f, delimiter=",", quotechar='"',
+                            lineterminator="\n")
+        writer.writerow(PREVIEW_FIELDS)
+        for owner, service_link, name, legend, thumbnail in layers:
+            writer.writerow([owner, service_link, name, object_file(legend),
+                             object_file(thumbnail)])
+
+    report = dict(cache.stats)
+    report.update({
+        "urls": len(urls), "images": len(cache.objects),
+        "bytes": sum(image["size"] for image in cache.objects.values()),
+        "seconds": round(time.perf_counter() - start, 1)})
+    return report
+
+
+if __name__ == "__main__":
+    report = update_previews(config.GEOSERVICES_CH_CSV, config.PREVIEWS_CH_CSV,
+                             config.PREVIEW_PATH,
+                             config.PREVIEW_CACHE_MAX_BYTES)
+    print(json.dumps(report, indent=1, sort_keys=True))
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Profiling
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Profile a harvest per source (python scraper.py --profile), to find
+    out whether OWSLib parsing, the scrapers, the GetMap probes or writing
+    the rows make a run slow, and which endpoints cost the most.
+Notes:
+- Uses Python 3.9
+- A sampling profiler: a thread per process takes the stacks of the threads
+  working on a source every config.PROFILE_INTERVAL seconds. Wall and CPU
+  time are measured per source and stage (fetch, parse, GetMap probes,
+  scrape, write)
+- tracemalloc traces the allocations of the CPU stage (parsing and
+  scraping) of every source: its peak and the lines that allocated the
+  most. With config.PARSE_WORKERS = 0 the CPU stage runs in the main
+  process, next to the fetch threads, whose allocations may then be
+  counted as well
+- Output in config.PROFILE_PATH, replaced by every profiled run:
+  sources/<operator>/<endpoint>.collapsed and .allocations.txt per source,
+  operators/<operator>.collapsed and .allocations.txt per operator, and
+  report.txt / report.json ranking the endpoints
+- .collapsed files are collapsed stacks ("frame;frame;frame count"), the
+  input of flamegraph.pl or https://www.speedscope.app
+- Profiling slows the run down, tracemalloc by about a factor of two
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+import configuration as config
+from harvest_state import save_state
+
+# Outermost function of a stack -> stage of the harvest it belongs to
+STAGE_FUNCTIONS = {"fetch_capabilities": "fetch", "get_version": "parse",
+                   "open_service": "parse", "get_map_with_retry": "getmap",
+                   "scrape_service_layers": "scrape", "write_rows": "write"}
+STAGES = ["fetch", "parse", "getmap", "scrape", "write", "other"]
+# Frames of a thread that waits for room on the pipeline queue, not samples
+# of the source
+IDLE_FRAMES = {("queue.py", "put")}
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+class SourceProfile:
+    """
+    The profile of a source, picklable so that the worker processes can
+    return it.
+
+    Parameters:
+    source (dict): Source information.
+    """
+
+    def __init__(self, source):
+        self.operator = source['Description']
+        self.url = source['URL']
+        self.stacks = Counter()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak = 0
+        # (file:line, size, count) of the lines that allocated the most
+        self.allocations = []
+
+    def merge(self, other):
+        self.stacks.update(other.stacks)
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.peak = max(self.peak, other.peak)
+        self.allocations = top_allocations(
+            self.allocations + other.allocations)
+
+    def stages(self):
+        """
+        Returns:
+        dict: The number of samples per stage.
+        """
+        stages = Counter()
+        for stack, count in self.stacks.items():
+            stages[stack_stage(stack)] += count
+        return stages
+
+
+def stack_stage(stack):
+    """
+    Parameters:
+    stack (str): A collapsed stack.
+
+    Returns:
+    str: The stage of its outermost frame in STAGE_FUNCTIONS, "other" if
+        there is none.
+    """
+    for frame in stack.split(";"):
+        stage = STAGE_FUNCTIONS.get(frame.rsplit(":", 1)[-1])
+        if stage is not None:
+            return stage
+    return "other"
+
+
+def top_allocations(allocations):
+    """
+    Returns:
+    list: The config.PROFILE_TOP_ALLOCATIONS largest allocations of a list of
+        (file:line, size, count), those of the same line added up.
+    """
+    totals = {}
+    for line, size, count in allocations:
+        total = totals.setdefault(line, [0, 0])
+        total[0] += size
+        total[1] += count
+    return sorted(((line, size, count) for line, (size, count)
+                   in totals.items()), key=lambda a: -a[1])[
+        :config.PROFILE_TOP_ALLOCATIONS]
+
+
+@lru_cache(maxsize=None)
+def short_path(filename):
+    """
+    Returns:
+    str: The path of a source file relative to the repository, or to the
+        sys.path entry it is found in, e.g. "scraper/default.py" or
+        "owslib/wms.py".
+    """
+    if filename.startswith(os.getcwd() + os.sep):
+        return os.path.relpath(filename).replace(os.sep, "/")
+    best = None
+    for entry in sys.path:
+        entry = os.path.abspath(entry or os.curdir)
+        if filename.startswith(entry + os.sep) and (
+                best is None or len(entry) > len(best)):
+            best = entry
+    if best is None:
+        return os.path.basename(filename)
+    return os.path.relpath(filename, best).replace(os.sep, "/")
+
+
+def collapse(frame):
+    """
+    Parameters:
+    frame (frame): The innermost frame of a thread.
+
+    Returns:
+    str or None: The stack, outermost frame first, None if the thread is
+        idle.
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        name = (short_path(code.co_filename), code.co_name)
+        if name in IDLE_FRAMES:
+            return None
+        frames.append("%s:%s" % name)
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class Sampler(threading.Thread):
+    """
+    Samples the stacks of the threads registered with a profile.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.profiles = {}
+
+    def register(self, profile):
+        with self.lock:
+            self.profiles[threading.get_ident()] = profile
+
+    def unregister(self):
+        with self.lock:
+            self.profiles.pop(threading.get_ident(), None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, profile in self.profiles.items():
+                    stack = collapse(frames.get(thread_id))
+                    if stack:
+                        profile.stacks[stack] += 1
+
+
+def get_sampler():
+    # One sampler per process, started on first use
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = Sampler(config.PROFILE_INTERVAL)
+            _sampler.start()
+        return _sampler
+
+
+@contextmanager
+def profile_source(source, memory=False):
+    """
+    Profile the work of the current thread on a source.
+
+    Parameters:
+    source (dict): Source information.
+    memory (bool): Trace the allocations as well.
+
+    Yields:
+    SourceProfile: The profile, complete when the block is left.
+    """
+    profile = SourceProfile(source)
+    sampler = get_sampler()
+    if memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        baseline = tracemalloc.get_traced_memory()[0]
+    sampler.register(profile)
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield profile
+    finally:
+        profile.cpu = time.thread_time() - cpu
+        profile.wall = time.perf_counter() - wall
+        sampler.unregister()
+        if memory:
+            profile.peak = tracemalloc.get_traced_memory()[1] - baseline
+            ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+                      tracemalloc.Filter(False, __file__)]
+            after = tracemalloc.take_snapshot().filter_traces(ignore)
+            profile.allocations = top_allocations(
+                ("%s:%s" % (short_path(diff.traceback[0].filename),
+                            diff.traceback[0].lineno),
+                 diff.size_diff, diff.count_diff)
+                for diff in after.compare_to(before.filter_traces(ignore),
+                                             "lineno")
+                if diff.size_diff > 0)
+
+
+def run_profiled(function, source, *args):
+    """
+    Call function with the CPU stage of a source profiled, e.g. in a worker
+    process.
+
+    Returns:
+    tuple: (result of function, SourceProfile)
+    """
+    with profile_source(source, memory=True) as profile:
+        result = function(source, *args)
+    return result, profile
+
+
+def file_name(text):
+    # A readable file name for an operator or URL, unique by its hash
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", re.sub(r"^\w+://", "", text))
+    return "%s_%s" % (name.strip("_")[:80],
+                      hashlib.sha1(text.encode("utf-8")).hexdigest()[:8])
+
+
+class Profiler:
+    """
+    The profiles of all sources of a run.
+
+    Parameters:
+    path (str): Output directory (config.PROFILE_PATH).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.profiles = {}
+
+    def add(self, profile):
+        with self.lock:
+            key = (profile.operator, profile.url)
+            if key in self.profiles:
+                self.profiles[key].merge(profile)
+            else:
+                self.profiles[key] = profile
+
+    @contextmanager
+    def profile(self, source, memory=False):
+        """
+        Profile a block of work on a source in this process, see
+        profile_source.
+        """
+        with profile_source(source, memory) as profile:
+            yield profile
+        self.add(profile)
+
+    def write_stacks(self, file_path, stacks):
+        with open(file_path, mode="w", encoding="utf8") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write("%s %s\n" % (stack, count))
+
+    def write_allocations(self, file_path, title, profile):
+        with open(file_path, mode="w", encoding="utf8") as f:
+            f.write("%s\npeak %.1f MB\n\n" % (title, profile.peak / 1e6))
+            for line, size, count in profile.allocations:
+                f.write("%10.1f kB %8s blocks  %s\n" % (size / 1e3, count,
+                                                       line))
+
+    def write(self):
+        """
+        Write the per-source and per-operator files and the report.
+
+        Returns:
+        dict: The most expensive endpoints, for the run report.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+        operators = {}
+        for (operator, url), profile in sorted(self.profiles.items()):
+            source_path = os.path.join(self.path, "sources",
+                                       file_name(operator))
+            os.makedirs(source_path, exist_ok=True)
+            base = os.path.join(source_path, file_name(url))
+            self.write_stacks(base + ".collapsed", profile.stacks)
+            self.write_allocations(base + ".allocations.txt",
+                                   "%s %s" % (operator, url), profile)
+            total = operators.setdefault(operator, SourceProfile(
+                {"Description": operator, "URL": None}))
+            total.merge(profile)
+        os.makedirs(os.path.join(self.path, "operators"), exist_ok=True)
+        for operator, profile in operators.items():
+            base = os.path.join(self.path, "operators", file_name(operator))
+            self.write_stacks(base + ".collapsed", profile.stacks)
+            self.write_allocations(base + ".allocations.txt", operator,
+                                   profile)
+
+        def summary(profile):
+            samples = sum(profile.stacks.values())
+            stages = profile.stages()
+            return {"operator": profile.operator, "url": profile.url,
+                    "wall": round(profile.wall, 3),
+                    "cpu": round(profile.cpu, 3), "samples": samples,
+                    "peak_mb": round(profile.peak / 1e6, 1),
+                    "stages": {stage: round(stages[stage] / samples, 3)
+                               for stage in STAGES if stages[stage]}
+                    if samples else {}}
+
+        endpoints = sorted((summary(profile)
+                            for profile in self.profiles.values()),
+                           key=lambda s: (-s["cpu"], -s["wall"]))
+        stages = Counter()
+        for profile in self.profiles.values():
+            stages.update(profile.stages())
+        report = {
+            "endpoints": endpoints,
+            "operators": sorted((summary(profile)
+                                 for profile in operators.values()),
+                                key=lambda s: (-s["cpu"], -s["wall"])),
+            "stages": {stage: stages[stage] for stage in STAGES}}
+        save_state(os.path.join(self.path, "report.json"), report)
+
+        with open(os.path.join(self.path, "report.txt"), mode="w",
+                  encoding="utf8") as f:
+            total = sum(stages.values()) or 1
+            f.write("Samples per stage: %s\n\n" % ", ".join(
+                "%s %.0f%%" % (stage, 100 * stages[stage] / total)
+                for stage in STAGES))
+            f.write("%4s %8s %8s %8s  %s\n" % (
+                "rank", "cpu s", "wall s", "peak MB", "endpoint / stages"))
+            for rank, endpoint in enumerate(endpoints, 1):
+                f.write("%4s %8.2f %8.2f %8.1f  %s %s\n%34s%s\n" % (
+                    rank, endpoint["cpu"], endpoint["wall"],
+                    endpoint["peak_mb"], endpoint["operator"],
+                    endpoint["url"], "", " ".join(
+                        "%s %.0f%%" % (stage, 100 * share)
+                        for stage, share in endpoint["stages"].items())))
+        return {"path": self.path, "stages": report["stages"],
+                "endpoints": endpoints[:10]}
@@ -12,51 +12,99 @@ Notes:
 """
 
 import os
+import queue
+import multiprocessing
 import requests
 import csv
-from owslib.wms import WebMapService
-from owslib.wmts import WebMapTileService
-from owslib.wfs import WebFeatureService
 import sys
 import logging
+import threading
 import configuration as config
+from operator_errors import OperatorErrorLog, cet
+from layer_table import LayerTable
+import profiling
+from harvest_state import (FailureHistory, HostLatency, ProtocolCache,
+                           save_state)
 import importlib
 import glob
+import fnmatch
+import argparse
 from collections import defaultdict
 from statistics import mean
 import xml.etree.ElementTree as ET
 import re
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
-from googleapiclient.http import BatchHttpRequest
-import httplib2
 import json
-import pytz
-from datetime import datetime, timezone
+from datetime import datetime
+from urllib.parse import parse_qsl, urlparse
 import shutil
+import heapq
+import tempfile
+import zlib
+from contextlib import nullcontext
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                FIRST_COMPLETED, wait)
 
 # globals
+# Heavy modules (OWSLib, pyproj, the Google API client) are imported where
+# they are first used, so that a short run starts quickly; check with
+# check-startup-time.py
 sys.path.insert(0, config.SOURCE_SCRAPER_DIR)
+logger = logging.getLogger("Scraping log")
+
+# Issues found during this run, written to the operator log files at the end
+error_log = OperatorErrorLog()
+# The issues of the source scrape_capabilities works on in this thread, if
+# any; other threads (e.g. the fetch threads) record to error_log
+source_error_log = threading.local()
 
 service_keys = (("WMSGetCap", "n.a."),
                 ("WMTSGetCap", "n.a."), ("WFSGetCap", "n.a."))
+# Service types in the order they are tried, and whether their layers can
+# have child/parent relations (we assume only WMSs can)
+SERVICE_TYPES = {"WMS": True, "WMTS": False, "WFS": False}
+
+def configure_logger(mode="a"):
+    """
+    Attach the file handler writing to config.LOG_FILE to the scraping
+    logger. The main process truncates the log file ("w"), the parse worker
+    processes append to it ("a").
+
+    Parameters:
+    mode (str): File mode of the log file.
 
-def get_map_with_retry(service, layer, timeout=10):
+    Returns:
+    None
+    """
+    logger.setLevel(logging.INFO)
+    fh = logging.FileHandler(config.LOG_FILE, mode, "utf-8")
+    fh.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(filename)s >"
+                                  "%(funcName)17s(): Line %(lineno)s - "
+                                  "%(levelname)s - %(message)s")
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+    return
+
+
+def get_map_with_retry(service, layer, timeouts=None):
     """
     Retrieves a map image from an OGC Web Map Service (WMS) with a specified timeout. If a timeout
-    occurs, the function retries the request with a longer timeout.
+    occurs, the function retries the request.
 
     Parameters:
         service (owslib.wms.WebMapService): The WMS service object.
         layer (str): The name of the layer to request.
-        timeout (int, optional): The initial timeout duration in seconds. Defaults to 10.
+        timeouts (dict, optional): The "read" timeout in seconds and the
+            number of "retries" for the host of the service, see
+            HostLatency.timeouts. Defaults to 10 seconds and one retry.
 
     Returns:
         bytes: The map image as a byte stream.
 
     Raises:
-        Exception: Propagates exceptions that occur during the WMS getmap request, except for timeouts.
+        Exception: Propagates exceptions that occur during the WMS getmap request, and the last timeout.
     """
+    timeouts = timeouts or {"read": 10, "retries": 1}
     bbox = service.contents[layer].boundingBoxWGS84
     params = {
         'layers': [layer],
@@ -65,18 +113,18 @@ def get_map_with_retry(service, layer, timeout=10):
         'size': (256, 256),
         'format': 'image/png',
         'transparent': True,
-        'timeout': timeout
+        'timeout': timeouts["read"]
     }
 
-    try:
-        response = service.getmap(**params)
-        return response
-    except requests.exceptions.Timeout:
-        print(f"Timeout occurred for layer {layer}. Retrying with a longer timeout.")
-        #logger.warning(f"Timeout occurred for layer {layer}. Retrying with a longer timeout.")
-        params['timeout'] = 50
-        response = service.getmap(**params)
-        return response
+    for attempt in range(timeouts["retries"] + 1):
+        try:
+            response = service.getmap(**params)
+            return response
+        except requests.exceptions.Timeout:
+            if attempt == timeouts["retries"]:
+                raise
+            logger.warning("Timeout occurred for layer %s. Retrying." % layer)
+
 
 def service_result_empty():
     """
@@ -107,19 +155,27 @@ def service_result_empty():
     return SERVICE_RESULT
 
 
-def get_version(input_url):
+def get_version(input_url, xml_data=None, timeouts=None):
     """
     Retrieve the version attribute from an XML response from a geoservice at
     the input URL.
 
     Parameters:
     input_url (str): URL to retrieve XML data from.
+    xml_data (bytes, optional): Capabilities document that has already been
+        fetched from input_url. If given, no request is made.
+    timeouts (dict, optional): "connect" and "read" timeout in seconds, see
+        HostLatency.timeouts.
 
     Returns:
     str or None: The version attribute value or None if not found.
     """
-    response = requests.get(input_url)
-    xml_data = response.content
+    if xml_data is None:
+        timeouts = timeouts or {"connect": config.CONNECT_TIMEOUT,
+                                "read": config.CAPABILITIES_TIMEOUT}
+        response = requests.get(input_url, timeout=(timeouts["connect"],
+                                                    timeouts["read"]))
+        xml_data = response.content
     root = ET.fromstring(xml_data)
     try:
         version = root.attrib["version"]
@@ -141,14 +197,34 @@ def write_file(input_dict, output_file):
     Returns:
     None
     """
+    write_rows([input_dict], output_file)
+    return
+
+
+def write_rows(rows, output_file):
+    """
+    Write a list of dictionaries to a CSV file in one go. If the file exists,
+    the rows are appended to it. If the file does not exist, a new file is
+    created with a header taken from the keys of the first row.
+
+    Parameters:
+    rows (list or LayerTable): Dictionaries to be written to file, all with
+        the same keys.
+    output_file (str): Path of the output file.
+
+    Returns:
+    None
+    """
+    if not rows:
+        return
     append_or_write = "a" if os.path.isfile(output_file) else "w"
     with open(output_file, append_or_write, encoding="utf-8") as f:
-        dict_writer = csv.DictWriter(f, fieldnames=list(input_dict.keys()),
+        dict_writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()),
                                      delimiter=",", quotechar='"',
                                      lineterminator="\n")
         if append_or_write == "w":
             dict_writer.writeheader()
-        dict_writer.writerow(input_dict)
+        dict_writer.writerows(rows)
     return
 
 
@@ -168,72 +244,336 @@ def load_source_collection():
     return sources
 
 
-def is_online(source):
+def source_matches(source, selector):
+    """
+    Check whether a source is selected by a --only/--exclude selector. A
+    selector matches the server operator (source Description, e.g. "KT_ZH"),
+    the host of the GetCapabilities URL (e.g. "wms.zh.ch") or the URL
+    itself. Shell-style wildcards are allowed (e.g. "KT_*" or
+    "*service=wfs*"); the comparison is case-insensitive.
+
+    Parameters:
+    source (dict): A dictionary with GetCapabilities source parameters.
+    selector (str): The selector.
+
+    Returns:
+    bool: True if the selector matches the source.
+    """
+    selector = selector.strip().lower()
+    server_url = source['URL'].strip().lower()
+    candidates = (source['Description'].strip().lower(),
+                  urlparse(server_url).hostname or "", server_url)
+    return any(fnmatch.fnmatchcase(candidate, selector)
+               for candidate in candidates)
+
+
+def select_sources(sources, only=None, exclude=None):
+    """
+    Select the sources of a partial run.
+
+    Parameters:
+    sources (list): All sources, as loaded by load_source_collection.
+    only (list, optional): Selectors; if given, a source must match one.
+    exclude (list, optional): Selectors; a source matching one is dropped.
+
+    Returns:
+    list: The selected sources, in the order of the source collection.
+    """
+    return [source for source in sources
+            if (not only or any(source_matches(source, s) for s in only))
+            and not any(source_matches(source, s) for s in exclude or [])]
+
+
+def looks_like_capabilities(head):
     """
-    Test if a server is online and reachable.
+    Check the first bytes of a response.
+
+    Parameters:
+    head (bytes): The first bytes of the (decompressed) response body.
+
+    Returns:
+    bool: True if they look like an XML capabilities document rather than
+        an HTML error page.
+    """
+    head = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    return head.startswith(b"<") and not head.startswith(
+        (b"<html", b"<!doctype html"))
+
+
+def open_capabilities(source, transport=None, timeouts=None):
+    """
+    Liveness check of a server that hands the open response on instead of
+    downloading the document twice. Only the headers and the first bytes of
+    the GetCapabilities response are read, with the timeouts of the host
+    (HostLatency), so dead hosts fail fast; requests that time out are
+    retried as often as the host's timeouts allow. Issues are added to the
+    operator's error log.
 
     Parameters:
     source (dict): A dictionary with GetCapabilities source parameters,
         including 'URL'.
+    transport (CapabilitiesTransport, optional): HTTP client shared by the
+        fetch threads. Without, requests is used.
+    timeouts (dict, optional): "connect" and "read" timeout in seconds and
+        "retries", see HostLatency.timeouts. By default config.CONNECT_TIMEOUT
+        and config.CAPABILITIES_TIMEOUT, without retries.
 
     Returns:
-    bool: True if the server is online, False otherwise.
+    CapabilitiesStream or None: The open response, to be read and closed by
+        the caller, if the server is online and serves something that looks
+        like a capabilities document; None otherwise.
     """
     server_operator = source['Description']
     server_url = source['URL']
+    from http_transport import is_timeout, open_requests_stream
+    timeouts = timeouts or {"connect": config.CONNECT_TIMEOUT,
+                            "read": config.CAPABILITIES_TIMEOUT,
+                            "retries": 0}
+    stream = None
     try:
-        request = requests.get(server_url)
-        if request.status_code == 200:
-            success = True
-        else:
-            success = False
+        for attempt in range(timeouts["retries"] + 1):
+            try:
+                if transport is not None:
+                    stream = transport.open(server_url, timeouts)
+                else:
+                    stream = open_requests_stream(
+                        server_url, (timeouts["connect"], timeouts["read"]))
+                break
+            except Exception as e_request:
+                if attempt == timeouts["retries"] or \
+                        not is_timeout(e_request):
+                    raise
+                logger.info("%s %s: %s, retrying" % (
+                    server_operator, server_url, e_request))
+        if stream.status_code != 200:
             error_details = ("GET requested yielded HTTP response status "
-                             "code %s" % request.status_code)
+                             "code %s" % stream.status_code)
+        elif not looks_like_capabilities(stream.head(512)):
+            error_details = "Response does not look like a capabilities document"
+        else:
+            return stream
     except Exception as e_request:
-        success = False
-        error_details = e_request
+        error_details = str(e_request) or type(e_request).__name__
         logger.info("%s %s: %s" % (server_operator, server_url, e_request))
+    if stream is not None:
+        stream.close()
 
-    # If there has been a problem, add the details to the operator's error
+    # There has been a problem, add the details to the operator's error
     # log file
-    if not success:
-        log_to_operator_csv(server_operator, server_url, error_details)
-    return success
+    log_to_operator_csv(server_operator, server_url, error_details)
+    return None
+
+
+def service_types_to_try(hint=None):
+    """
+    The order in which the service types are tried: Web Map Service (WMS),
+    Web Map Tile Service (WMTS), Web Feature Service (WFS), or the service
+    type of the hint first.
+
+    Parameters:
+    hint (dict, optional): The protocol that last worked, with
+        "service_type".
+
+    Returns:
+    list: The service types.
+    """
+    service_types = list(SERVICE_TYPES)
+    if hint and hint.get("service_type") in SERVICE_TYPES:
+        service_types.remove(hint["service_type"])
+        service_types.insert(0, hint["service_type"])
+    return service_types
+
+
+def create_service(server_url, service_type, version, document=None):
+    """
+    Create the OWSLib service object of a service type.
+
+    Parameters:
+    server_url (str): GetCapabilities URL of the service.
+    service_type (str): "WMS", "WMTS" or "WFS".
+    version (str or None): Service version, None to use the default.
+    document (bytes, optional): Capabilities document to parse. If None,
+        OWSLib fetches the capabilities itself.
+
+    Returns:
+    var: The OWSLib service object.
+    """
+    if service_type == "WMS":
+        from owslib.wms import WebMapService
+        if version is not None:
+            return WebMapService(server_url, version=version, xml=document)
+        return WebMapService(server_url, xml=document)
+    if service_type == "WMTS":
+        from owslib.wmts import WebMapTileService
+        return WebMapTileService(server_url, xml=document)
+    from owslib.wfs import WebFeatureService
+    return WebFeatureService(server_url, version=version or '2.0.0',
+                             xml=document)
+
+
+def parse_service(server_url, source_version, document=None, hint=None):
+    """
+    Create the OWSLib service object of a service, trying Web Map Service
+    (WMS), Web Map Tile Service (WMTS) and Web Feature Service (WFS) in turn.
+
+    Parameters:
+    server_url (str): GetCapabilities URL of the service.
+    source_version (str or None): Service version, None to use the default.
+    document (bytes, optional): Capabilities document to parse. If None,
+        OWSLib fetches the capabilities itself.
+    hint (dict, optional): The protocol that last worked for this service
+        ("service_type", "version"), tried first.
+
+    Returns:
+    tuple: (service, service_type, children_possible). service and
+        service_type are None if no valid service could be identified.
+    """
+    for service_type in service_types_to_try(hint):
+        version = source_version
+        if version is None and hint and \
+                hint.get("service_type") == service_type:
+            version = hint.get("version")
+        try:
+            service = create_service(server_url, service_type, version,
+                                     document)
+            if document is None or len(service.contents) > 0:
+                return service, service_type, SERVICE_TYPES[service_type]
+        except Exception:
+            pass
+
+    return None, None, False
+
+
+def open_service(server_url, source_version, xml=None, hint=None):
+    """
+    Determine whether a service is a Web Map Service (WMS), a Web Map Tile
+    Service (WMTS) or a Web Feature Service (WFS) and create the matching
+    OWSLib service object. If a capabilities document has already been
+    fetched, OWSLib parses it directly. Only if that fails OWSLib is left to
+    fetch the capabilities itself, as it did before documents were prefetched.
+
+    Parameters:
+    server_url (str): GetCapabilities URL of the service.
+    source_version (str or None): Service version, None to use the default.
+    xml (bytes, optional): Prefetched capabilities document.
+    hint (dict, optional): The protocol that last worked for this service
+        ("service_type", "version"), tried first.
+
+    Returns:
+    tuple: (service, service_type, children_possible, attempts). service and
+        service_type are None if no valid service could be identified,
+        attempts is the number of service types tried.
+    """
+    service_types = service_types_to_try(hint)
+    attempts = 0
+    documents = [xml, None] if xml is not None else [None]
+    for document in documents:
+        service, service_type, children_possible = parse_service(
+            server_url, source_version, document, hint)
+        if service_type is not None:
+            attempts += service_types.index(service_type) + 1
+            return service, service_type, children_possible, attempts
+        attempts += len(service_types)
+    return None, None, False, attempts
 
 
-def get_service_info(source):
+def walk_layer_tree(service, children_possible=True):
     """
-    Extracts information from an OGC web service (WMS, WMTS, WFS) using the 
-    OWSLib library. This function takes a dictionary called "source" as input 
-    and runs an OGC GetCapabilities extraction. The function tries to determine 
-    if the service is a Web Map Service (WMS), Web Map Tile Service (WMTS), or 
-    Web Feature Service (WFS) based on the version number in the source URL. If 
-    the version number is invalid, the function writes an error message to a 
+    Walk the layer tree of a service depth-first, in document order, and
+    visit every layer once.
+
+    OWSLib lists all named layers in service.contents, nested ones included.
+    The parent of a layer in the tree is its nearest named ancestor; layers
+    without one are roots. The TREE path of every layer (its own and its
+    named ancestors' ids, from the root) is computed once, when it is
+    visited.
+
+    Parameters:
+    service (var): GetCap results (WMS, WMTS or WFS).
+    children_possible (bool): Whether the layers of this service type can
+        have children. If not, every layer is a root.
+
+    Yields:
+    tuple: (layer id, parent id, parent path), parent id and parent path
+        None for root layers.
+    """
+    contents = service.contents
+    children = defaultdict(list)
+    roots = []
+    for layer_id, layer in contents.items():
+        parent = getattr(layer, "parent", None) if children_possible else None
+        # Skip unnamed layers (not in contents), which only group others
+        while parent is not None and contents.get(parent.id) is not parent:
+            parent = parent.parent
+        if parent is None:
+            roots.append(layer_id)
+        else:
+            children[parent.id].append(layer_id)
+
+    visited = set()
+    paths = {}
+    stack = [(layer_id, None) for layer_id in reversed(roots)]
+    while stack:
+        layer_id, parent_id = stack.pop()
+        if layer_id in visited:
+            continue
+        visited.add(layer_id)
+        parent_path = paths.get(parent_id)
+        segment = layer_id.replace('"', '')
+        paths[layer_id] = segment if parent_path is None else "%s/%s" % (
+            parent_path, segment)
+        yield layer_id, parent_id, parent_path
+        stack.extend((child_id, layer_id)
+                     for child_id in reversed(children.get(layer_id, [])))
+
+
+def get_service_info(source, xml=None, protocol=None, timeouts=None):
+    """
+    Extracts information from an OGC web service (WMS, WMTS, WFS) using the
+    OWSLib library. This function takes a dictionary called "source" as input
+    and runs an OGC GetCapabilities extraction. The function tries to determine
+    if the service is a Web Map Service (WMS), Web Map Tile Service (WMTS), or
+    Web Feature Service (WFS) based on the version number in the source URL. If
+    the version number is invalid, the function writes an error message to a
     log file.
 
-    The function then creates a service object using either WebMapService, 
-    WebMapTileService, or WebFeatureService from the OWSLib library. The 
-    function then loops through all the layers in the service contents and 
-    checks if the layer is a parent or child layer. For each layer, the function 
-    calls write_service_info to write the service information and layer tree.
+    The function then creates a service object using either WebMapService,
+    WebMapTileService, or WebFeatureService from the OWSLib library. The
+    function then walks the layer tree once (walk_layer_tree). For each layer,
+    the function calls scrape_layer_info to scrape the service information
+    and layer tree.
 
-    If an error occurs, the function writes an error message to a log file and 
-    returns False.
+    If an error occurs, the function writes an error message to a log file and
+    returns None.
 
     Parameters:
-        source (dict): A dictionary containing the GetCapabilities URL and 
+        source (dict): A dictionary containing the GetCapabilities URL and
         Description of the OGC web service.
+        xml (bytes, optional): The GetCapabilities document of the service if
+        it has already been fetched.
+        protocol (dict, optional): The protocol that last worked for this
+        service ("service_type", "version"), tried before the cascade. It is
+        replaced in place with the protocol found, the number of attempts
+        and the attempts saved compared to the cascade.
+        timeouts (dict, optional): Timeouts and retries of the requests to
+        the host of the service, see HostLatency.timeouts.
 
     Returns:
-        None
+        LayerTable or None: The scraped layer rows, None if the service could
+        not be harvested.
     """
     server_operator = source['Description']
     server_url = source['URL']
+    rows = []
+    hint = None
+    if protocol is not None:
+        hint = dict(protocol)
+        protocol.clear()
 
     try:
         # Check if this service has a valid service version number. If not,
         # set version to None (i.e., use default)
-        source_version = get_version(source['URL'])
+        source_version = get_version(source['URL'], xml, timeouts)
         match = re.match(r"^\d+\.\d+\.\d+$", source_version)
         if not match:
             error_details = "Invalid service version number. Scraper will try the default."
@@ -243,142 +583,75 @@ def get_service_info(source):
             source_version = None
 
         # Check if this service is a WMS, a WMTS or a WFS
-        service_type = None
-        try:
-            if source_version is not None:
-                service = WebMapService(server_url, version=source_version)
-            else:
-                service = WebMapService(server_url)
-            service_type = "WMS"
-            # We assume WMSs can have child/parent relations
-            children_possible = True
-        except:
-            pass
-
-        if service_type is None:
-            try:
-                service = WebMapTileService(server_url)
-                service_type = "WMTS"
-                # We assume WMTSs can't have child/parent relations
-                children_possible = False
-            except:
-                pass
-
-        if service_type is None:
-            try:
-                if source_version is None:
-                    service = WebFeatureService(server_url, version='2.0.0')
-                else:
-                    service = WebFeatureService(server_url,
-                                                version=source_version)
-                service_type = "WFS"
-                # We assume WFSs can't have child/parent relations
-                children_possible = False
-            except:
-                pass
+        service, service_type, children_possible, attempts = open_service(
+            server_url, source_version, xml, hint)
+        if protocol is not None:
+            protocol["attempts"] = attempts
+        if protocol is not None and service_type is not None:
+            protocol["service_type"] = service_type
+            protocol["version"] = getattr(service, "version", None) or \
+                source_version
+            protocol["attempts_saved"] = \
+                list(SERVICE_TYPES).index(service_type) - \
+                service_types_to_try(hint).index(service_type)
 
         if service_type is not None:
             # I.e., we have found a valid service endpoint of type WMS, WTMS or
             # WFS
             service_title = service.identification.title
-
-            # Extract all layer names
-            layers = list(service.contents)
-            layers_done = []
-            for i in layers:
-                this_layer = service.contents[i].id
-                # Check that we have not yet processed this layer as a child of
-                # another layer before
-                if this_layer not in layers_done:
-                    # get root layer / extracting the description for simple layer
-                    # Some root WMS layers are blocked so no get map is
-                    # possible, so we check if we can load them as TOPIC
-                    # (aka al children layer active)
-                    if "wms" in server_url.lower():
-                        # Even some Root layers do not have titles therfore
-                        # skipping as well
-                        if service.contents[i].title is None:
-                            logger.warning("%s: Title is empty. Skipping." % i)
-                        else:
-                            try:
-                                # check if root layer is loadable, by trying to
-                                # call a Get Map, if it is blocked it will
-                                # raise an error
-                                service.getmap(layers=[i], srs='EPSG:4326',
-                                               bbox=(service.contents[i].boundingBoxWGS84[0],
-                                                     service.contents[i].boundingBoxWGS84[1],
-                                                     service.contents[i].boundingBoxWGS84[2],
-                                                     service.contents[i].boundingBoxWGS84[3]),
-                                               size=(256, 256), format='image/png',
-                                               transparent=True, timeout=10)
-                                # Then extract abstract etc
-                                if service_title is not None:
-                                    layertree = "%s/%s/%s" % (server_operator,
-                                                              service_title,
-                                                              i.replace('"', ''))
-                                else:
-                                    layertree = "%s/%s" % (server_operator,
-                                                           i.replace('"', ''))
-
-                                write_service_info(source, service,
-                                                   this_layer,
-                                                   layertree, group=i)
-                                layers_done.append(this_layer)
-                            except Exception as e:
-                                # Check if the exception indicates that the
-                                # request was not allowed or forbidden
-                                if any([msg in str(e) for msg in service.exceptions]):
-                                    logger.warning(
-                                        "%s: GetMap request is blocked for this layer" % i)
-                                else:
-                                    logger.error(
-                                        "%s: %s" % (
-                                            i, str(e).replace('\n', ' ').replace('\r', '')))
-                    else:
-                        if service_title is not None:
-                            layertree = "%s/%s/%s" % (server_operator,
-                                                      service_title,
-                                                      i.replace('"', ''))
-                        else:
-                            layertree = "%s/%s" % (server_operator,
-                                                   i.replace('"', ''))
-                        logger.info("Analysing %s > %s > %s" % (server_operator,
-                                                                server_url,
-                                                                this_layer))
-                        write_service_info(source, service, this_layer,
-                                           layertree, group=i)
-                        layers_done.append(this_layer)
-
-                    # Check if this layer is parent to child layers. If it is,
-                    # check the child layers
-                    if children_possible:
-                        try:
-                            number_children = len(service.contents[i].children)
-                        except AttributeError:
-                            number_children = 0
-
-                    if children_possible and number_children > 0:
-                        for j in range(number_children):
-                            this_child_layer = service.contents[i]._children[j].id
-                            if this_child_layer not in layers_done:
-                                if service_title is not None:
-                                    layertree = "%s/%s/%s" % (server_operator,
-                                                              service_title,
-                                                              i.replace('"', ''))
-                                else:
-                                    layertree = "%s/%s" % (server_operator,
-                                                           i.replace('"', ''))
-                                logger.info("Analysing %s > %s > %s >> %s" % (
-                                    server_operator, server_url, this_layer,
-                                    this_child_layer))
-                                write_service_info(source, service,
-                                                   this_child_layer, layertree,
-                                                   group=i)
-                                layers_done.append(this_child_layer)
-
+            if service_title is not None:
+                tree_prefix = "%s/%s" % (server_operator, service_title)
+            else:
+                tree_prefix = server_operator
+
+            # Walk the layer tree once, depth-first in document order. Only
+            # root layers are probed with a GetMap: some root WMS layers are
+            # blocked, so no GetMap is possible. Their children are scraped
+            # anyway
+            probe_roots = "wms" in server_url.lower()
+            layers = []
+            for layer_id, parent_id, parent_path in walk_layer_tree(
+                    service, children_possible):
+                if parent_id is None:
+                    layertree = "%s/%s" % (tree_prefix,
+                                           layer_id.replace('"', ''))
+                    group = layer_id
                 else:
-                    # This layer has already been processed
-                    pass
+                    layertree = "%s/%s" % (tree_prefix, parent_path)
+                    group = parent_id
+                    logger.info("Analysing %s > %s > %s >> %s" % (
+                        server_operator, server_url, parent_id, layer_id))
+
+                if parent_id is None and probe_roots:
+                    # Even some Root layers do not have titles therfore
+                    # skipping as well
+                    if service.contents[layer_id].title is None:
+                        logger.warning("%s: Title is empty. Skipping." %
+                                       layer_id)
+                        continue
+                    try:
+                        # check if root layer is loadable, by trying to
+                        # call a Get Map, if it is blocked it will
+                        # raise an error
+                        get_map_with_retry(service, layer_id, timeouts)
+                    except Exception as e:
+                        # Check if the exception indicates that the
+                        # request was not allowed or forbidden
+                        if any([msg in str(e) for msg in service.exceptions]):
+                            logger.warning(
+                                "%s: GetMap request is blocked for this "
+                                "layer" % layer_id)
+                        else:
+                            logger.error("%s: %s" % (
+                                layer_id, str(e).replace('\n', ' ').replace(
+                                    '\r', '')))
+                        continue
+                elif parent_id is None:
+                    logger.info("Analysing %s > %s > %s" % (
+                        server_operator, server_url, layer_id))
+
+                layers.append((layer_id, layertree, group))
+            rows = scrape_service_layers(source, service, layers)
         else:
             # Service could not be identified as valid WMS, WMTS or WFS by
             # OWSLib
@@ -386,34 +659,128 @@ def get_service_info(source):
             log_to_operator_csv(server_operator, server_url, error_details)
             logger.warning("%s > %s: %s" %
                            (server_operator, server_url, error_details))
+            return None
 
     except Exception as e_request:
         error_details = str(e_request)
         log_to_operator_csv(server_operator, server_url, error_details)
         logger.error("%s > %s: %s" %
                      (server_operator, server_url, error_details))
-        return False
+        return None
+
+    return rows
+
 
 def log_to_operator_csv(server_operator, server_url, error_details):
-    CET = pytz.timezone('Europe/Zurich')
-    timestamp = datetime.now(timezone.utc).astimezone(CET).isoformat()
+    """
+    Record an issue in the error log of a server operator. The issues are
+    kept in memory and written to <config.DEAD_SERVICES_PATH>/<operator>
+    _errors.csv once at the end of the run (see OperatorErrorLog.flush).
 
-    log_file_name = "%s_errors.csv" % server_operator
-    log_file_path = os.path.join(config.DEAD_SERVICES_PATH, log_file_name)
+    Parameters:
+    server_operator (str): Server operator (source Description).
+    server_url (str): URL (or layer name) the issue relates to.
+    error_details (str or Exception): Description of the issue.
 
-    error_log = '%s,%s,%s,"%s"' % (timestamp, server_operator, server_url,
-                                   error_details)
-    append_or_write = "a" if os.path.isfile(log_file_path) else "w"
-    with open(log_file_path, append_or_write, encoding="utf-8") as f:
-        if append_or_write == "w":
-            f.write("Timestamp,Operator,URL,Issue\n")
-        f.write(error_log + "\n")
+    Returns:
+    None
+    """
+    getattr(source_error_log, "log", error_log).record(
+        server_operator, server_url, error_details)
+    return
+
+
+def load_scraper(server_operator):
+    """
+    Load the custom scraper of a server operator (scraper/<operator>.py) or
+    the default scraper.
+
+    Parameters:
+    server_operator (str): Description of the source.
+
+    Returns:
+    module: The scraper.
+    """
+    # check if custom scraper is available
+    if importlib.util.find_spec(server_operator) is not None:
+        return importlib.import_module(server_operator, package=None)
+    return importlib.import_module('default', package=None)
+
+
+def scrape_service_layers(source, service, layers):
+    """
+    Scrape OGC GetCap results for all layers of a service, using a custom or
+    default scraper based on availability. Scrapers with a scrape_service
+    function get all layers at once and compute the service-wide fields
+    once; custom scrapers with only scrape are called layer by layer
+    (scrape_layer_info).
+
+    Parameters:
+    source (dict): Source information.
+    service (var): GetCap results.
+    layers (list): (layer name, tree structure, group name) per layer.
+
+    Returns:
+    LayerTable: The scraped layer rows; layers that failed or that the
+        scraper returned no row for (e.g. an unsupported service type) are
+        left out and logged.
+    """
+    server_operator = source['Description']
+    try:
+        scraper = load_scraper(server_operator)
+    except Exception as e_request:
+        error_details = str(e_request)
+        log_to_operator_csv(server_operator, source['URL'], error_details)
+        logger.error("%s, %s: %s" % (server_operator, source['URL'],
+                                     error_details))
+        return LayerTable()
+
+    rows = LayerTable()
+    if not hasattr(scraper, "scrape_service"):
+        for i, layertree, group in layers:
+            layer_data = scrape_layer_info(source, service, i, layertree,
+                                           group)
+            if layer_data:
+                rows.append(layer_data)
+        return rows
+
+    for i, layer_data in scraper.scrape_service(
+            source, service,
+            ((i, layertree, group, service_result_empty())
+             for i, layertree, group in layers),
+            config.MAPGEO_PREFIX):
+        if isinstance(layer_data, Exception):
+            error_details = str(layer_data)
+            log_to_operator_csv(server_operator, i, error_details)
+            logger.error("%s, %s: %s" % (server_operator, i, error_details))
+        elif layer_data:
+            rows.append(layer_data)
+        else:
+            log_unsupported_layer(server_operator, i)
+    return rows
+
+
+def log_unsupported_layer(server_operator, i):
+    """
+    Log a layer the scraper returned no row for (False or None), e.g. one of
+    an unsupported service type.
+
+    Parameters:
+    server_operator (str): Server operator.
+    i (str): Layer name.
+
+    Returns:
+    None
+    """
+    error_details = "Layer not scraped: unsupported service type"
+    log_to_operator_csv(server_operator, i, error_details)
+    logger.error("%s, %s: %s" % (server_operator, i, error_details))
     return
 
 
-def write_service_info(source, service, i, layertree, group):
+def scrape_layer_info(source, service, i, layertree, group):
     """
-    Write OGC GetCap results for a service, using a custom or default scraper 
+    Scrape OGC GetCap results for a layer, using a custom or default scraper
     based on availability.
 
     Parameters:
@@ -424,273 +791,713 @@ def write_service_info(source, service, i, layertree, group):
     group (str): Group name.
 
     Returns:
-    bool: Returns `True` if the function runs successfully, `False` otherwise.
+    dict or None: The scraped layer row, None if scraping failed.
     """
     server_operator = source['Description']
     # Load Empty parameter list
     layer_data = service_result_empty()
 
     try:
-        # check if custom scraper is available
-        scraper_spec = importlib.util.find_spec(server_operator)
-
-        # run custom scraper
-        if scraper_spec is not None:
-            scraper = importlib.import_module(server_operator, package=None)
-            layer_data = scraper.scrape(source, service, i, layertree, group,
-                                        layer_data, config.MAPGEO_PREFIX)
-
-        # run default scraper
-        else:
-            scraper = importlib.import_module('default', package=None)
-            layer_data = scraper.scrape(source, service, i, layertree, group,
-                                        layer_data, config.MAPGEO_PREFIX)
-
-        # Writing the Result file
-        write_file(layer_data, config.GEOSERVICES_CH_CSV)
-
-        return True
+        scraper = load_scraper(server_operator)
+        layer_data = scraper.scrape(source, service, i, layertree, group,
+                                    layer_data, config.MAPGEO_PREFIX)
+        if not layer_data:
+            log_unsupported_layer(server_operator, i)
+            return None
+        return layer_data
 
     except Exception as e_request:
         error_details = str(e_request)
         log_to_operator_csv(server_operator, i, error_details)
         logger.error("%s, %s: %s" % (server_operator, i, error_details))
-        return False
-
-
-def write_dataset_info(csv_filename, output_file, output_simple_file):
-    """
-    Writes the processed data in First Normal Form (NF1) to two output files:
-    one with detailed information and one with simple information (title and 
-    map geo link). This function reads data from a CSV file and processes it to 
-    bring the data into first normal form (NF1) with one entry per dataset. The 
-    processed data is then written to two output files.
-
-    Inputs
-    csv_filename: the name of the input CSV file
-    output_file: the name of the output file for the full dataset information
-    output_simple_file: the name of the output file for the simplified dataset 
-        information
-
-    Functionality
-    1. Store processed dataset IDs in geo_data_done to avoid processing the 
-       same dataset multiple times.
-    2. Loop over all rows in the CSV file and filter for unique datasets by 
-       comparing the TITLE, NAME, and OWNER fields.
-    3. For each unique dataset, create a new empty layer using the 
-       service_result_empty function and update it with the dataset information.
-    4. If there are multiple datasets with the same TITLE, NAME, and OWNER, 
-       combine the information from all datasets into a single layer.
-    5. Perform post-processing on the dataset information, such as removing 
-       duplicates from the KEYWORDS field and updating the service links 
-       (WMSGetCap, WMTSGetCap, WFSGetCap) based on the SERVICETYPE and 
-       SERVICELINK fields in the CSV file. Write the processed dataset 
-       information to the output files using the write_file function, with 
-       different keys for each file.
-    6. The full dataset information is written to output_file, while a 
-       simplified version containing only the OWNER, TITLE, and MAPGEO fields 
-       is written to output_simple_file.
+        return None
+
+
+def fetch_capabilities(n, source, num_sources, documents, history=None,
+                       transport=None, timeouts=None):
+    """
+    I/O stage of the harvest pipeline. Checks whether the server of a source
+    is online and downloads its GetCapabilities document. The result is put
+    on the bounded documents queue; when the queue is full this blocks, so
+    fetching never runs further ahead of parsing than the queue allows.
+
+    Sources that are backed off in the failure history are skipped. The
+    liveness check only reads the first bytes of the response; if they look
+    like a capabilities document, the rest of the same response is read.
 
     Parameters:
-    csv_filename: str
-        Path to the source CSV file
-    output_file: str
-        Path to the output file with detailed information
-    output_simple_file: str
-        Path to the output file with simple information
+    n (int): Index of the source in the source collection.
+    source (dict): A dictionary with GetCapabilities source parameters.
+    num_sources (int): Total number of sources, for the progress message.
+    documents (queue.Queue): Queue handing documents to the CPU stage.
+    history (FailureHistory, optional): Failure history of the sources.
+    transport (CapabilitiesTransport, optional): HTTP client shared by the
+        fetch threads (HTTP/2, compression). Without, requests is used.
+    timeouts (dict, optional): Timeouts and retries of the requests to the
+        host of the source, see HostLatency.timeouts.
 
     Returns:
     None
     """
-    # create an empty list to store already processed  datasetUID
-    geo_data_done = []
-
-    # read CSV in dict
-    lst = [*csv.DictReader(open(csv_filename, encoding="utf-8"),
-                           delimiter=",", quotechar='"', lineterminator="\n")]
-
-    for i in lst:
-        # filter for unique ID consisting of TITLE NAME and OWNER
-        lst_layers = list(filter(lambda lst: (lst['TITLE'] == i['TITLE']) and (
-            lst['NAME'] == i['NAME']) and (lst['OWNER'] == i['OWNER']), lst))
-
-        checklayer = i['OWNER']+"_"+i['TITLE'] + \
-            "_"+i['NAME']  # create a datasetUID
-
-        if checklayer not in geo_data_done:
-            # get new empty layer
-            dataset = service_result_empty()
-            dataset.update(service_keys)
-            dataset['OWNER'] = i['OWNER']
-            dataset['TITLE'] = i['TITLE']
-            dataset['NAME'] = i['NAME']
-            # check if multiple datasets are found, ege there must be WMS  WFS
-            # or WMTS if lst_layers is bigger
-
-            for j in range(len(lst_layers)):
-                # check if multiple datasets are found, ege there must be WMS,
-                # WFS or WMTS if lst_layers is bigger
-                if "layers=WMS" in dataset['MAPGEO']:
-                    dataset['MAPGEO'] = dataset['MAPGEO']
-                elif "layers=WMS" in lst_layers[j]['MAPGEO']:
-                    dataset['MAPGEO'] = lst_layers[j]['MAPGEO']
-                elif "layers=WMTS" in lst_layers[j]['MAPGEO']:
-                    dataset['MAPGEO'] = lst_layers[j]['MAPGEO']
-                dataset['ABSTRACT'] = lst_layers[j]['ABSTRACT'] if lst_layers[j]['ABSTRACT'] != "n.a." else dataset['ABSTRACT']
-                dataset['METADATA'] = lst_layers[j]['METADATA'] if lst_layers[j]['METADATA'] != "n.a." else dataset['METADATA']
-                dataset['CONTACT'] = lst_layers[j]['CONTACT'] if lst_layers[j]['CONTACT'] != "n.a." else dataset['CONTACT']
-                dataset['KEYWORDS'] = lst_layers[j]['KEYWORDS'] if lst_layers[j]['KEYWORDS'] != "n.a." else ""
-                dataset['WMSGetCap'] = lst_layers[j]['SERVICELINK'] if "wms".casefold(
-                ) in lst_layers[j]['SERVICETYPE'].casefold() else dataset['WMSGetCap']
-                dataset['WMTSGetCap'] = lst_layers[j]['SERVICELINK'] if "wmts".casefold(
-                ) in lst_layers[j]['SERVICETYPE'].casefold() else dataset['WMTSGetCap']
-                dataset['WFSGetCap'] = lst_layers[j]['SERVICELINK'] if "wfs".casefold(
-                ) in lst_layers[j]['SERVICETYPE'].casefold() else dataset['WFSGetCap']
-            # remove duplicates from keywords
-            keywordlist = dataset['KEYWORDS']
-            li = list(keywordlist.split(","))
-            keywords = list(dict.fromkeys(li))
-            dataset['KEYWORDS'] = ','.join(keywords)
-
-            # writing the datasetfile
-            datasetfile_keys = ['OWNER', 'TITLE', 'NAME', 'MAPGEO', 'ABSTRACT',
-                                'KEYWORDS', 'CONTACT', 'WMSGetCap', 'WMTSGetCap', 'WFSGetCap']
-            datasetfile = dict((k, dataset[k])
-                               for k in datasetfile_keys if k in dataset)
-            write_file(datasetfile, output_file)
-
-            # writing the simple overview file
-            datasetfile_keys = ['OWNER', 'TITLE', 'MAPGEO']
-            datasetfile = dict((k, dataset[k])
-                               for k in datasetfile_keys if k in dataset)
-            write_file(datasetfile, output_simple_file)
-
-            # add datasetID to lyer done
-            geo_data_done.append(checklayer)
+    server_operator = source['Description']
+    server_url = source['URL']
+    status = "offline"
+    xml = None
+    try:
+        if history is not None and history.should_skip(server_url):
+            status = "skipped"
+            history.record_skip(server_operator, server_url)
+            log_to_operator_csv(server_operator, server_url,
+                                history.describe(server_url))
+            logger.info("Skipping %s > %s: %s" % (
+                server_operator, server_url, history.describe(server_url)))
+            return
+
+        # Check if a custom scraper exists for this source
+        if os.path.isfile(os.path.join(config.SOURCE_SCRAPER_DIR,
+                                       "%s.py" % server_operator)):
+            scraper_type = "custom"
+        else:
+            scraper_type = "default"
+
+        status_msg = "Running %s scraper on %s > %s (source %s/%s)" % (
+            scraper_type, server_operator, server_url, n + 1, num_sources)
+        print(status_msg)
+        logger.info(status_msg)
+
+        # Check if this server is online. If yes, read the rest of its
+        # capabilities
+        stream = open_capabilities(source, transport, timeouts)
+        if stream is not None:
+            status = "online"
+            try:
+                xml = stream.read()
+            except Exception as e_request:
+                # The parse stage will let OWSLib fetch the document itself
+                logger.info("%s %s: %s" % (server_operator, server_url,
+                                           e_request))
+            finally:
+                stream.close()
+        else:
+            logger.warning("Scraping %s > %s aborted" % (
+                server_operator, server_url))
+    finally:
+        documents.put((n, source, status, xml))
     return
 
 
-def write_dataset_stats(csv_filename, output_file):
+def scrape_capabilities(source, xml, protocol=None, timeouts=None):
+    """
+    CPU stage of the harvest pipeline, run in a worker process. Parses the
+    capabilities document of a source and scrapes it into layer rows.
+
+    Parameters:
+    source (dict): A dictionary with GetCapabilities source parameters.
+    xml (bytes or None): The prefetched capabilities document.
+    protocol (dict, optional): The protocol that last worked for this
+        source, see get_service_info.
+    timeouts (dict, optional): Timeouts and retries of the requests to the
+        host of the source, see HostLatency.timeouts.
+
+    Returns:
+    tuple: (rows, errors, protocol) with the scraped layer rows (None if the
+        service could not be harvested), the operator errors recorded
+        meanwhile and the protocol found.
     """
-    Processes data from a CSV file and writes summary statistics to an output 
-    file.
+    # Collect this source's issues separately, the main process merges them.
+    # The log is per thread: with config.PARSE_WORKERS = 0 this runs in the
+    # main thread while the fetch threads keep recording to error_log
+    source_log = OperatorErrorLog()
+    source_error_log.log = source_log
+    try:
+        protocol = dict(protocol or {})
+        rows = get_service_info(source, xml, protocol, timeouts)
+    finally:
+        del source_error_log.log
+    return rows, source_log.all_records(), protocol
 
-    The function reads data from a CSV file `csv_filename` and calculates the 
-    number of occurrences of each `OWNER` and the counts and percentages of 
-    entries with non-empty fields (`KEYWORDS`, `ABSTRACT`, `CONTACT`, 
-    `METADATA`) for each `OWNER`.
 
-    The summary statistics are then written to an output file `output_file` in 
-    CSV format.
+def run_harvest(sources, history=None, output_file=None, protocols=None,
+                latency=None, profiler=None):
+    """
+    Harvests all sources in a two-stage pipeline and writes the layer rows to
+    output_file (config.GEOSERVICES_CH_CSV by default).
+
+    A pool of threads fetches the capabilities documents (I/O stage) and puts
+    them on a queue bounded by config.PIPELINE_QUEUE_SIZE. A pool of
+    config.PARSE_WORKERS processes parses and scrapes them (CPU stage), so
+    OWSLib parsing and scraping are not serialised by the GIL. With
+    config.PARSE_WORKERS = 0 the CPU stage runs inline, e.g. for debugging.
+    Results are written in the order of the source collection, so the output
+    does not depend on which worker finishes first.
 
     Parameters:
-    - csv_filename (str): The path to the input CSV file
-    - output_file (str): The path to the output CSV file
+    sources (list): The sources to harvest, as loaded by
+        load_source_collection.
+    history (FailureHistory, optional): Failure history of the sources. It
+        decides which sources are skipped and is updated with the outcome of
+        every source that is attempted.
+    output_file (str, optional): The file the layer rows are written to.
+    protocols (ProtocolCache, optional): The protocol that last worked per
+        source. It is tried before the WMS, WMTS, WFS cascade and updated
+        with the protocol found.
+    latency (HostLatency, optional): Latency histograms per host. They set
+        the timeouts and retries of the requests to a host and are updated
+        with the latencies of this run.
+    profiler (profiling.Profiler, optional): Profiles the fetch, the
+        parsing and scraping (in its worker process) and the writing of
+        every source (--profile).
 
     Returns:
-    None
+    dict: Statistics of the run for the run report: "transport" (bytes on
+        the wire, decompression time, HTTP versions; None if the transport
+        could not be set up), "protocols" (attempts, attempts saved) and
+        "latency" (hosts with learned timeouts).
     """
-    # Read in the data from the CSV file
-    data = []
-    with open(csv_filename, mode="r", encoding="utf8") as f:
-        data = list(csv.DictReader(f, delimiter=",",
-                    quotechar='"', lineterminator="\n"))
-
-    # Calculate the number of occurrences of each OWNER
-    owner_counts = defaultdict(int)
-    for entry in data:
-        owner_counts[entry['OWNER']] += 1
-
-    # Calculate the counts and percentages of entries with non-empty fields for
-    # each OWNER
-    fields = ['KEYWORDS', 'ABSTRACT', 'CONTACT', 'METADATA']
-    counts = defaultdict(lambda: defaultdict(int))
-    percentages = defaultdict(lambda: defaultdict(float))
-
-    for field in fields:
-        for entry in data:
-            if entry[field]:
-                counts[field][entry['OWNER']] += 1
-        for owner, count in counts[field].items():
-            percentages[field][owner] = count / owner_counts[owner]
-
-    # Write the results to a CSV file
-    CET = pytz.timezone('Europe/Zurich')
-    datestamp = datetime.now(timezone.utc).astimezone(CET).strftime("%Y-%m-%d")
-    with open(output_file, mode="w", encoding="utf8") as f:
-        writer = csv.DictWriter(f, fieldnames=[
-            'DATE', 'OWNER', 'DATASET_COUNT', 'KEYWORDS_COUNT', 'KEYWORDS_MISSING',
-            'KEYWORDS_PERCENTAGE', 'ABSTRACT_COUNT', 'ABSTRACT_MISSING',
-            'ABSTRACT_PERCENTAGE', 'CONTACT_COUNT', 'CONTACT_MISSING',
-            'CONTACT_PERCENTAGE', 'METADATA_COUNT', 'METADATA_MISSING',
-            'METADATA_PERCENTAGE', 'TOTAL_PERCENTAGE'], lineterminator="\n")
-        writer.writeheader()
-        for owner in owner_counts.keys():
-            row = {
-                'DATE': datestamp,
-                'OWNER': owner,
-                'DATASET_COUNT': owner_counts[owner]
-            }
-            total_percentages = []
-            for field in fields:
-                percentage = percentages[field].get(owner, None)
-                if percentage is not None:
-                    percentage = "{:.1%}".format(percentage)
-                    total_percentages.append(percentages[field][owner])
+    output_file = output_file or config.GEOSERVICES_CH_CSV
+    num_sources = len(sources)
+    documents = queue.Queue(maxsize=config.PIPELINE_QUEUE_SIZE)
+    results = {}
+    next_result = 0
+
+    def host_timeouts(source):
+        if latency is None:
+            return None
+        return latency.timeouts(urlparse(source['URL']).netloc)
+
+    def profiled(source, memory=False):
+        # Profiles a block of work on a source in --profile mode
+        if profiler is None:
+            return nullcontext()
+        return profiler.profile(source, memory)
+
+    def fetch(n, source):
+        with profiled(source):
+            fetch_capabilities(n, source, num_sources, documents, history,
+                               transport, host_timeouts(source))
+
+    def write_results():
+        # Write all results that are next in source order
+        nonlocal next_result
+        while next_result in results:
+            source, status, rows, errors, protocol = results.pop(next_result)
+            error_log.extend(errors)
+            if protocols is not None and protocol:
+                protocols.record(source['URL'], protocol)
+            if rows:
+                with profiled(source):
+                    write_rows(rows, output_file)
+            if history is not None and status != "skipped":
+                if rows is None:
+                    history.record_failure(source['URL'], error_log.last_issue(
+                        source['Description'], source['URL']))
                 else:
-                    percentage = "0%"
-                row[field + '_COUNT'] = counts[field].get(owner, 0)
-                row[field + '_MISSING'] = owner_counts[owner] - \
-                    counts[field].get(owner, 0)
-                row[field + '_PERCENTAGE'] = percentage
-            if len(total_percentages) > 0:
-                row['TOTAL_PERCENTAGE'] = "{:.1%}".format(
-                    mean(total_percentages))
+                    history.record_success(source['URL'])
+            next_result += 1
+
+    def collect(future, n, source):
+        try:
+            if profiler is None:
+                rows, errors, protocol = future.result()
             else:
-                row['TOTAL_PERCENTAGE'] = "0%"
-            writer.writerow(row)
+                (rows, errors, protocol), profile = future.result()
+                profiler.add(profile)
+        except Exception as e_worker:
+            log_to_operator_csv(source['Description'], source['URL'],
+                                str(e_worker))
+            logger.error("%s > %s: %s" % (source['Description'],
+                                          source['URL'], e_worker))
+            rows, errors, protocol = None, [], None
+        results[n] = (source, "online", rows, errors, protocol)
 
-    # Keep a timestamped copy of this statistics file
-    path, file_with_ext = os.path.split(output_file)
-    copy_file = os.path.join(path, "%s %s" % (datestamp, file_with_ext))
-    shutil.copy(output_file, copy_file)
+    try:
+        from http_transport import CapabilitiesTransport
+        transport = CapabilitiesTransport(latency=latency)
+    except Exception as e:
+        logger.error("Could not set up the %s transport, using requests: %s"
+                     % (config.HTTP_TRANSPORT, e))
+        transport = None
+    io_pool = ThreadPoolExecutor(max_workers=config.FETCH_WORKERS)
+    for n, source in enumerate(sources):
+        io_pool.submit(fetch, n, source)
+
+    cpu_pool = None
+    if config.PARSE_WORKERS > 0:
+        # Workers are spawned rather than forked: forking while the fetch
+        # threads hold locks (logging, urllib3) can deadlock the children
+        cpu_pool = ProcessPoolExecutor(
+            max_workers=config.PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_logger)
+    max_in_flight = 2 * max(config.PARSE_WORKERS, 1)
+    in_flight = {}
+    received = 0
+    try:
+        while received < num_sources or in_flight:
+            if received < num_sources and len(in_flight) < max_in_flight:
+                n, source, status, xml = documents.get()
+                received += 1
+                hint = protocols.hint(source['URL']) \
+                    if protocols is not None else None
+                if status != "online":
+                    results[n] = (source, status, None, [], None)
+                elif cpu_pool is None:
+                    with profiled(source, memory=True):
+                        results[n] = (source, status, *scrape_capabilities(
+                            source, xml, hint, host_timeouts(source)))
+                elif profiler is None:
+                    future = cpu_pool.submit(scrape_capabilities, source, xml,
+                                             hint, host_timeouts(source))
+                    in_flight[future] = (n, source)
+                else:
+                    future = cpu_pool.submit(
+                        profiling.run_profiled, scrape_capabilities, source,
+                        xml, hint, host_timeouts(source))
+                    in_flight[future] = (n, source)
+            else:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, *in_flight.pop(future))
+            write_results()
+    finally:
+        io_pool.shutdown(wait=False, cancel_futures=True)
+        # Unblock fetch threads still waiting for room on the queue
+        while not documents.empty():
+            documents.get_nowait()
+        if cpu_pool is not None:
+            cpu_pool.shutdown()
+        if transport is not None:
+            transport.close()
+    return {"transport": transport.report() if transport is not None
+            else None,
+            "protocols": protocols.report() if protocols is not None
+            else None,
+            "latency": latency.report() if latency is not None else None}
+
+
+def merge_harvest(csv_filename, harvest_file, sources, selected,
+                  protocols=None):
+    """
+    Splice the layer rows of a partial run into the existing harvest, leaving
+    the rows of the sources that were not harvested untouched.
+
+    A row of the existing harvest is replaced if its server operator was
+    harvested completely, or if its (OWNER, SERVICELINK, SERVICETYPE) is
+    that of a fresh row or of a harvested source URL. Operators often serve
+    WMS and WFS under the same base URL as separate sources, so the service
+    type of a source is taken from the SERVICE parameter of its URL or from
+    the protocol cache; only if neither knows it, the rows of all service
+    types of its SERVICELINK are replaced. The fresh rows of an operator
+    take the place of its first replaced row, so the file keeps its order by
+    source.
 
+    Parameters:
+    csv_filename (str): The existing harvest (config.GEOSERVICES_CH_CSV). It
+        is created if it does not exist.
+    harvest_file (str): The rows harvested by the partial run.
+    sources (list): All sources of the source collection.
+    selected (list): The sources harvested by the partial run.
+    protocols (ProtocolCache, optional): The service type that last worked
+        per source URL.
+
+    Returns:
+    None
+    """
+    def service_link(url):
+        return url.split("?")[0].strip().lower()
+
+    def service_type(url):
+        # "WMS", "WMTS" or "WFS", None if unknown
+        for key, value in parse_qsl(urlparse(url).query):
+            if key.lower() == "service" and value.upper() in SERVICE_TYPES:
+                return value.upper()
+        hint = protocols.hint(url) if protocols is not None else None
+        return hint["service_type"] if hint else None
+
+    fresh_rows = LayerTable()
+    if os.path.isfile(harvest_file):
+        fresh_rows = LayerTable.read_csv(harvest_file)
+    fieldnames = fresh_rows.fields if len(fresh_rows) else None
+    if os.path.isfile(csv_filename):
+        with open(csv_filename, mode="r", encoding="utf8") as f:
+            fieldnames = fieldnames or csv.DictReader(
+                f, delimiter=",", quotechar='"', lineterminator="\n").fieldnames
+    if not fieldnames:
+        return
+
+    selected_urls = {source['URL'] for source in selected}
+    complete_operators = {source['Description'] for source in selected} - {
+        source['Description'] for source in sources
+        if source['URL'] not in selected_urls}
+    replaced_links = set()
+    # (OWNER, SERVICELINK) of the selected sources of unknown service type
+    untyped_links = set()
+    for source in selected:
+        link = (source['Description'], service_link(source['URL']))
+        source_type = service_type(source['URL'])
+        if source_type is None:
+            untyped_links.add(link)
+        else:
+            replaced_links.add(link + (source_type,))
+    replaced_links.update(
+        (owner, service_link(link), link_type)
+        for owner, link, link_type in zip(
+            fresh_rows.column('OWNER'), fresh_rows.column('SERVICELINK'),
+            fresh_rows.column('SERVICETYPE')))
+    fresh_by_owner = defaultdict(list)
+    for n, owner in enumerate(fresh_rows.column('OWNER')):
+        fresh_by_owner[owner].append(n)
+
+    # The existing rows are streamed, only the fresh ones are in memory
+    temp_file = csv_filename + ".tmp"
+    with open(temp_file, mode="w", encoding="utf-8") as f:
+        dict_writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=",",
+                                     quotechar='"', lineterminator="\n")
+        dict_writer.writeheader()
+        if os.path.isfile(csv_filename):
+            with open(csv_filename, mode="r", encoding="utf8") as f_old:
+                for row in csv.DictReader(f_old, delimiter=",",
+                                          quotechar='"', lineterminator="\n"):
+                    link = (row['OWNER'], service_link(row['SERVICELINK']))
+                    if row['OWNER'] in complete_operators or \
+                            link in untyped_links or \
+                            link + (row['SERVICETYPE'],) in replaced_links:
+                        dict_writer.writerows(
+                            fresh_rows[n] for n in
+                            fresh_by_owner.pop(row['OWNER'], []))
+                    else:
+                        dict_writer.writerow(row)
+        for rows in fresh_by_owner.values():
+            dict_writer.writerows(fresh_rows[n] for n in rows)
+    os.replace(temp_file, csv_filename)
     return
 
 
-def write_operator_stats(out_file):
+# Columns of the dataset files
+DATASET_KEYS = ['OWNER', 'TITLE', 'NAME', 'MAPGEO', 'ABSTRACT', 'KEYWORDS',
+                'CONTACT', 'WMSGetCap', 'WMTSGetCap', 'WFSGetCap']
+DATASET_SIMPLE_KEYS = ['OWNER', 'TITLE', 'MAPGEO']
+# Columns of geoservices_CH.csv the datasets are merged from
+DATASET_LAYER_KEYS = ['OWNER', 'TITLE', 'NAME', 'MAPGEO', 'ABSTRACT',
+                      'CONTACT', 'KEYWORDS', 'SERVICETYPE', 'SERVICELINK']
+STATS_FIELDS = ['KEYWORDS', 'ABSTRACT', 'CONTACT', 'METADATA']
+
+
+def new_dataset(layer):
+    """
+    Create an empty dataset (one entry of geodata_CH.csv) for the TITLE, NAME
+    and OWNER of a layer.
+
+    Parameters:
+    layer (dict): A row of geoservices_CH.csv.
+
+    Returns:
+    dict: The dataset, with "n.a." for everything not yet merged.
+    """
+    dataset = service_result_empty()
+    dataset.update(service_keys)
+    dataset['OWNER'] = layer['OWNER']
+    dataset['TITLE'] = layer['TITLE']
+    dataset['NAME'] = layer['NAME']
+    return dataset
+
+
+def merge_layer(dataset, layer):
+    """
+    Merge a layer of the dataset into it. The layers of a dataset (e.g. its
+    WMS, WMTS and WFS layer) are merged in the order of geoservices_CH.csv.
+
+    Parameters:
+    dataset (dict): The dataset, updated in place.
+    layer (dict): A row of geoservices_CH.csv with the TITLE, NAME and OWNER
+        of the dataset.
+
+    Returns:
+    None
+    """
+    # A WMS link to map.geo.admin.ch is preferred over a WMTS link
+    if "layers=WMS" in dataset['MAPGEO']:
+        pass
+    elif "layers=WMS" in layer['MAPGEO']:
+        dataset['MAPGEO'] = layer['MAPGEO']
+    elif "layers=WMTS" in layer['MAPGEO']:
+        dataset['MAPGEO'] = layer['MAPGEO']
+    for key in ['ABSTRACT', 'CONTACT']:
+        if layer[key] != "n.a.":
+            dataset[key] = layer[key]
+    dataset['KEYWORDS'] = layer['KEYWORDS'] if layer['KEYWORDS'] != "n.a." \
+        else ""
+    service_type = layer['SERVICETYPE'].casefold()
+    for service, key in [("wms", 'WMSGetCap'), ("wmts", 'WMTSGetCap'),
+                         ("wfs", 'WFSGetCap')]:
+        if service in service_type:
+            dataset[key] = layer['SERVICELINK']
+
+
+def finish_dataset(dataset):
+    # remove duplicates from keywords
+    keywords = list(dict.fromkeys(dataset['KEYWORDS'].split(",")))
+    dataset['KEYWORDS'] = ','.join(keywords)
+    return dataset
+
+
+class DatasetStats:
+    """
+    Per-owner statistics of geoservices_CH.csv, updated one layer at a time:
+    the number of layers of each OWNER and how many of them have non-empty
+    KEYWORDS, ABSTRACT, CONTACT and METADATA.
+    """
+
+    def __init__(self):
+        self.owner_counts = defaultdict(int)
+        self.counts = defaultdict(lambda: defaultdict(int))
+
+    def add(self, layer):
+        """
+        Parameters:
+        layer (dict): A row of geoservices_CH.csv.
+        """
+        self.owner_counts[layer['OWNER']] += 1
+        for field in STATS_FIELDS:
+            if layer[field]:
+                self.counts[field][layer['OWNER']] += 1
+
+    def write(self, output_file, keep_copy=True):
+        """
+        Write the statistics, one row per owner in the order of
+        geoservices_CH.csv.
+
+        Parameters:
+        output_file (str): The path to the output CSV file.
+        keep_copy (bool): Keep a timestamped copy of the statistics, which
+            check-geoservices-stats.py compares against. Partial runs do not.
+
+        Returns:
+        None
+        """
+        datestamp = datetime.now(cet()).strftime("%Y-%m-%d")
+        with open(output_file, mode="w", encoding="utf8") as f:
+            writer = csv.DictWriter(f, fieldnames=[
+                'DATE', 'OWNER', 'DATASET_COUNT', 'KEYWORDS_COUNT', 'KEYWORDS_MISSING',
+                'KEYWORDS_PERCENTAGE', 'ABSTRACT_COUNT', 'ABSTRACT_MISSING',
+                'ABSTRACT_PERCENTAGE', 'CONTACT_COUNT', 'CONTACT_MISSING',
+                'CONTACT_PERCENTAGE', 'METADATA_COUNT', 'METADATA_MISSING',
+                'METADATA_PERCENTAGE', 'TOTAL_PERCENTAGE'], lineterminator="\n")
+            writer.writeheader()
+            for owner, owner_count in self.owner_counts.items():
+                row = {
+                    'DATE': datestamp,
+                    'OWNER': owner,
+                    'DATASET_COUNT': owner_count
+                }
+                total_percentages = []
+                for field in STATS_FIELDS:
+                    count = self.counts[field].get(owner, 0)
+                    if count:
+                        percentage = count / owner_count
+                        total_percentages.append(percentage)
+                        percentage = "{:.1%}".format(percentage)
+                    else:
+                        percentage = "0%"
+                    row[field + '_COUNT'] = count
+                    row[field + '_MISSING'] = owner_count - count
+                    row[field + '_PERCENTAGE'] = percentage
+                if len(total_percentages) > 0:
+                    row['TOTAL_PERCENTAGE'] = "{:.1%}".format(
+                        mean(total_percentages))
+                else:
+                    row['TOTAL_PERCENTAGE'] = "0%"
+                writer.writerow(row)
+
+        # Keep a timestamped copy of this statistics file
+        if keep_copy:
+            path, file_with_ext = os.path.split(output_file)
+            copy_file = os.path.join(path, "%s %s" % (datestamp,
+                                                      file_with_ext))
+            shutil.copy(output_file, copy_file)
+
+
+def write_dataset_files(csv_filename, output_file, output_simple_file,
+                        stats_file=None, keep_copy=True,
+                        partition_bytes=None):
+    """
+    Write the datasets and the statistics of geoservices_CH.csv in a single
+    streaming pass over it, with bounded memory.
+
+    The datasets bring the layers into first normal form (NF1), one entry per
+    TITLE, NAME and OWNER: the layers of a dataset (WMS, WMTS, WFS) are
+    merged into one (see merge_layer). output_file gets the full dataset
+    information, output_simple_file only OWNER, TITLE and MAPGEO. The
+    datasets are in the order of their first layer in csv_filename.
+
+    Memory does not grow with the size of csv_filename:
+    1. The layers are read one at a time. The per-owner statistics are
+       counted on the fly, and the layers are spilled to temporary partition
+       files by a hash of TITLE, NAME and OWNER, so all layers of a dataset
+       end up in the same partition.
+    2. The partitions are merged one at a time; each yields a run of
+       datasets ordered by their first layer.
+    3. The runs are k-way merged into the output files.
+    Only the owners and one partition are in memory at any time.
+
+    Parameters:
+    csv_filename (str): Path to the source CSV file.
+    output_file (str): Path to the output file with detailed information.
+    output_simple_file (str): Path to the output file with simple
+        information.
+    stats_file (str, optional): Path to the statistics output file, no
+        statistics are written if None.
+    keep_copy (bool): Keep a timestamped copy of the statistics, which
+        check-geoservices-stats.py compares against. Partial runs do not.
+    partition_bytes (int, optional): Size of csv_filename per partition,
+        config.DATASET_PARTITION_BYTES by default.
+
+    Returns:
+    DatasetStats: The statistics.
+    """
+    partition_bytes = partition_bytes or config.DATASET_PARTITION_BYTES
+    partitions = min(config.DATASET_MAX_PARTITIONS, max(
+        1, -(-os.path.getsize(csv_filename) // partition_bytes)))
+    stats = DatasetStats()
+    with tempfile.TemporaryDirectory(prefix="datasets_") as tmp_path:
+        # 1. Stream the layers into the partitions
+        partition_files = [open(os.path.join(tmp_path, "layers_%s.csv" % p),
+                                mode="w", encoding="utf8", newline="")
+                           for p in range(partitions)]
+        try:
+            writers = [csv.writer(f, lineterminator="\n")
+                       for f in partition_files]
+            with open(csv_filename, mode="r", encoding="utf8") as f:
+                for n, layer in enumerate(csv.DictReader(
+                        f, delimiter=",", quotechar='"', lineterminator="\n")):
+                    stats.add(layer)
+                    dataset_id = "\x1f".join(
+                        [layer['OWNER'], layer['TITLE'], layer['NAME']])
+                    p = zlib.crc32(dataset_id.encode("utf-8")) % partitions
+                    writers[p].writerow(
+                        [n] + [layer[key] for key in DATASET_LAYER_KEYS])
+        finally:
+            for f in partition_files:
+                f.close()
+
+        # 2. Merge the datasets of each partition into a run
+        for p in range(partitions):
+            datasets = {}
+            with open(os.path.join(tmp_path, "layers_%s.csv" % p), mode="r",
+                      encoding="utf8", newline="") as f:
+                for row in csv.reader(f, lineterminator="\n"):
+                    layer = dict(zip(DATASET_LAYER_KEYS, row[1:]))
+                    dataset_id = (layer['OWNER'], layer['TITLE'],
+                                  layer['NAME'])
+                    if dataset_id not in datasets:
+                        datasets[dataset_id] = (row[0], new_dataset(layer))
+                    merge_layer(datasets[dataset_id][1], layer)
+            os.remove(os.path.join(tmp_path, "layers_%s.csv" % p))
+            # Datasets are in the order of their first layer
+            with open(os.path.join(tmp_path, "run_%s.csv" % p), mode="w",
+                      encoding="utf8", newline="") as f:
+                writer = csv.writer(f, lineterminator="\n")
+                for first_layer, dataset in datasets.values():
+                    finish_dataset(dataset)
+                    writer.writerow([first_layer] +
+                                    [dataset[key] for key in DATASET_KEYS])
+            del datasets
+
+        # 3. Merge the runs into the output files
+        run_files = [open(os.path.join(tmp_path, "run_%s.csv" % p),
+                          mode="r", encoding="utf8", newline="")
+                     for p in range(partitions)]
+        try:
+            runs = [csv.reader(f, lineterminator="\n") for f in run_files]
+            datasets = heapq.merge(*runs, key=lambda row: int(row[0]))
+            simple_columns = [DATASET_KEYS.index(key) + 1
+                              for key in DATASET_SIMPLE_KEYS]
+            with open(output_file, mode="w", encoding="utf-8") as f, \
+                    open(output_simple_file, mode="w",
+                         encoding="utf-8") as f_simple:
+                writer = csv.writer(f, delimiter=",", quotechar='"',
+                                    lineterminator="\n")
+                simple_writer = csv.writer(f_simple, delimiter=",",
+                                           quotechar='"', lineterminator="\n")
+                writer.writerow(DATASET_KEYS)
+                simple_writer.writerow(DATASET_SIMPLE_KEYS)
+                for row in datasets:
+                    writer.writerow(row[1:])
+                    simple_writer.writerow([row[i] for i in simple_columns])
+        finally:
+            for f in run_files:
+                f.close()
+
+    if stats_file is not None:
+        stats.write(stats_file, keep_copy)
+    return stats
+
+
+def write_operator_stats(out_file, operator_errors, skipped_counts=None):
     """
     Collates error statistics per server operator (if they had errors in this 
-    scraper run) based on the files named "*_errors.csv" in 
-    <config.DEAD_SERVICES_PATH>. Writes the overview statistics into a 
-    markdown file that can comfortably viewed on GitHub
+    scraper run) from the issues collected in operator_errors, whose log files
+    are named "*_errors.csv" in <config.DEAD_SERVICES_PATH>. Writes the
+    overview statistics into a markdown file that can comfortably viewed on
+    GitHub
 
     Parameters:
     out_file: Name of the output markdown file (should end in "*.md" so that 
     GitHub recognizes it as such.
+    operator_errors (OperatorErrorLog): The issues found during this run.
+    skipped_counts (dict, optional): The number of sources per server
+        operator that were skipped because they kept failing in past runs.
 
     Returns:
     None: This function does not return any value.
 
     """
-    error_files = glob.glob(os.path.join(
-        config.DEAD_SERVICES_PATH, "*_errors.csv"))
-
-    CET = pytz.timezone('Europe/Zurich')
-    datestamp = datetime.now(timezone.utc).astimezone(CET).strftime("%d.%m.%Y")
+    datestamp = datetime.now(cet()).strftime("%d.%m.%Y")
 
     with open(out_file, "w", encoding="utf-8") as f:
         f.write("# Issues found during the last run (%s)\n\n" % datestamp)
-        for error_file in error_files:
-            server_operator = error_file.replace(
-                "_errors.csv", "").replace("tools/", "")
-            with open(error_file, "r", encoding="utf-8") as in_file:
-                error_data = in_file.readlines()[1:]
+        for server_operator, count in operator_errors.counts().items():
+            error_file = operator_errors.log_file_path(
+                server_operator, config.DEAD_SERVICES_PATH)
             f.write("- %s: [%s issue(s)](%s)\n" %
-                    (server_operator, len(error_data), error_file))
+                    (server_operator, count, error_file))
+        if skipped_counts:
+            f.write("\n## Sources skipped after repeated failures\n\n")
+            for server_operator, count in skipped_counts.items():
+                error_file = operator_errors.log_file_path(
+                    server_operator, config.DEAD_SERVICES_PATH)
+                f.write("- %s: [%s source(s) not probed in this run](%s)\n"
+                        % (server_operator, count, error_file))
     return
 
 
+def load_google_credentials():
+    """
+    Get the credentials for the Google Index API. The approach depends on
+    whether this script is running on GitHub (via GitHub Actions) or
+    locally. In the latter case you need a valid config.JSON_KEY_FILE in
+    this repo.
+
+    Returns:
+    oauth2client.service_account.ServiceAccountCredentials or None: The
+        credentials, None if the results should not be submitted.
+    """
+    if not config.GOOGLE_INDEXING:
+        return None
+    from oauth2client.service_account import ServiceAccountCredentials
+    if os.path.exists(config.JSON_KEY_FILE):
+        # This script is running locally
+        # uncomment below if you want enable search locally
+        print("uncomment line below if you want to submit dev results to goooogle")
+        # return ServiceAccountCredentials.from_json_keyfile_name(
+        #     config.JSON_KEY_FILE, scopes=config.SCOPES)
+        return None
+    # This script is running on GitHub
+    client_secret = json.loads(os.environ.get('CLIENT_SECRET'))
+    return ServiceAccountCredentials.from_json_keyfile_dict(
+        client_secret, scopes=config.SCOPES)
+
+
 def publish_urls(credentials):
     """
     Publishes a list of URLs to the Google Indexing API using the provided 
@@ -714,6 +1521,9 @@ def publish_urls(credentials):
         'https://davidoesch.github.io/geoservice_harvester_poc/data/geodata_CH.csv': 'URL_UPDATED'
     }
 
+    import httplib2
+    from googleapiclient.discovery import build
+
     # Authorize credentials
     credentials = credentials
     http = credentials.authorize(httplib2.Http())
@@ -743,56 +1553,93 @@ if __name__ == "__main__":
 
     1 Clean up: Deletes previous log files and scraped data.
     2 Load sources: Calls the load_source_collection function to get a list of 
-      sources to scrape.
-    3 For each source:
+      sources to scrape. With --only/--exclude only the selected sources are
+      harvested (partial run, see below).
+    3 Harvest: Calls the run_harvest function. For each source:
         a. Check if a scraper exists for the source. If not, it sets a message 
            indicating that the default scraper will be used.
         b. Prints and logs a message indicating the start of the scraper for 
            the source.
-        c. Calls the is_online function to check if the server is online.
-        d. If the server is online, calls the get_service_info function to get 
-           information from the service.
+        c. Calls the open_capabilities function to check if the server is
+           online and reads the rest of the capabilities document from the
+           same response (I/O stage, thread pool).
+        d. If the server is online, calls the get_service_info function in a
+           worker process to get information from the service (CPU stage,
+           process pool).
         e. If the server is not online, logs a message indicating the scraper 
            was aborted.
-    4 Create dataset view and stats: Calls the write_dataset_info and 
-      write_dataset_stats functions to generate the dataset files.
+    4 Create dataset view and stats: Calls the write_dataset_files function
+      to generate the dataset and statistics files in one pass, the
+      search index of the catalogue page (search_index.py) and the layer
+      files per owner (layer_files.py).
+      Compares the layers with the previous run (change_detection.py) and
+      adds them to the history of full runs (snapshot_store.py).
     5 Logs and prints a message indicating that the scraper has completed.
+
+    A partial run (e.g. "python scraper.py --only KT_ZH") splices the fresh
+    rows of the selected sources into the existing geoservices_CH.csv and
+    keeps the rows and error logs of all other sources. It ignores the
+    failure back-off, keeps no dated statistics copy and does not publish to
+    the Google Index API.
+
+    With --profile every source is profiled (profiling.py): CPU samples
+    and allocations per source and operator, and a report ranking the
+    endpoints, in config.PROFILE_PATH.
     """
-    # Initialize and configure the logger
-    logger = logging.getLogger("Scraping log")
-    logger.setLevel(logging.INFO)
-    fh = logging.FileHandler(config.LOG_FILE, "w", "utf-8")
-    fh.setLevel(logging.INFO)
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(filename)s >"
-                                  "%(funcName)17s(): Line %(lineno)s - "
-                                  "%(levelname)s - %(message)s")
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
+    parser = argparse.ArgumentParser(
+        description="Harvest the geoservices of the source collection")
+    parser.add_argument(
+        "--only", action="append", metavar="SELECTOR",
+        help="Only harvest sources matching SELECTOR: an operator "
+        "(Description), a host or a URL, wildcards allowed. Repeatable.")
+    parser.add_argument(
+        "--exclude", action="append", metavar="SELECTOR",
+        help="Do not harvest sources matching SELECTOR. Repeatable.")
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Profile every source (CPU samples, allocations) and write "
+        "collapsed stacks and a report to %s." % config.PROFILE_PATH)
+    args = parser.parse_args()
+    partial_run = bool(args.only or args.exclude)
 
-    # Get the credentials for the Google Index API. The approach depends on
-    # whether this script is running on GitHub (via GitHub Actions) or
-    # locally. In the latter case you need a valid config.JSON_KEY_FILE in
-    # this repo.
-    if os.path.exists(config.JSON_KEY_FILE):
-        # This script is running locally
-        # uncomment below if you want enable search locally
-        print("uncomment line below if you want to submit dev results to goooogle")
-    #    google_credentials = ServiceAccountCredentials.from_json_keyfile_name(
-    #        config.JSON_KEY_FILE, scopes=config.SCOPES)
+    # Initialize and configure the logger
+    configure_logger("w")
+
+    # Load sources and select the sources of a partial run
+    all_sources = load_source_collection()
+    sources = select_sources(all_sources, args.only, args.exclude)
+    if partial_run:
+        print("Partial run: %s of %s sources selected" % (len(sources),
+                                                         len(all_sources)))
+        logger.info("Partial run (only %s, exclude %s): %s of %s sources" % (
+            args.only, args.exclude, len(sources), len(all_sources)))
+        if not sources:
+            sys.exit("No source matches the selection")
+
+        # Keep the issues of the sources that are not harvested
+        error_log.load(config.DEAD_SERVICES_PATH)
+        selected_urls = {source['URL'] for source in sources}
+        for server_operator in {source['Description'] for source in sources}:
+            operator_urls = [source['URL'] for source in all_sources
+                             if source['Description'] == server_operator]
+            if all(url in selected_urls for url in operator_urls):
+                error_log.discard(server_operator)
+            else:
+                error_log.discard(server_operator, [
+                    url for url in operator_urls if url in selected_urls])
+        harvest_file = config.GEOSERVICES_CH_CSV + ".partial"
     else:
-        # This script is running on GitHub
-        client_secret = os.environ.get('CLIENT_SECRET')
-        client_secret = json.loads(client_secret)
-        client_secret_str = json.dumps(client_secret)
-        google_credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-            json.loads(client_secret_str), scopes=config.SCOPES)
-
-    # Clean up main data file and operator-specific error log files
+        harvest_file = config.GEOSERVICES_CH_CSV
+
+    # Get the credentials for the Google Index API
+    google_credentials = None if partial_run else load_google_credentials()
+
+    # Clean up main data file (unless rows are spliced into it) and
+    # operator-specific error log files
     try:
-        os.remove(config.GEOSERVICES_CH_CSV)
+        os.remove(harvest_file)
     except OSError as e:
-        logger.error("Could not delete %s: %s" %
-                     (config.GEOSERVICES_CH_CSV, e))
+        logger.error("Could not delete %s: %s" % (harvest_file, e))
     error_log_files = glob.glob(os.path.join(
         config.DEAD_SERVICES_PATH, "*_errors.csv"))
     for error_log_file in error_log_files:
@@ -801,34 +1648,47 @@ if __name__ == "__main__":
         except OSError as e:
             logger.error("Could not delete %s: %s" % (error_log_file, e))
 
-    # Load sources
-    sources = load_source_collection()
-    num_sources = len(sources)
-    n = 1
-
-    for source in sources:
-        server_operator = source['Description']
-        server_url = source['URL']
-        # Check if a custom scraper exists for this source
-        if os.path.isfile(os.path.join(config.SOURCE_SCRAPER_DIR,
-                                       "%s.py" % server_operator)):
-            scraper_type = "custom"
-        else:
-            scraper_type = "default"
-
-        status_msg = "Running %s scraper on %s > %s (source %s/%s)" % (
-            scraper_type, server_operator, server_url, n, num_sources)
-        print(status_msg)
-        logger.info(status_msg)
-
-        # Check if this server is online. If yes, proceed to gather
-        # information
-        if is_online(source):
-            get_service_info(source)
-        else:
-            logger.warning("Scraping %s > %s aborted" % (
-                server_operator, server_url))
-        n += 1
+    # Harvest the sources. In a full run, sources that keep failing are
+    # backed off according to their failure history
+    protocols = ProtocolCache(config.PROTOCOL_CACHE_FILE)
+    latency = HostLatency(
+        config.HOST_LATENCY_FILE, config.LATENCY_TIMEOUT_FACTOR,
+        config.CONNECT_TIMEOUT_CAP, config.READ_TIMEOUT_CAP,
+        config.MAX_RETRIES,
+        {"connect": config.CONNECT_TIMEOUT,
+         "read": config.CAPABILITIES_TIMEOUT, "retries": 1},
+        config.LATENCY_MAX_TIMEOUT_SHARE, config.REQUEST_TIME_BUDGET)
+    profiler = profiling.Profiler(config.PROFILE_PATH) if args.profile \
+        else None
+    if partial_run:
+        failure_history = None
+        harvest_report = run_harvest(sources, None, harvest_file, protocols,
+                                     latency, profiler)
+        merge_harvest(config.GEOSERVICES_CH_CSV, harvest_file, all_sources,
+                      sources, protocols)
+        try:
+            os.remove(harvest_file)
+        except OSError:
+            pass
+    else:
+        failure_history = FailureHistory(config.FAILURE_HISTORY_FILE,
+                                         config.FAILURE_BACKOFF_AFTER,
+                                         config.FAILURE_BACKOFF_MAX_RUNS)
+        harvest_report = run_harvest(sources, failure_history,
+                                     protocols=protocols, latency=latency,
+                                     profiler=profiler)
+        failure_history.save(source['URL'] for source in sources)
+    protocols.save(source['URL'] for source in all_sources)
+    latency.save()
+    run_report = {"date": datetime.now(cet()).strftime("%Y-%m-%d %H:%M"),
+                  "partial": partial_run, "sources": len(sources)}
+    run_report.update(harvest_report)
+    if profiler is not None:
+        try:
+            run_report["profile"] = profiler.write()
+            print("Profile written to %s" % config.PROFILE_PATH)
+        except Exception as e:
+            logger.error("Could not write the profile: %s" % e)
 
     # Create dataset view and stats
     print("\nCreating dataset files")
@@ -839,15 +1699,77 @@ if __name__ == "__main__":
         except OSError as e:
             logger.error("Could not delete %s: %s" % (f, e))
 
-    write_dataset_info(config.GEOSERVICES_CH_CSV,
-                       config.GEODATA_CH_CSV, config.GEODATA_SIMPLE_CH_CSV)
-    write_dataset_stats(config.GEOSERVICES_CH_CSV,
-                        config.GEOSERVICES_STATS_CH_CSV)
-
-    write_operator_stats(config.OPERATOR_STATS_FILE)
+    write_dataset_files(config.GEOSERVICES_CH_CSV, config.GEODATA_CH_CSV,
+                        config.GEODATA_SIMPLE_CH_CSV,
+                        config.GEOSERVICES_STATS_CH_CSV,
+                        keep_copy=not partial_run)
+    try:
+        import search_index
+        search_index.build_search_index(config.GEOSERVICES_CH_CSV,
+                                        config.SEARCH_INDEX_PATH)
+    except Exception as e:
+        logger.error("Could not build the search index: %s" % e)
+    try:
+        import layer_files
+        layer_files.render_layer_files(config.GEODATA_CH_CSV,
+                                       config.GEOSERVICES_CH_CSV,
+                                       config.LAYER_FILES_PATH)
+    except Exception as e:
+        logger.error("Could not render the layer files: %s" % e)
+    try:
+        import wfs_schema
+        run_report["wfs_schemas"] = wfs_schema.harvest_schemas(
+            config.GEOSERVICES_CH_CSV, config.WFS_FEATURETYPES_CH_CSV,
+            config.WFS_ATTRIBUTES_CH_CSV, latency)
+    except Exception as e:
+        logger.error("Could not harvest the WFS schemas: %s" % e)
+    if config.PREVIEWS:
+        try:
+            import preview_cache
+            run_report["previews"] = preview_cache.update_previews(
+                config.GEOSERVICES_CH_CSV, config.PREVIEWS_CH_CSV,
+                config.PREVIEW_PATH, config.PREVIEW_CACHE_MAX_BYTES, latency)
+        except Exception as e:
+            logger.error("Could not update the previews: %s" % e)
+
+    # Detect the layers added, removed or modified since the latest snapshot
+    # of the history, before this run is added to it
+    try:
+        import change_detection
+        changes = change_detection.update_changes()
+        if changes is not None:
+            msg = ("Layers added: %(added)s, removed: %(removed)s, "
+                   "modified: %(modified)s" % changes)
+            print(msg)
+            logger.info(msg)
+    except Exception as e:
+        logger.error("Could not detect changes: %s" % e)
+
+    # Keep the layer table of full runs in the snapshot history
+    if not partial_run:
+        try:
+            import snapshot_store
+            snapshot_store.open_store().add(config.GEOSERVICES_CH_CSV)
+        except Exception as e:
+            logger.error("Could not add the snapshot to %s: %s" % (
+                config.HISTORY_PATH, e))
+
+    # Write the operator error logs, their overview and the run report
+    error_log.flush(config.DEAD_SERVICES_PATH)
+    try:
+        import catalogue_db
+        run_report["catalogue"] = catalogue_db.update_catalogue(
+            config.CATALOGUE_DB, run_report, all_sources)
+    except Exception as e:
+        logger.error("Could not update the catalogue database: %s" % e)
+    save_state(config.RUN_REPORT_FILE, run_report)
+    write_operator_stats(config.OPERATOR_STATS_FILE, error_log,
+                         failure_history.skipped_counts()
+                         if failure_history is not None else None)
 
     # Publish to Google Index API
-    publish_urls(google_credentials)
+    if google_credentials is not None:
+        publish_urls(google_credentials)
 
     print("\nScraper run completed")
     logger.info("Scraper run completed")
@@ -9,15 +9,26 @@ Purpose: This script is be a part of a larger script that scrapes metadata infor
     information such as owner, title, name, tree structure, group, abstract, keywords, and legend of the OGC web service layers.
 """
 
-import re
+import logging
 import math
 import requests
 import json
 import time
+from functools import lru_cache
 from requests.utils import requote_uri
-from pyproj import Transformer
-# Define a transformer to convert from WGS84 to LV95
-transformer = Transformer.from_crs("EPSG:4326", 'EPSG:2056')
+from text_cleaner import clean_text, extract_metadata_url
+
+# (connect, read) timeout in seconds of the URL shortener requests
+SHORTEN_TIMEOUT = (3, 10)
+
+logger = logging.getLogger("Scraping log")
+
+@lru_cache(maxsize=None)
+def get_transformer():
+    # Define a transformer to convert from WGS84 to LV95, on first use since
+    # importing pyproj and building the transformer is slow
+    from pyproj import Transformer
+    return Transformer.from_crs("EPSG:4326", 'EPSG:2056')
 
 def shorten_mapgeo(mapgeo):
     # Set the API endpoint URL
@@ -34,7 +45,12 @@ def shorten_mapgeo(mapgeo):
     # Try the request up to 3 times    
     for i in range(3):
         # Make the POST request    
-        r = requests.post(url=url, data=json.dumps({'url': requote_uri(mapgeo)}), headers=headers)
+        try:
+            r = requests.post(url=url, data=json.dumps({'url': requote_uri(mapgeo)}), headers=headers,
+                              timeout=SHORTEN_TIMEOUT)
+        except requests.exceptions.Timeout:
+            logger.warning("URL shortener request timed out. Retrying...")
+            continue
         # Code to execute if status code is 2xx (i.e. 200, 201, 202, etc.)
         if r.status_code // 100 == 2:
             # Convert the response data to a JSON object
@@ -42,12 +58,14 @@ def shorten_mapgeo(mapgeo):
             # Return the response data if the request was successful
             return data['shorturl']
         else:
-            # If the response was not successful, print an error message
-            print(f"Request failed with status code {r.status_code}. Retrying...")
+            # If the response was not successful, log an error message
+            logger.warning("URL shortener request failed with status code "
+                           "%s. Retrying..." % r.status_code)
             # Wait for a few seconds before retrying
             time.sleep(5)
-    # If all retries fail, print an error message and return None
-    print("Request failed after 3 retries. providing no shorted URL")
+    # If all retries fail, log an error message and return the long URL
+    logger.error("URL shortener request failed after 3 retries, providing "
+                 "no shortened URL")
     data=mapgeo
     return data
 
@@ -62,18 +80,89 @@ def remove_newline(toclean):
         str: The cleaned string.
 
     """
-    if toclean:
-        #remove newlines and ennumernation
-        test=re.sub(r'[\n\r\t\f\v]', ' ', toclean)
-        #remove HTML Fragments
-        clean = re.compile('<.*?>')
-        test=re.sub(clean, '', test)
+    #newlines, ennumernation and HTML Fragments in one pass
+    return(clean_text(toclean))
+
+def service_fields(source, service, prefix):
+    """
+    Compute the fields that are the same for all layers of a service.
+
+    Parameters:
+    source (dict): A dictionary containing information about the source of the service.
+    service (owslib.wms.WebMapService): A WM(T/F)S service object from the owslib library.
+    prefix (str): The map.geo.admin.ch link prefix (config.MAPGEO_PREFIX).
+
+    Returns:
+    dict: OWNER, CONTACT (missing if the provider has neither e-mail nor
+    name), SERVICELINK, SERVICETYPE (None if unknown), VERSION (WMS only)
+    and GEOADMIN3 (True for mf-geoadmin3, False for web-mapviewer).
+    """
+    type=source['URL']
+    shared = {"OWNER": source['Description']}
+
+    #contact
+    if hasattr(service, 'provider'):
+        if hasattr(service.provider, 'contact') and service.provider.contact and hasattr(service.provider.contact, 'email'):
+            shared["CONTACT"] = service.provider.contact.email
+        elif hasattr(service.provider, 'name'):
+            shared["CONTACT"] = service.provider.name
+    else:
+        shared["CONTACT"] = ""
+
+    #servicelink
+    if "?" in type:
+        shared["SERVICELINK"] = type.split("?")[0]
+    else:
+        shared["SERVICELINK"] = type
+
+    #servicetype
+    if "WMS" in type or "wms" in type:
+        shared["SERVICETYPE"] = "WMS"
+        shared["VERSION"] = service.identification.version
+    elif "WMTS" in type or "wmts" in type:
+        shared["SERVICETYPE"] = "WMTS"
+    elif "WFS" in type or "wfs" in type:
+        shared["SERVICETYPE"] = "WFS"
+    elif "STAC" in type:
+        shared["SERVICETYPE"] = "STAC"
     else:
-        test=""
-    return(test)
+        shared["SERVICETYPE"] = None
+
+    #see if we work with mf-geoadmin3
+    shared["GEOADMIN3"] = "test." not in prefix
+    return shared
+
+def scrape_service(source, service, layers, prefix):
+    """
+    Extract the metadata information of all layers of a service. The fields
+    shared by all layers (see service_fields) are computed once.
+
+    Parameters:
+    source (dict): A dictionary containing information about the source of the service.
+    service (owslib.wms.WebMapService): A WM(T/F)S service object from the owslib library.
+    layers (iterable): (i, layertree, group, layer_data) per layer, as the
+        arguments of scrape.
+    prefix (str): The map.geo.admin.ch link prefix (config.MAPGEO_PREFIX).
+
+    Yields:
+    tuple: (i, layer_data) in the order of layers. layer_data is the
+    exception raised if the layer could not be scraped, the other layers
+    are scraped anyway.
+    """
+    try:
+        shared = service_fields(source, service, prefix)
+    except Exception:
+        # scrape computes them per layer and reports the issue per layer
+        shared = None
+    for i, layertree, group, layer_data in layers:
+        try:
+            yield i, scrape(source, service, i, layertree, group, layer_data,
+                            prefix, shared)
+        except Exception as e:
+            yield i, e
 
 #SERVICE WMS
-def scrape(source,service,i,layertree, group,layer_data,prefix):
+def scrape(source,service,i,layertree, group,layer_data,prefix,shared=None):
     """
     Extract metadata information from WMS service and stores it in the `layer_data` dictionary.
     
@@ -85,6 +174,8 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
     group (str): The name of the parent layer group.
     layer_data (dict): A dictionary to store the extracted metadata information.
     prefix (str): A prefix string to add to each key in the `layer_data` dictionary.
+    shared (dict, optional): The fields shared by all layers of the service,
+        as returned by service_fields. Computed if not given.
     
     Returns:
     None
@@ -101,14 +192,15 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
     - LEGEND: Legend URL of the layer
     - CONTACT: Contact information of the provider of the service
     """
-    type=source['URL']
-    #breakpoint()
+    if shared is None:
+        shared = service_fields(source, service, prefix)
 
     #owner
-    layer_data["OWNER"]= source['Description']
+    layer_data["OWNER"]= shared["OWNER"]
     
     #title
-    layer_data["TITLE"]= service.contents[i].title
+    temp = service.contents[i].title
+    layer_data["TITLE"]= clean_text(temp) if temp else temp
 
     #name
     if hasattr(service.contents[i], 'name'):
@@ -166,21 +258,12 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
 
     
     #contact
-    if hasattr(service, 'provider'):
-        if hasattr(service.provider, 'contact') and service.provider.contact and hasattr(service.provider.contact, 'email'):
-            layer_data["CONTACT"] = service.provider.contact.email
-        elif hasattr(service.provider, 'name'):
-            layer_data["CONTACT"] = service.provider.name
-    else:
-        layer_data["CONTACT"] = ""
+    if "CONTACT" in shared:
+        layer_data["CONTACT"] = shared["CONTACT"]
 
     
     #servicelink
-    service_link=source['URL']
-    if "?" in service_link:
-        layer_data["SERVICELINK"] = service_link.split("?")[0]
-    else:
-        layer_data["SERVICELINK"] = source['URL']
+    layer_data["SERVICELINK"] = shared["SERVICELINK"]
         
 
     #metadata
@@ -193,11 +276,7 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
             try:
                 layer_data["METADATA"] = service.contents[i].layers[0].metadataUrls[0]['url']
             except:
-                try:
-                    url = re.findall(regex,service.contents[i].abstract)
-                    layer_data["METADATA"] = url[0][0] if len(url) == 1 else ""
-                except:
-                    layer_data["METADATA"] = ""
+                layer_data["METADATA"] = extract_metadata_url(service.contents[i].abstract)
 
     #update
     layer_data["UPDATE"]=""
@@ -253,11 +332,12 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
     # Calculate the distance between the two corners of the bounding box in meters.
     distance = math.sqrt((bbox[2] - bbox[0])**2 + (bbox[3] - bbox[1])**2)
     
-    if "test." in prefix: #webmapviewer use case
+    if not shared["GEOADMIN3"]: #webmapviewer use case
         # Calculate the appropriate zoom level using the formula for Web Mercator projection.
         zoom = math.log2((156543.03 * map_width_px) / (256 * screen_dpi * distance))
     else: #mf-geoadmin3 use case
-       
+        transformer = get_transformer()
+
         # Transform the WGS84 bbox to LV95
         xmin, ymin = transformer.transform(bbox[0], bbox[1])
         xmax, ymax = transformer.transform(bbox[2], bbox[3])
@@ -281,17 +361,17 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
     #now the service specific stuff
 
     #see if we work with mf-geoadmin3
-    if "test." not in prefix:
+    if shared["GEOADMIN3"]:
         if math.isnan(distance):
             lon_lv95=2663000 
             lat_lv95=1189572
         else:
             # Convert the latitude from WGS84 to LV95
-            lon_lv95, lat_lv95 = transformer.transform(layer_data["CENTER_LAT"], layer_data["CENTER_LON"])
+            lon_lv95, lat_lv95 = get_transformer().transform(layer_data["CENTER_LAT"], layer_data["CENTER_LON"])
         
 
 
-    if "WMS" in type or "wms" in type:
+    if shared["SERVICETYPE"] == "WMS":
         #servicetype
         layer_data["SERVICETYPE"]="WMS"    
 
@@ -306,7 +386,7 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
 
             layer_data["MAPGEO"]= r""+prefix+"layers=WMS||"+service.contents[i].title+"||"+service.url+"?||"+\
                 service.contents[i].id+"||"\
-                +service.identification.version+"&E="+str(lon_lv95)+\
+                +shared["VERSION"]+"&E="+str(lon_lv95)+\
                 "&N="+str(lat_lv95)+"&zoom="+str(layer_data["MAX_ZOOM"])
             
         #for web-mapviewer    
@@ -319,10 +399,10 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
             #layer_data["MAPGEO"]= shorten_mapgeo(r""+prefix+"layers=WMS||"+service.contents[i].title+"||"+service.provider.url+"?||"+\
             #service.contents[i].id+"||"+service.identification.version)
             layer_data["MAPGEO"]= r""+prefix+"layers=WMS||"+service.contents[i].title+"||"+service.provider.url+"?||"+\
-            service.contents[i].id+"||"+service.identification.version
+            service.contents[i].id+"||"+shared["VERSION"]
         return(layer_data)
 
-    elif "WMTS" in type or "wmts" in type:
+    elif shared["SERVICETYPE"] == "WMTS":
         #servicetype
         layer_data["SERVICETYPE"]="WMTS"    
 
@@ -347,12 +427,12 @@ def scrape(source,service,i,layertree, group,layer_data,prefix):
             layer_data["MAPGEO"]= shorten_mapgeo(r""+prefix+"layers="+service.contents[i].id)
         return(layer_data)
 
-    elif "WFS" in type or "wfs" in type:
+    elif shared["SERVICETYPE"] == "WFS":
         #servicetype
         layer_data["SERVICETYPE"]="WFS"    
         
         return(layer_data)
-    elif "STAC" in type:
+    elif shared["SERVICETYPE"] == "STAC":
         print("STAC detetcted ..add config")
     else:
         return(False)        
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Search index
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Build a static, precomputed search index of the harvested layers
+    for the catalogue page, so that a search only downloads the parts of the
+    index it needs instead of the whole geoservices_CH.csv.
+Notes:
+- Uses Python 3.9
+- Written to config.SEARCH_INDEX_PATH:
+  - manifest.json: fields, owners and shards of the index
+  - terms/<prefix>.json.gz: inverted index of the tokens starting with
+    <prefix> (first SEARCH_PREFIX_LENGTH characters), token -> ids of the
+    layers containing it, delta-encoded
+  - docs/<owner>.json.gz: the layers of one owner; the ids of an owner's
+    layers are a contiguous range listed in the manifest
+- Only gzip is written: the page decompresses the shards itself with
+  DecompressionStream, which does not support brotli
+- Tokens are the words of TITLE, ABSTRACT, KEYWORDS, OWNER and NAME,
+  lowercased and without diacritics. js/search_index.js tokenises queries
+  the same way, keep the two in sync
+"""
+
+import glob
+import gzip
+import json
+import os
+import re
+import unicodedata
+from datetime import datetime
+import configuration as config
+from layer_table import LayerTable
+from operator_errors import cet
+
+TOKEN_SPLIT_PATTERN = re.compile(r"[^a-z0-9]+")
+INDEXED_FIELDS = ["TITLE", "ABSTRACT", "KEYWORDS", "OWNER", "NAME"]
+# Fields of the layers in the docs shards, i.e. what the page displays
+DOC_FIELDS = ["OWNER", "TITLE", "NAME", "MAPGEO", "ABSTRACT", "KEYWORDS",
+              "LEGEND", "CONTACT", "SERVICELINK", "METADATA", "SERVICETYPE",
+              "TREE", "BBOX"]
+
+
+def tokenize(text):
+    """
+    Split a text into search tokens.
+
+    Parameters:
+    text (str): The text.
+
+    Returns:
+    set: The lowercase tokens without diacritics, at least 2 characters.
+    """
+    if not text:
+        return set()
+    text = unicodedata.normalize("NFKD", text.lower().replace("ß", "ss"))
+    # Drop all combining marks (category M), as js/search_index.js does
+    text = "".join(c for c in text
+                   if not unicodedata.category(c).startswith("M"))
+    return {token for token in TOKEN_SPLIT_PATTERN.split(text)
+            if len(token) >= 2}
+
+
+def shard_name(text):
+    # File-system safe name of an owner or a prefix
+    return re.sub(r"[^A-Za-z0-9_-]", "_", text)
+
+
+def write_compressed(path, data):
+    """
+    Write a JSON document gzip-compressed.
+
+    Parameters:
+    path (str): Path of the file, without .gz.
+    data: The JSON-serialisable document.
+
+    Returns:
+    int: The size of the gzip file in bytes.
+    """
+    payload = json.dumps(data, ensure_ascii=False,
+                         separators=(",", ":")).encode("utf-8")
+    with open(path + ".gz", "wb") as f:
+        # mtime=0 keeps the files byte-identical if the index is unchanged
+        f.write(gzip.compress(payload, compresslevel=9, mtime=0))
+    return os.path.getsize(path + ".gz")
+
+
+def build_search_index(csv_filename, output_path,
+                       prefix_length=None):
+    """
+    Build the search index of the harvested layers.
+
+    Parameters:
+    csv_filename (str): The harvested layers (config.GEOSERVICES_CH_CSV).
+    output_path (str): Directory of the index; existing shards are replaced.
+    prefix_length (int, optional): Length of the token prefixes the terms
+        are sharded by, config.SEARCH_PREFIX_LENGTH by default.
+
+    Returns:
+    dict: The manifest of the index.
+    """
+    prefix_length = prefix_length or config.SEARCH_PREFIX_LENGTH
+    rows = LayerTable.read_csv(csv_filename)
+
+    # Number the layers owner by owner, so every owner is an id range
+    rows_by_owner = {}
+    for n, owner in enumerate(rows.column("OWNER")):
+        rows_by_owner.setdefault(owner, []).append(n)
+
+    terms = {}
+    owners = {}
+    doc_id = 0
+    for owner, owner_rows in rows_by_owner.items():
+        owners[owner] = {"first": doc_id, "count": len(owner_rows),
+                         "file": "docs/%s.json" % shard_name(owner)}
+        for n in owner_rows:
+            row = rows[n]
+            tokens = set()
+            for field in INDEXED_FIELDS:
+                tokens |= tokenize(row.get(field))
+            for token in tokens:
+                terms.setdefault(token, []).append(doc_id)
+            doc_id += 1
+
+    shards = {}
+    for token in sorted(terms):
+        shards.setdefault(token[:prefix_length], {})[token] = terms[token]
+
+    # Replace the previous index
+    for subdir in ("docs", "terms"):
+        os.makedirs(os.path.join(output_path, subdir), exist_ok=True)
+        for old_file in glob.glob(os.path.join(output_path, subdir, "*")):
+            os.remove(old_file)
+
+    size = 0
+    for owner, owner_rows in rows_by_owner.items():
+        size += write_compressed(
+            os.path.join(output_path, owners[owner]["file"]),
+            [[rows.value(n, field) if field in rows.columns else ""
+              for field in DOC_FIELDS] for n in owner_rows])
+    shard_files = {}
+    for prefix, shard in shards.items():
+        # Ids are ascending, store the gaps between them
+        postings = {token: [ids[0]] + [b - a for a, b in zip(ids, ids[1:])]
+                    for token, ids in shard.items()}
+        shard_files[prefix] = "terms/%s.json" % shard_name(prefix)
+        size += write_compressed(
+            os.path.join(output_path, shard_files[prefix]), postings)
+
+    manifest = {
+        "date": datetime.now(cet()).strftime("%Y-%m-%d"),
+        "documents": doc_id,
+        "terms": len(terms),
+        "prefix_length": prefix_length,
+        "fields": DOC_FIELDS,
+        "owners": owners,
+        "shards": shard_files,
+        "size": size}
+    with open(os.path.join(output_path, "manifest.json"), "w",
+              encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    return manifest
+
+
+if __name__ == "__main__":
+    manifest = build_search_index(config.GEOSERVICES_CH_CSV,
+                                  config.SEARCH_INDEX_PATH)
+    print("%s layers, %s terms in %s shards, %.1f kB (gzip)" % (
+        manifest["documents"], manifest["terms"], len(manifest["shards"]),
+        manifest["size"] / 1024))
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Snapshot store
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Keep the history of geoservices_CH.csv without storing a full copy
+    per run: a base Parquet table plus one small delta per run (the layer
+    rows that were added or modified, and the keys of the removed ones), and
+    reconstruct the table as of any date in the history.
+Notes:
+- Uses Python 3.9
+- Rows are identified by the ROW_KEY of change_detection.py
+- The deltas are "<date> geoservices_CH_delta.parquet" files in
+  config.HISTORY_PATH, listed in its manifest.json. Once there are more than
+  config.HISTORY_MAX_DELTAS of them, the oldest are folded into the base;
+  dates before the base date can no longer be reconstructed
+- The columns of the table are fixed by the base: columns that appear later
+  are not kept until the next rebase, columns that disappear are empty
+- Usage:
+  python snapshot_store.py add [data/geoservices_CH.csv]
+  python snapshot_store.py as-of 2026-10-19 out.csv
+  python snapshot_store.py dates
+"""
+
+import argparse
+import os
+from datetime import datetime
+import configuration as config
+from change_detection import (connect, create_keyed_view, quote,
+                              read_csv_sql, read_parquet_sql, table_columns)
+from harvest_state import load_state, save_state
+from operator_errors import cet
+
+
+class SnapshotStore:
+    """
+    History of the layer table: a base table and the deltas of later runs.
+
+    Every stored row has a SNAPSHOT_DATE and a DELTA_OP, "upsert" (the row
+    as of that date) or "delete". The table as of a date holds, per
+    ROW_KEY, the latest stored row up to that date unless it is a delete.
+    """
+
+    def __init__(self, path, max_deltas=None, memory_limit=None,
+                 temp_directory=None):
+        self.path = path
+        self.max_deltas = max_deltas
+        self.memory_limit = memory_limit
+        self.temp_directory = temp_directory
+        manifest = load_state(self.manifest_file())
+        self.base = manifest.get("base")
+        self.deltas = manifest.get("deltas", [])
+        self.columns = manifest.get("columns", [])
+
+    def manifest_file(self):
+        return os.path.join(self.path, "manifest.json")
+
+    def base_file(self):
+        return os.path.join(self.path, "geoservices_CH_base.parquet")
+
+    def delta_file(self, date):
+        return os.path.join(self.path, "%s geoservices_CH_delta.parquet" %
+                            date)
+
+    def dates(self):
+        """
+        Returns:
+        list: The dates of the stored snapshots, oldest first.
+        """
+        return ([self.base] if self.base else []) + self.deltas
+
+    def save_manifest(self):
+        save_state(self.manifest_file(), {"base": self.base,
+                                          "deltas": self.deltas,
+                                          "columns": self.columns})
+        return
+
+    def connect(self):
+        return connect(self.memory_limit, self.temp_directory)
+
+    def state_sql(self, date):
+        """
+        Returns:
+        str: SQL query of the stored rows (with the bookkeeping columns
+            of change_detection.STORE_COLUMNS) that make up the table as
+            of a date.
+        """
+        files = [self.base_file()] + [self.delta_file(delta)
+                                      for delta in self.deltas
+                                      if delta <= date]
+        return """
+            SELECT * EXCLUDE (ROW_RANK) FROM (
+                SELECT *, row_number() OVER (
+                    PARTITION BY ROW_KEY ORDER BY SNAPSHOT_DATE DESC)
+                    AS ROW_RANK
+                FROM read_parquet([%s])
+                WHERE SNAPSHOT_DATE <= '%s')
+            WHERE ROW_RANK = 1 AND DELTA_OP = 'upsert'""" % (
+            ", ".join("'%s'" % f.replace("'", "''") for f in files), date)
+
+    def check_date(self, date):
+        if not self.base:
+            raise ValueError("The snapshot store %s is empty" % self.path)
+        if date < self.base:
+            raise ValueError("%s is before the oldest snapshot (%s)" % (
+                date, self.base))
+        return
+
+    def as_of(self, date, keys=False):
+        """
+        Reconstruct the layer table as of a date.
+
+        Parameters:
+        date (str): The date (YYYY-MM-DD). The latest snapshot on or before
+            it is returned.
+        keys (bool): Also return the ROW_KEY and ROW_DIGEST columns.
+
+        Returns:
+        polars.DataFrame: The layer table, ordered by OWNER and SERVICELINK.
+        """
+        self.check_date(date)
+        columns = (["ROW_KEY", "ROW_DIGEST"] if keys else []) + self.columns
+        con = self.connect()
+        table = con.execute("SELECT %s FROM (%s) ORDER BY %s" % (
+            ", ".join(quote(c) for c in columns), self.state_sql(date),
+            ", ".join(quote(c) for c in ["OWNER", "SERVICELINK", "ROW_KEY"]
+                      if c in self.columns or c == "ROW_KEY"))).pl()
+        con.close()
+        return table
+
+    def write_as_of(self, date, csv_filename):
+        """
+        Write the layer table as of a date to a CSV file like
+        geoservices_CH.csv.
+
+        Parameters:
+        date (str): The date (YYYY-MM-DD).
+        csv_filename (str): Path of the CSV file.
+
+        Returns:
+        None
+        """
+        self.as_of(date).write_csv(csv_filename)
+        return
+
+    def add(self, csv_filename, date=None):
+        """
+        Add the current layer table as snapshot. The first snapshot becomes
+        the base, later ones are stored as delta to the table as of the
+        previous snapshot. A snapshot of the same date as the latest one
+        replaces it.
+
+        Parameters:
+        csv_filename (str): The layer table (config.GEOSERVICES_CH_CSV).
+        date (str, optional): Date of the snapshot, today by default.
+
+        Returns:
+        dict: The number of upserted and deleted rows.
+        """
+        date = date or datetime.now(cet()).strftime("%Y-%m-%d")
+        if self.dates() and date < self.dates()[-1]:
+            raise ValueError("%s is before the latest snapshot (%s)" % (
+                date, self.dates()[-1]))
+        if self.deltas and date == self.deltas[-1]:
+            self.deltas.pop()
+        elif date == self.base:
+            self.base = None
+        os.makedirs(self.path, exist_ok=True)
+
+        con = self.connect()
+        source = read_csv_sql(csv_filename)
+        if not self.base:
+            self.columns = table_columns(con, source)
+        else:
+            # Align the table to the columns of the base
+            current_columns = table_columns(con, source)
+            source = "(SELECT %s FROM %s)" % (", ".join(
+                quote(c) if c in current_columns else
+                "NULL::VARCHAR AS %s" % quote(c) for c in self.columns),
+                source)
+        create_keyed_view(con, "current_rows", source, self.columns)
+        table_columns_sql = ", ".join(quote(c) for c in self.columns)
+
+        if not self.base:
+            target = self.base_file()
+            query = """
+                SELECT '%s' AS SNAPSHOT_DATE, 'upsert' AS DELTA_OP, ROW_KEY,
+                    ROW_DIGEST, %s
+                FROM current_rows""" % (date, table_columns_sql)
+        else:
+            target = self.delta_file(date)
+            con.execute("CREATE VIEW previous_rows AS %s" %
+                        self.state_sql(date))
+            query = """
+                SELECT '%s' AS SNAPSHOT_DATE, 'upsert' AS DELTA_OP,
+                    c.ROW_KEY, c.ROW_DIGEST, %s
+                FROM current_rows c
+                LEFT JOIN previous_rows p ON c.ROW_KEY = p.ROW_KEY
+                WHERE p.ROW_KEY IS NULL OR p.ROW_DIGEST <> c.ROW_DIGEST
+                UNION ALL
+                SELECT '%s', 'delete', p.ROW_KEY, NULL, %s
+                FROM previous_rows p
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM current_rows c
+                    WHERE c.ROW_KEY = p.ROW_KEY)""" % (
+                date, ", ".join("c.%s" % quote(c) for c in self.columns),
+                date, ", ".join("NULL::VARCHAR AS %s" % quote(c)
+                                for c in self.columns))
+        temp_file = target + ".tmp"
+        con.execute("COPY (%s) TO '%s' (FORMAT PARQUET, COMPRESSION ZSTD)" % (
+            query, temp_file.replace("'", "''")))
+        counts = dict(con.execute("""
+            SELECT DELTA_OP, count(*) FROM %s GROUP BY DELTA_OP""" %
+                                  read_parquet_sql(temp_file)).fetchall())
+        con.close()
+        os.replace(temp_file, target)
+
+        if target == self.base_file():
+            self.base = date
+        else:
+            self.deltas.append(date)
+        if self.max_deltas is not None and len(self.deltas) > self.max_deltas:
+            self.rebase(self.deltas[-self.max_deltas - 1])
+        self.save_manifest()
+        return {"upsert": counts.get("upsert", 0),
+                "delete": counts.get("delete", 0)}
+
+    def rebase(self, date):
+        """
+        Fold the deltas up to a date into the base. The history before that
+        date is lost.
+
+        Parameters:
+        date (str): Date of one of the stored deltas.
+
+        Returns:
+        None
+        """
+        self.check_date(date)
+        con = self.connect()
+        temp_file = self.base_file() + ".tmp"
+        con.execute("""
+            COPY (SELECT '%s' AS SNAPSHOT_DATE, * EXCLUDE (SNAPSHOT_DATE)
+                  FROM (%s))
+            TO '%s' (FORMAT PARQUET, COMPRESSION ZSTD)""" % (
+            date, self.state_sql(date), temp_file.replace("'", "''")))
+        con.close()
+        os.replace(temp_file, self.base_file())
+        for delta in [d for d in self.deltas if d <= date]:
+            os.remove(self.delta_file(delta))
+        self.deltas = [d for d in self.deltas if d > date]
+        self.base = date
+        self.save_manifest()
+        return
+
+
+def open_store():
+    """
+    Returns:
+    SnapshotStore: The history of config.GEOSERVICES_CH_CSV.
+    """
+    return SnapshotStore(config.HISTORY_PATH, config.HISTORY_MAX_DELTAS,
+                         config.CHANGES_MEMORY_LIMIT, config.CHANGES_TEMP_DIR)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="History of the harvested geoservices")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="Add a snapshot")
+    add_parser.add_argument("csv_filename", nargs="?",
+                            default=config.GEOSERVICES_CH_CSV)
+    add_parser.add_argument("--date", help="YYYY-MM-DD, today by default")
+    as_of_parser = commands.add_parser(
+        "as-of", help="Reconstruct the table as of a date")
+    as_of_parser.add_argument("date", help="YYYY-MM-DD")
+    as_of_parser.add_argument("csv_filename")
+    commands.add_parser("dates", help="List the stored snapshots")
+    args = parser.parse_args()
+
+    store = open_store()
+    if args.command == "add":
+        print(store.add(args.csv_filename, args.date))
+    elif args.command == "as-of":
+        store.write_as_of(args.date, args.csv_filename)
+    else:
+        print("\n".join(store.dates()))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Title: Spatial index
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Persistent spatial index over the bounding boxes of all layers in
+    geoservices_CH.csv, in WGS84 and LV95, to answer "which layers cover
+    this point or area" without parsing the BBOX strings of every layer.
+    It is built on first use and rebuilt when geoservices_CH.csv is newer
+    (open_index, config.SPATIAL_INDEX_DB).
+Notes:
+- Uses Python 3.9
+- SQLite R*Tree tables, one per CRS; LV95 boxes are the WGS84 boxes
+  reprojected (pyproj), for layers inside the LV95 area of use
+- Layers without a BBOX of their own get the extent of Switzerland from
+  scraper/default.py (SWISS_BBOX). They are flagged as "fallback" and are
+  not in the R*Trees, so they do not turn up for every query; queries can
+  list them separately. Unparsable boxes are flagged as "invalid"
+- The index is a working file in config.CACHE_PATH and is not committed
+- Usage (layers covering a point or area, WGS84 or LV95):
+  python spatial_index.py 7.44 46.95
+  python spatial_index.py 2600000 1200000 2601000 1201000
+"""
+
+import csv
+import math
+import os
+import sqlite3
+import sys
+from functools import lru_cache
+import configuration as config
+
+# BBOX that scraper/default.py sets for layers without one
+SWISS_BBOX = (5.88932, 45.78485, 10.88932, 47.78485)
+# Area of use of LV95 (EPSG:2056) in WGS84
+LV95_AREA = (5.96, 45.82, 10.49, 47.81)
+CRS_TABLES = {"WGS84": "bbox_wgs84", "LV95": "bbox_lv95"}
+SCHEMA = """
+CREATE TABLE layers (
+    layer_id INTEGER PRIMARY KEY,
+    owner TEXT,
+    title TEXT,
+    name TEXT,
+    servicelink TEXT,
+    servicetype TEXT,
+    bbox TEXT,
+    bbox_source TEXT NOT NULL
+);
+CREATE INDEX layers_bbox_source ON layers (bbox_source);
+CREATE VIRTUAL TABLE bbox_wgs84 USING rtree (
+    layer_id, min_x, max_x, min_y, max_y
+);
+CREATE VIRTUAL TABLE bbox_lv95 USING rtree (
+    layer_id, min_x, max_x, min_y, max_y
+);
+"""
+
+
+def parse_bbox(bbox):
+    """
+    Parameters:
+    bbox (str): "xmin ymin xmax ymax" in WGS84, as in geoservices_CH.csv.
+
+    Returns:
+    tuple: (box or None, "layer", "fallback" or "invalid")
+    """
+    try:
+        box = tuple(float(v) for v in bbox.split())
+    except (AttributeError, ValueError):
+        return None, "invalid"
+    if len(box) != 4 or not all(math.isfinite(v) for v in box):
+        return None, "invalid"
+    xmin, ymin, xmax, ymax = box
+    if not (-180 <= xmin <= xmax <= 180 and -90 <= ymin <= ymax <= 90):
+        return None, "invalid"
+    if all(abs(a - b) < 1e-6 for a, b in zip(box, SWISS_BBOX)):
+        return box, "fallback"
+    return box, "layer"
+
+
+@lru_cache(maxsize=None)
+def get_transformer():
+    from pyproj import Transformer
+    return Transformer.from_crs("EPSG:4326", "EPSG:2056", always_xy=True)
+
+
+def lv95_boxes(boxes):
+    """
+    Reproject boxes to LV95, all at once.
+
+    Parameters:
+    boxes (list): (xmin, ymin, xmax, ymax) in WGS84.
+
+    Returns:
+    list: Per box, the box in LV95, clipped to the LV95 area of use; None
+        if it lies outside.
+    """
+    clipped = [(max(box[0], LV95_AREA[0]), max(box[1], LV95_AREA[1]),
+                min(box[2], LV95_AREA[2]), min(box[3], LV95_AREA[3]))
+               for box in boxes]
+    # Corners and edge midpoints, the edges are slightly curved in LV95
+    lons = []
+    lats = []
+    for xmin, ymin, xmax, ymax in clipped:
+        xmid = (xmin + xmax) / 2
+        ymid = (ymin + ymax) / 2
+        lons += [xmin, xmid, xmax, xmax, xmax, xmid, xmin, xmin]
+        lats += [ymin, ymin, ymin, ymid, ymax, ymax, ymax, ymid]
+    eastings, northings = get_transformer().transform(lons, lats) \
+        if lons else ([], [])
+    result = []
+    for n, (xmin, ymin, xmax, ymax) in enumerate(clipped):
+        if xmin > xmax or ymin > ymax:
+            result.append(None)
+            continue
+        e = eastings[8 * n:8 * n + 8]
+        north = northings[8 * n:8 * n + 8]
+        box = (min(e), min(north), max(e), max(north))
+        result.append(box if all(math.isfinite(v) for v in box) else None)
+    return result
+
+
+def build_spatial_index(geoservices_csv, db_file):
+    """
+    Build the spatial index of all layers. The database is replaced
+    atomically.
+
+    Parameters:
+    geoservices_csv (str): The layers (config.GEOSERVICES_CH_CSV).
+    db_file (str): The index (config.SPATIAL_INDEX_DB).
+
+    Returns:
+    dict: The number of layers per bbox_source, for the run report.
+    """
+    counts = {"layer": 0, "fallback": 0, "invalid": 0}
+    layers = []
+    boxes = {}
+    with open(geoservices_csv, mode="r", encoding="utf8") as f:
+        for layer_id, row in enumerate(csv.DictReader(
+                f, delimiter=",", quotechar='"', lineterminator="\n")):
+            box, bbox_source = parse_bbox(row["BBOX"])
+            counts[bbox_source] += 1
+            layers.append((layer_id, row["OWNER"], row["TITLE"], row["NAME"],
+                           row["SERVICELINK"].strip(), row["SERVICETYPE"],
+                           row["BBOX"], bbox_source))
+            if bbox_source == "layer":
+                boxes[layer_id] = box
+    lv95 = dict(zip(boxes, lv95_boxes(list(boxes.values()))))
+
+    os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+    temp_file = db_file + ".tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    connection = sqlite3.connect(temp_file)
+    try:
+        connection.executescript(SCHEMA)
+        with connection:
+            connection.executemany(
+                "INSERT INTO layers VALUES (?, ?, ?, ?, ?, ?, ?, ?)", layers)
+            connection.executemany(
+                "INSERT INTO bbox_wgs84 VALUES (?, ?, ?, ?, ?)",
+                [(layer_id, box[0], box[2], box[1], box[3])
+                 for layer_id, box in boxes.items()])
+            connection.executemany(
+                "INSERT INTO bbox_lv95 VALUES (?, ?, ?, ?, ?)",
+                [(layer_id, box[0], box[2], box[1], box[3])
+                 for layer_id, box in lv95.items() if box is not None])
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    os.replace(temp_file, db_file)
+    return counts
+
+
+def open_index(geoservices_csv=None, db_file=None):
+    """
+    Open the spatial index, building it first if it is missing or older
+    than the layers.
+
+    Parameters:
+    geoservices_csv (str, optional): The layers, config.GEOSERVICES_CH_CSV
+        by default.
+    db_file (str, optional): The index, config.SPATIAL_INDEX_DB by default.
+
+    Returns:
+    SpatialIndex: The index.
+    """
+    geoservices_csv = geoservices_csv or config.GEOSERVICES_CH_CSV
+    db_file = db_file or config.SPATIAL_INDEX_DB
+    if not os.path.exists(db_file) or (
+            os.path.exists(geoservices_csv) and
+            os.stat(geoservices_csv).st_mtime_ns >=
+            os.stat(db_file).st_mtime_ns):
+        build_spatial_index(geoservices_csv, db_file)
+    return SpatialIndex(db_file)
+
+
+class SpatialIndex:
+    """
+    Queries of the spatial index. Coordinates are WGS84 (lon/lat) or LV95
+    (E/N).
+
+    Parameters:
+    db_file (str): The index (config.SPATIAL_INDEX_DB).
+    """
+
+    def __init__(self, db_file):
+        self.connection = sqlite3.connect("file:%s?mode=ro" % db_file,
+                                          uri=True, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+    def close(self):
+        self.connection.close()
+
+    def query(self, xmin, ymin, xmax=None, ymax=None, crs="WGS84",
+              mode="covers"):
+        """
+        Find the layers by their bounding box.
+
+        Parameters:
+        xmin, ymin (float): A point, or the lower left corner of an area.
+        xmax, ymax (float, optional): The upper right corner of the area.
+        crs (str): "WGS84" or "LV95".
+        mode (str): "covers" for the layers whose box contains the point or
+            area, "intersects" for those whose box overlaps it.
+
+        Returns:
+        list: The ids of the layers, see layers().
+        """
+        table = CRS_TABLES[crs]
+        if xmax is None:
+            xmax, ymax = xmin, ymin
+        if mode == "covers":
+            parameters = (xmin, xmax, ymin, ymax)
+        elif mode == "intersects":
+            parameters = (xmax, xmin, ymax, ymin)
+        else:
+            raise ValueError("Unknown mode %s" % mode)
+        return [layer_id for layer_id, in self.connection.execute(
+            "SELECT layer_id FROM %s WHERE min_x <= ? AND max_x >= ? AND "
+            "min_y <= ? AND max_y >= ?" % table, parameters)]
+
+    def layers(self, layer_ids):
+        """
+        Parameters:
+        layer_ids (list): Ids returned by query().
+
+        Returns:
+        list: The layers (sqlite3.Row: owner, title, name, servicelink,
+            servicetype, bbox, bbox_source).
+        """
+        layer_ids = list(layer_ids)
+        rows = []
+        # SQLite allows at most 999 parameters per statement
+        for n in range(0, len(layer_ids), 900):
+            chunk = layer_ids[n:n + 900]
+            rows += self.connection.execute(
+                "SELECT * FROM layers WHERE layer_id IN (%s) "
+                "ORDER BY layer_id" % ",".join("?" * len(chunk)),
+                chunk).fetchall()
+        return rows
+
+    def fallback_layers(self):
+        """
+        Returns:
+        list: The ids of the layers with the extent of Switzerland instead
+            of a BBOX of their own.
+        """
+        return [layer_id for layer_id, in self.connection.execute(
+            "SELECT layer_id FROM layers WHERE bbox_source = 'fallback'")]
+
+
+if __name__ == "__main__":
+    coordinates = [float(v) for v in sys.argv[1:5]]
+    # LV95 coordinates are in the millions
+    crs = "LV95" if coordinates[0] > 1000 else "WGS84"
+    index = open_index()
+    layer_ids = index.query(*coordinates, crs=crs)
+    for layer in index.layers(layer_ids):
+        print("%s > %s: %s (%s)" % (layer["owner"], layer["servicelink"],
+                                    layer["title"], layer["name"]))
+    print("%s layers cover the %s, %s more have no BBOX of their own" % (
+        len(layer_ids), "point" if len(coordinates) == 2 else "area",
+        len(index.fallback_layers())))
+    index.close()
@@ -0,0 +1,99 @@
+"""
+Title: Text cleaner
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Normalise the free text (titles, abstracts) scraped from OGC
+    capabilities documents. Newlines and other control characters become
+    blanks and HTML fragments are removed, in a single pass with precompiled
+    patterns. Also extracts metadata URLs from abstracts.
+Notes:
+- Used by the default scraper (scraper/default.py) for every layer, so this
+  is on the hot path of a harvest
+- Run this file to benchmark it against the former two-pass implementation
+  over all titles and abstracts of a harvest:
+  python text_cleaner.py [data/geoservices_CH.csv]
+"""
+
+import re
+
+# One alternation for both jobs: an HTML fragment ("<...>", which may span
+# lines) or a single control character
+MARKUP_PATTERN = re.compile(r"<[^>]*>|[\n\r\t\f\v]")
+URL_PATTERN = re.compile(r"https?://[^\s<>\"']+")
+
+
+def _replace_markup(match):
+    # A control character is one character long, an HTML fragment at least
+    # two ("<>")
+    return " " if len(match.group()) == 1 else ""
+
+
+def clean_text(text):
+    """
+    Remove newline characters, enumeration, and HTML fragments from a string.
+
+    Parameters:
+    text (str): The string to be cleaned.
+
+    Returns:
+    str: The cleaned string, "" if text is empty or None.
+    """
+    if not text:
+        return ""
+    return MARKUP_PATTERN.sub(_replace_markup, text)
+
+
+def extract_metadata_url(text):
+    """
+    Extract the metadata link from a free text such as a layer abstract.
+
+    Parameters:
+    text (str): The text to search.
+
+    Returns:
+    str: The URL if the text contains exactly one, "" otherwise (several
+        URLs are ambiguous).
+    """
+    if not text:
+        return ""
+    urls = URL_PATTERN.findall(text)
+    return urls[0].rstrip(".,;)") if len(urls) == 1 else ""
+
+
+if __name__ == "__main__":
+    # Micro-benchmark against the former remove_newline implementation
+    import csv
+    import sys
+    import timeit
+    import configuration as config
+
+    def remove_newline_two_pass(toclean):
+        if toclean:
+            test = re.sub(r'[\n\r\t\f\v]', ' ', toclean)
+            clean = re.compile('<.*?>')
+            test = re.sub(clean, '', test)
+        else:
+            test = ""
+        return test
+
+    csv_filename = sys.argv[1] if len(sys.argv) > 1 else \
+        config.GEOSERVICES_CH_CSV
+    with open(csv_filename, mode="r", encoding="utf8") as f:
+        texts = []
+        for row in csv.DictReader(f, delimiter=",", quotechar='"',
+                                  lineterminator="\n"):
+            texts.append(row['TITLE'])
+            texts.append(row['ABSTRACT'])
+
+    assert [clean_text(t) for t in texts] == \
+        [remove_newline_two_pass(t) for t in texts]
+    repeat = 5
+    two_pass = timeit.timeit(
+        lambda: [remove_newline_two_pass(t) for t in texts],
+        number=repeat) / repeat
+    per_text = timeit.timeit(
+        lambda: [clean_text(t) for t in texts], number=repeat) / repeat
+    print("%s texts from %s" % (len(texts), csv_filename))
+    print("two-pass remove_newline: %8.1f ms" % (two_pass * 1000))
+    print("clean_text:              %8.1f ms (%.1fx)" % (
+        per_text * 1000, two_pass / per_text))
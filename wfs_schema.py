@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+Title: WFS schemas
+Author: David Oesch
+Date: 2026-10-19
+Purpose: Harvest the attribute schemas of the WFS feature types in
+    geoservices_CH.csv with DescribeFeatureType requests, asking for many
+    typeNames per request where the server allows it. Writes a compact
+    attributes table: every distinct schema once (config.WFS_ATTRIBUTES_CH_CSV)
+    and per feature type a link from its geoservices_CH.csv row (OWNER,
+    SERVICELINK, NAME) to its schema (config.WFS_FEATURETYPES_CH_CSV).
+Notes:
+- Uses Python 3.9
+- Up to config.WFS_SCHEMA_BATCH_SIZE typeNames per request. A batch the
+  server rejects (an exception report, or an HTTP error status with a body)
+  is split in halves down to single feature types, and later batches of
+  that service are no larger than the size that worked. After a transport
+  failure (e.g. a connect or read timeout) the service is given up for the
+  run: smaller requests would only wait for the same server again
+- config.WFS_SCHEMA_WORKERS requests in flight, at most
+  config.WFS_SCHEMA_HOST_CONNECTIONS of them to the same host
+- Schemas are identified by a hash of their content: the many feature types
+  sharing a schema (e.g. one per municipality) are stored once, and a
+  DescribeFeatureType document that has been parsed before is not parsed
+  again
+- Usage: python wfs_schema.py
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+import configuration as config
+
+logger = logging.getLogger("Scraping log")
+
+XSD = "{http://www.w3.org/2001/XMLSchema}"
+# Query parameters of a SERVICELINK that are replaced in the request
+REQUEST_PARAMETERS = {"service", "request", "version", "typename",
+                      "typenames"}
+FEATURETYPE_FIELDS = ["OWNER", "SERVICELINK", "NAME", "SCHEMA"]
+ATTRIBUTE_FIELDS = ["SCHEMA", "POSITION", "ATTRIBUTE", "TYPE", "NULLABLE"]
+
+
+class ServerRejection(ValueError):
+    """
+    The server answered a request with an error, an exception report or an
+    HTTP error status with a body, so a smaller request may still succeed.
+    """
+
+
+def local_name(name):
+    # "gml:PointPropertyType" -> "PointPropertyType"
+    return (name or "").split(":")[-1]
+
+
+def describe_url(service_link, type_names):
+    """
+    Parameters:
+    service_link (str): The SERVICELINK of the feature types.
+    type_names (list): The typeNames to describe.
+
+    Returns:
+    str: The DescribeFeatureType URL.
+    """
+    parts = urlparse(service_link)
+    query = [(key, value) for key, value in parse_qsl(parts.query)
+             if key.lower() not in REQUEST_PARAMETERS]
+    query += [("SERVICE", "WFS"), ("REQUEST", "DescribeFeatureType"),
+              ("VERSION", config.WFS_SCHEMA_VERSION),
+              ("TYPENAME", ",".join(type_names))]
+    return urlunparse(parts._replace(query=urlencode(query, safe=":,")))
+
+
+def sequence_attributes(complex_type):
+    """
+    Parameters:
+    complex_type (xml.etree.ElementTree.Element): An xsd:complexType.
+
+    Returns:
+    list: (attribute, type, nullable) per element of the type.
+    """
+    attributes = []
+    for element in complex_type.iter(XSD + "element"):
+        name = element.get("name") or local_name(element.get("ref"))
+        attribute_type = element.get("type")
+        if attribute_type is None:
+            # Inline simple type, e.g. a string with a maximum length
+            restriction = element.find(".//%srestriction" % XSD)
+            attribute_type = restriction.get("base") \
+                if restriction is not None else ""
+        nullable = element.get("minOccurs") == "0" or \
+            element.get("nillable") == "true"
+        attributes.append((name, local_name(attribute_type), nullable))
+    return attributes
+
+
+def parse_schema(document):
+    """
+    Parse a DescribeFeatureType response.
+
+    Parameters:
+    document (bytes): The XML schema.
+
+    Returns:
+    tuple: (attributes by feature type name without prefix, schema
+        locations of further DescribeFeatureType documents it imports)
+
+    Raises:
+    ServerRejection: If the document is no XML schema, e.g. an exception
+        report.
+    """
+    try:
+        root = ET.fromstring(document)
+    except ET.ParseError as e:
+        raise ServerRejection("No XML schema: %s" % e)
+    if root.tag != XSD + "schema":
+        raise ServerRejection("No XML schema: %s" % " ".join(
+            "".join(root.itertext()).split())[:200])
+    types = {complex_type.get("name"): sequence_attributes(complex_type)
+             for complex_type in root.findall(XSD + "complexType")}
+    features = {}
+    for element in root.findall(XSD + "element"):
+        inline_type = element.find(XSD + "complexType")
+        if inline_type is not None:
+            features[element.get("name")] = sequence_attributes(inline_type)
+        elif local_name(element.get("type")) in types:
+            features[element.get("name")] = types[local_name(
+                element.get("type"))]
+    # Servers answer for feature types of several namespaces with a schema
+    # that imports one DescribeFeatureType document per namespace
+    imports = [i.get("schemaLocation") for i in root.findall(XSD + "import")
+               if "describefeaturetype" in
+               (i.get("schemaLocation") or "").lower()]
+    return features, imports
+
+
+def schema_id(attributes):
+    # Content hash of an attribute list
+    return hashlib.sha1(json.dumps(attributes).encode("utf-8")).hexdigest()[
+        :16]
+
+
+def batches(type_names, size, service_link):
+    """
+    Split typeNames into batches of at most size names and
+    config.WFS_SCHEMA_MAX_URL_LENGTH characters of request URL.
+
+    Returns:
+    list: The batches.
+    """
+    result = [[]]
+    for type_name in type_names:
+        batch = result[-1]
+        if batch and (len(batch) >= size or len(describe_url(
+                service_link, batch + [type_name])) >
+                config.WFS_SCHEMA_MAX_URL_LENGTH):
+            result.append([])
+        result[-1].append(type_name)
+    return [batch for batch in result if batch]
+
+
+class SchemaHarvester:
+    """
+    Fetches and parses DescribeFeatureType documents, thread-safe.
+
+    Parameters:
+    transport (CapabilitiesTransport, optional): HTTP client. Without,
+        requests is used.
+    latency (HostLatency, optional): Timeouts per host.
+    """
+
+    def __init__(self, transport=None, latency=None):
+        self.transport = transport
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.host_slots = defaultdict(lambda: threading.Semaphore(
+            config.WFS_SCHEMA_HOST_CONNECTIONS))
+        self.batch_sizes = {}
+        # Transport failure by SERVICELINK of the services given up
+        self.unreachable = {}
+        # Parsed documents by content hash
+        self.documents = {}
+        self.stats = {"requests": 0, "failed_requests": 0, "batched": 0,
+                      "documents_parsed": 0, "documents_cached": 0,
+                      "services_given_up": 0}
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def fetch(self, url):
+        """
+        GET a document, with at most config.WFS_SCHEMA_HOST_CONNECTIONS
+        requests to the same host at a time.
+
+        Returns:
+        bytes: The document.
+
+        Raises:
+        ServerRejection: If the status is not 200 and there is a body.
+        Exception: If the request failed, or its status is not 200 without
+            a body.
+        """
+        host = urlparse(url).netloc
+        timeouts = self.latency.timeouts(host) \
+            if self.latency is not None else None
+        with self.lock:
+            slot = self.host_slots[host]
+        with slot:
+            self.count("requests")
+            if self.transport is not None:
+                response = self.transport.get(url, timeouts)
+            else:
+                import requests
+                timeouts = timeouts or {"connect": config.CONNECT_TIMEOUT,
+                                        "read": config.CAPABILITIES_TIMEOUT}
+                response = requests.get(url, timeout=(timeouts["connect"],
+                                                      timeouts["read"]))
+        if response.status_code != 200:
+            message = "HTTP response status code %s" % response.status_code
+            if response.content:
+                raise ServerRejection(message)
+            raise ValueError(message)
+        return response.content
+
+    def parse(self, document):
+        # parse_schema, once per distinct document
+        key = hashlib.sha1(document).hexdigest()
+        with self.lock:
+            parsed = self.documents.get(key)
+        if parsed is not None:
+            self.count("documents_cached")
+            return parsed
+        parsed = parse_schema(document)
+        self.count("documents_parsed")
+        with self.lock:
+            self.documents[key] = parsed
+        return parsed
+
+    def describe(self, service_link, type_names):
+        """
+        Describe feature types with one request, following the imports of
+        the response.
+
+        Returns:
+        dict: Attributes by feature type name without prefix.
+
+        Raises:
+        Exception: If the request failed or the response is no schema.
+        """
+        features, imports = self.parse(self.fetch(describe_url(
+            service_link, type_names)))
+        features = dict(features)
+        for location in imports:
+            features.update(self.parse(self.fetch(location))[0])
+        return features
+
+    def describe_batch(self, service_link, type_names):
+        """
+        Describe feature types, splitting the batch in halves where the
+        server rejects it. After a transport failure, the service is not
+        requested again.
+
+        Returns:
+        dict: Attributes, or the exception, by typeName.
+        """
+        with self.lock:
+            failure = self.unreachable.get(service_link)
+        if failure is not None:
+            return {type_name: failure for type_name in type_names}
+        try:
+            features = self.describe(service_link, type_names)
+        except ServerRejection as e:
+            self.count("failed_requests")
+            if len(type_names) == 1:
+                return {type_names[0]: e}
+            # E.g. no support for several typeNames, or a response too
+            # large: smaller batches from now on
+            half = (len(type_names) + 1) // 2
+            with self.lock:
+                self.batch_sizes[service_link] = min(
+                    self.batch_sizes.get(service_link,
+                                         config.WFS_SCHEMA_BATCH_SIZE), half)
+            results = {}
+            for batch in batches(type_names, half, service_link):
+                results.update(self.describe_batch(service_link, batch))
+            return results
+        except Exception as e:
+            # E.g. a connect or read timeout, a smaller batch would not help
+            self.count("failed_requests")
+            with self.lock:
+                first = service_link not in self.unreachable
+                self.unreachable.setdefault(service_link, e)
+            if first:
+                self.count("services_given_up")
+                logger.info("DescribeFeatureType %s: %s, giving up the "
+                            "service" % (service_link, e))
+            return {type_name: e for type_name in type_names}
+        if len(type_names) > 1:
+            self.count("batched")
+        if len(type_names) == 1 and len(features) == 1:
+            # Described under another name, e.g. in other case
+            return {type_names[0]: list(features.values())[0]}
+        results = {}
+        missing = []
+        for type_name in type_names:
+            attributes = features.get(local_name(type_name))
+            if attributes is None:
+                missing.append(type_name)
+            else:
+                results[type_name] = attributes
+        if len(type_names) == 1 and missing:
+            results[type_names[0]] = ValueError(
+                "Feature type not described in the response")
+        else:
+            for type_name in missing:
+                results.update(self.describe_batch(service_link, [type_name]))
+        return results
+
+    def describe_services(self, services, pool):
+        """
+        Describe the feature types of all services. A first batch per
+        service finds the batch size the server copes with, then the
+        remaining batches of all services run concurrently.
+
+        Parameters:
+        services (dict): typeNames by SERVICELINK.
+        pool (concurrent.futures.Executor): Runs the requests.
+
+        Returns:
+        dict: Attributes, or the exception, by typeName by SERVICELINK.
+        """
+        results = {service_link: {} for service_link in services}
+        remaining = {}
+        first = []
+        for service_link, type_names in services.items():
+            batch = batches(type_names, config.WFS_SCHEMA_BATCH_SIZE,
+                            service_link)[0]
+            remaining[service_link] = type_names[len(batch):]
+            first.append((service_link, pool.submit(
+                self.describe_batch, service_link, batch)))
+        rest = []
+        for service_link, future in first:
+            results[service_link].update(future.result())
+            size = self.batch_sizes.get(service_link,
+                                        config.WFS_SCHEMA_BATCH_SIZE)
+            rest += [(service_link, pool.submit(
+                self.describe_batch, service_link, batch))
+                for batch in batches(remaining[service_link], size,
+                                     service_link)]
+        for service_link, future in rest:
+            results[service_link].update(future.result())
+        return results
+
+
+def load_feature_types(geoservices_csv):
+    """
+    Parameters:
+    geoservices_csv (str): The layers (config.GEOSERVICES_CH_CSV).
+
+    Returns:
+    dict: (OWNER, typeNames) by SERVICELINK of the WFS feature types, in
+        the order of the file.
+    """
+    services = {}
+    with open(geoservices_csv, mode="r", encoding="utf8") as f:
+        for row in csv.DictReader(f, delimiter=",", quotechar='"',
+                                  lineterminator="\n"):
+            if row["SERVICETYPE"] != "WFS":
+                continue
+            owner, type_names = services.setdefault(
+                row["SERVICELINK"].strip(), (row["OWNER"], []))
+            if row["NAME"] not in type_names:
+                type_names.append(row["NAME"])
+    return services
+
+
+def harvest_schemas(geoservices_csv, featuretypes_csv, attributes_csv,
+                    latency=None):
+    """
+    Harvest the schemas of all WFS feature types and write the attributes
+    table.
+
+    Parameters:
+    geoservices_csv (str): The layers (config.GEOSERVICES_CH_CSV).
+    featuretypes_csv (str): Output, the schema of every feature type.
+    attributes_csv (str): Output, the attributes of every schema.
+    latency (HostLatency, optional): Timeouts per host.
+
+    Returns:
+    dict: Statistics for the run report: feature types described and
+        failed, distinct schemas, requests and documents parsed.
+    """
+    start = time.perf_counter()
+    services = load_feature_types(geoservices_csv)
+    try:
+        from http_transport import CapabilitiesTransport
+        transport = CapabilitiesTransport(latency=latency)
+    except Exception as e:
+        logger.error("Could not set up the %s transport, using requests: %s"
+                     % (config.HTTP_TRANSPORT, e))
+        transport = None
+    harvester = SchemaHarvester(transport, latency)
+    try:
+        with ThreadPoolExecutor(
+                max_workers=config.WFS_SCHEMA_WORKERS) as pool:
+            results = harvester.describe_services(
+                {service_link: type_names
+                 for service_link, (_, type_names) in services.items()},
+                pool)
+    finally:
+        if transport is not None:
+            transport.close()
+
+    schemas = {}
+    failed = 0
+    with open(featuretypes_csv, mode="w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f, delimiter=",", quotechar='"',
+                            lineterminator="\n")
+        writer.writerow(FEATURETYPE_FIELDS)
+        for service_link, (owner, type_names) in services.items():
+            for type_name in type_names:
+                attributes = results[service_link][type_name]
+                if isinstance(attributes, Exception):
+                    failed += 1
+                    logger.info("DescribeFeatureType %s %s: %s" % (
+                        service_link, type_name, attributes))
+                    continue
+                schema = schema_id(attributes)
+                schemas.setdefault(schema, attributes)
+                writer.writerow([owner, service_link, type_name, schema])
+    with open(attributes_csv, mode="w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f, delimiter=",", quotechar='"',
+                            lineterminator="\n")
+        writer.writerow(ATTRIBUTE_FIELDS)
+        for schema, attributes in schemas.items():
+            for position, (name, attribute_type, nullable) in enumerate(
+                    attributes):
+                writer.writerow([schema, position, name, attribute_type,
+                                 "true" if nullable else "false"])
+
+    report = dict(harvester.stats)
+    report.update({
+        "services": len(services),
+        "feature_types": sum(len(type_names)
+                             for _, type_names in services.values()),
+        "failed": failed, "schemas": len(schemas),
+        "seconds": round(time.perf_counter() - start, 1)})
+    return report
+
+
+if __name__ == "__main__":
+    report = harvest_schemas(config.GEOSERVICES_CH_CSV,
+                             config.WFS_FEATURETYPES_CH_CSV,
+                             config.WFS_ATTRIBUTES_CH_CSV)
+    print(json.dumps(report, indent=1, sort_keys=True))